@@ -0,0 +1,163 @@
+import bisect
+import time
+
+import numpy as np
+
+from Metrics import metrics
+from TapeRecorder import TapeRecorder
+from TickBuffer import TickBuffer
+
+
+class StrikeLadder:
+    """The contracts of one currency pair and expiry, kept sorted by strike.
+    A strike quoted on several watchlist rows (e.g. a contract listed twice) keeps the quotes of every row,
+    and is scanned at the best bid and the best offer among them."""
+
+    def __init__(self):
+        self.strikes = []
+        self.quotes = []  # Per strike, row to [name, bid, offer].
+        self.bids = []  # The best of the sell column: what the strike can be sold at.
+        self.offers = []  # The best of the buy column: what the strike can be bought at.
+        self.bidNames = []  # The contract with the best bid (or the first one listed) at each strike.
+        self.offerNames = []
+
+    def insert(self, strike, name, row):
+        position = bisect.bisect_left(self.strikes, strike)
+        if position == len(self.strikes) or self.strikes[position] != strike:
+            self.strikes.insert(position, strike)
+            self.quotes.insert(position, {})
+            self.bids.insert(position, np.nan)
+            self.offers.insert(position, np.nan)
+            self.bidNames.insert(position, name)
+            self.offerNames.insert(position, name)
+        self.quotes[position][row] = [name, np.nan, np.nan]
+
+    def set(self, strike, row, bid, offer):
+        position = bisect.bisect_left(self.strikes, strike)
+        quotes = self.quotes[position]
+        quotes[row][1:] = bid, offer
+        best = max((quote for quote in quotes.values() if not np.isnan(quote[1])), key=lambda quote: quote[1],
+                   default=None)
+        self.bids[position] = np.nan if best is None else best[1]
+        self.bidNames[position] = self.bidNames[position] if best is None else best[0]
+        best = min((quote for quote in quotes.values() if not np.isnan(quote[2])), key=lambda quote: quote[2],
+                   default=None)
+        self.offers[position] = np.nan if best is None else best[2]
+        self.offerNames[position] = self.offerNames[position] if best is None else best[0]
+
+    def scan(self, minimumEdge=0.0):
+        """A binary is worth less the higher its strike, so any contract bid above the offer of a lower strike
+        is an arbitrage: buy the lower strike, sell the higher one. Walks the ladder once, keeping the cheapest
+        offer below each strike, and returns the widest violation at each strike as (low, high, offer, bid)."""
+
+        violations = []
+        cheapest = None
+        for position, bid in enumerate(self.bids):
+            if cheapest is not None and bid - self.offers[cheapest] > minimumEdge:
+                violations.append((cheapest, position, self.offers[cheapest], bid))
+            if not np.isnan(self.offers[position]) and (cheapest is None or
+                                                        self.offers[position] < self.offers[cheapest]):
+                cheapest = position
+        return violations
+
+
+class ArbitrageScanner:
+    """Looks for strike-ladder arbitrage on the watchlist: for binaries on the same pair and expiry, a higher
+    strike bid above a lower strike's offer. Contracts are indexed by (pair, expiry, strike), with the strike
+    and expiry parsed once from each name, and every snapshot passed to update() only rescans the ladders
+    whose prices changed.
+
+    violations holds every current violation as a dictionary; opened has the ones that appeared on the
+    last update. minimumEdge is the smallest bid over offer (in dollars per contract) that counts."""
+
+    def __init__(self, currencyPairs=None, minimumEdge=0.0):
+        self.currencyPairs = set(currencyPairs) if currencyPairs is not None else None
+        self.minimumEdge = minimumEdge
+        self.ladders = {}  # (pair, expiry) to StrikeLadder.
+        self.keys = {}  # Contract name to (pair, expiry, strike), or None for contracts that are not scanned.
+        self.names = None
+        self.rowKeys = []
+        self.sell = None
+        self.buy = None
+        self.found = {}  # (pair, expiry) to the violations of that ladder.
+        self.violations = []
+        self.opened = []
+
+    def key(self, name):
+        """(pair, expiry, strike) of a name such as 'EUR/USD >1.0850 (3PM)', or None if it is not a pair binary."""
+
+        if name not in self.keys:
+            parts = name.split(" ")
+            try:
+                key = (parts[0], parts[-1], float(parts[-2].replace(">", "")))
+            except (IndexError, ValueError):
+                key = None
+            if key is not None and self.currencyPairs is not None and key[0] not in self.currencyPairs:
+                key = None
+            self.keys[name] = key
+        return self.keys[name]
+
+    def index(self, names):
+        """Rebuilds the ladders for a new set of watchlist rows."""
+
+        self.names = list(names)
+        self.rowKeys = [self.key(name) for name in names]
+        self.ladders = {}
+        self.found = {}
+        for row, (name, key) in enumerate(zip(names, self.rowKeys)):
+            if key is None:
+                continue
+            self.ladders.setdefault(key[:2], StrikeLadder()).insert(key[2], name, row)
+        self.sell = np.full(len(names), np.nan)
+        self.buy = np.full(len(names), np.nan)
+
+    def update(self, snapshot):
+        """Applies a snapshot (in the NadexSearch.getSnapshot form) and returns the current violations."""
+
+        with metrics.timer('arbitrage.update'):
+            reindexed = snapshot['names'] != self.names
+            if reindexed:
+                self.index(snapshot['names'])
+            sell = np.asarray(TapeRecorder.toFloats(snapshot['sell']), dtype=float)
+            buy = np.asarray(TapeRecorder.toFloats(snapshot['buy']), dtype=float)
+
+            changed = np.flatnonzero(TickBuffer.moved(self.sell, sell) | TickBuffer.moved(self.buy, buy))
+            self.sell, self.buy = sell, buy
+
+            dirty = set()
+            for row in changed.tolist():
+                key = self.rowKeys[row]
+                if key is not None:
+                    self.ladders[key[:2]].set(key[2], row, sell[row], buy[row])
+                    dirty.add(key[:2])
+
+            for group in dirty:
+                ladder = self.ladders[group]
+                self.found[group] = [{'pair': group[0], 'expiry': group[1],
+                                      'low': ladder.offerNames[low], 'high': ladder.bidNames[high],
+                                      'offer': float(offer), 'bid': float(bid), 'size': float(bid - offer)}
+                                     for low, high, offer, bid in ladder.scan(self.minimumEdge)]
+
+            if dirty or reindexed:
+                previous = {(v['low'], v['high']) for v in self.violations}
+                self.violations = sorted((v for found in self.found.values() for v in found),
+                                         key=lambda v: -v['size'])
+                self.opened = [v for v in self.violations if (v['low'], v['high']) not in previous]
+            else:
+                self.opened = []
+
+        metrics.increment('arbitrage.violations', len(self.opened))
+        if self.opened and 'timestamp' in snapshot:
+            metrics.record('arbitrage.latency', time.time() - snapshot['timestamp'])
+        return self.violations
+
+    def report(self, violations=None):
+        """Returns violations (default the current ones) as a printable table, widest first."""
+
+        violations = self.violations if violations is None else violations
+        if not violations:
+            return "No strike-ladder arbitrage."
+        lines = ["%-32s %-32s %8s %8s %8s" % ("Buy", "Sell", "Offer", "Bid", "Edge")]
+        for v in violations:
+            lines.append("%-32s %-32s %8.2f %8.2f %8.2f" % (v['low'], v['high'], v['offer'], v['bid'], v['size']))
+        return "\n".join(lines)
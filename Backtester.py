@@ -0,0 +1,210 @@
+import argparse
+import time
+
+import numpy as np
+
+from BinaryPricer import BinaryPricer
+from CurrencyOption import CurrencyOption
+from ExpiryParser import ExpiryParser
+from Metrics import metrics
+from RateCurve import RateCurve
+from TapeRecorder import TapeReplayer
+from TradingRules import TradingRules
+from VolatilitySolver import VolatilitySolver
+
+
+class Backtester:
+    """Runs TradingRules over a recorded tape in one vectorized pass.
+    The tape is loaded into (time x contract) arrays, and volatility and the binary Greeks are only solved where
+    a rule could fire. Orders fill at the recorded offer (buy) or bid (sell short). Contracts seen up to their expiry
+    settle at 100 or 0 on the last recorded underlying; the others are closed at their last recorded bid/offer.
+
+    entries='first' trades each contract at most once, like the live scheduler which unsubscribes a contract
+    after its first order; entries='changes' trades every time a contract's signal changes to buy or sell."""
+
+    columns = ('sell', 'buy', 'underlying', 'expiry')
+    trade = np.dtype([('tick', np.int64), ('timestamp', float), ('contract', np.int64), ('side', np.int8),
+                      ('price', float), ('exit', float), ('pnl', float), ('settled', bool)])
+
+    def __init__(self, exchangeRates=None, rules=None, precision=0.05, entries='first', expiredBelow=60.0,
+                 blockSize=1000000, rateCurve=None):
+        if entries not in ('first', 'changes'):
+            raise ValueError("entries must be 'first' or 'changes'.")
+        self.exchangeRates = exchangeRates or {}  # Used where no indicative price was recorded.
+        self.precision = precision
+        self.entries = entries
+        self.expiredBelow = expiredBelow/ExpiryParser.SECONDS_PER_YEAR  # Seconds left that count as expired.
+        self.blockSize = blockSize  # Contracts solved per VolatilitySolver call, to bound memory.
+        self.solver = VolatilitySolver()
+        self.rules = rules or TradingRules(payout=self.solver.payout)
+        self.binaryPricer = BinaryPricer(self.solver.payout)
+        self.rateCurve = rateCurve or RateCurve()  # Rates follow each contract's expiry along the tape.
+
+    def load(self, tape):
+        """Reads a tape (a path or a TapeReplayer) into a dictionary of arrays:
+        timestamp (T), sell, buy, underlying and expiry (T x N), and per contract name, strike and the codes of
+        its two currencies in currencies (-1 for a currency without a rate curve).
+        Cells of contracts that were not on the watchlist at a tick are NaN."""
+
+        with metrics.timer('backtest.load'):
+            replayer = tape if isinstance(tape, TapeReplayer) else TapeReplayer(tape)
+            try:
+                names = [replayer.names[contractId] for contractId in range(len(replayer.names))]
+                data = {column: np.full((len(replayer), len(names)), np.nan) for column in self.columns}
+                for i in range(len(replayer)):
+                    rows, _ = replayer.rows(i)
+                    ids = rows['id']
+                    for column in self.columns:
+                        data[column][i, ids] = rows[column]
+                rows = ids = None  # Views into the tape, which has to be released before it is closed.
+                data['timestamp'] = np.array(replayer.tickTimes, dtype=float)
+            finally:
+                if replayer is not tape:
+                    replayer.close()
+
+        strikes, domesticCode, foreignCode, rates = [], [], [], []
+        currencies = sorted(currency for currency in {c for name in names for c in CurrencyOption.parseName(name)[1]}
+                            if currency in self.rateCurve)
+        codes = {currency: code for code, currency in enumerate(currencies)}
+        for name in names:
+            strike, countries = CurrencyOption.parseName(name)
+            strikes.append(strike)
+            domesticCode.append(codes.get(countries[0], -1))
+            foreignCode.append(codes.get(countries[1], -1))
+            rates.append(self.exchangeRates.get("/".join(countries), np.nan))
+
+        data['underlying'] = np.where(np.isnan(data['underlying']), np.array(rates), data['underlying'])
+        data['names'] = names
+        data['strike'] = np.array(strikes)
+        data['currencies'] = currencies
+        data['domesticCode'] = np.array(domesticCode, dtype=np.int64)
+        data['foreignCode'] = np.array(foreignCode, dtype=np.int64)
+        return data
+
+    def binaryGreeks(self, data):
+        """Binary value and delta (see BinaryPricer) at every tick where the rules need them, NaN elsewhere."""
+
+        buy, underlying, expiry = data['buy'], data['underlying'], data['expiry']
+        value = np.full(buy.shape, np.nan)
+        delta = np.full(buy.shape, np.nan)
+        ticks, contracts = np.nonzero(self.rules.candidates(buy, data['sell'], data['strike'], underlying))
+
+        for start in range(0, len(ticks), self.blockSize):
+            t, c = ticks[start:start + self.blockSize], contracts[start:start + self.blockSize]
+            strike = data['strike'][c]
+            r_domestic, domesticDiscount = self.rateCurve.lookupEach(data['currencies'], data['domesticCode'][c],
+                                                                     expiry[t, c])
+            r_foreign = self.rateCurve.lookupEach(data['currencies'], data['foreignCode'][c], expiry[t, c])[0]
+            volatility, d1, d2, converged = self.solver.solve(buy[t, c], strike, underlying[t, c], expiry[t, c],
+                                                              r_domestic, r_foreign, self.precision,
+                                                              discount=domesticDiscount)
+            greeks = self.binaryPricer.compute(underlying[t, c], strike, expiry[t, c], volatility,
+                                               r_domestic, r_foreign, domesticDiscount)
+            value[t, c] = greeks['price']
+            delta[t, c] = greeks['delta']
+
+        metrics.increment('backtest.solved', len(ticks))
+        return value, delta
+
+    def signals(self, data):
+        """The TradingRules signal of every contract at every tick, as an int8 (T x N) array."""
+
+        with metrics.timer('backtest.signals'):
+            return self.rules.signals(data['buy'], data['sell'], data['strike'], data['underlying'],
+                                      *self.binaryGreeks(data))
+
+    def entryPoints(self, signals):
+        """Returns the (tick, contract) indices where orders are placed."""
+
+        trading = signals != TradingRules.NONE
+        if self.entries == 'first':
+            contracts = np.nonzero(trading.any(axis=0))[0]
+            return trading[:, contracts].argmax(axis=0), contracts
+
+        changed = trading.copy()
+        changed[1:] &= signals[1:] != signals[:-1]
+        return np.nonzero(changed)
+
+    def exits(self, data):
+        """Per contract: the settlement or closing bid and offer, and whether the contract settled."""
+
+        sell, buy, expiry = data['sell'], data['buy'], data['expiry']
+        ticks = np.arange(len(expiry))
+        lastExpiry = np.where(np.isfinite(expiry), ticks[:, None], -1).max(axis=0)
+        lastPriced = np.where(np.isfinite(sell) & np.isfinite(buy), ticks[:, None], -1).max(axis=0)
+        contracts = np.arange(expiry.shape[1])
+
+        with np.errstate(invalid='ignore'):
+            settled = (lastExpiry >= 0) & (expiry[np.maximum(lastExpiry, 0), contracts] <= self.expiredBelow)
+            inTheMoney = data['underlying'][np.maximum(lastExpiry, 0), contracts] > data['strike']
+        settlement = np.where(inTheMoney, 100.0, 0.0)
+
+        closingBid = np.where(lastPriced >= 0, sell[np.maximum(lastPriced, 0), contracts], np.nan)
+        closingOffer = np.where(lastPriced >= 0, buy[np.maximum(lastPriced, 0), contracts], np.nan)
+        return np.where(settled, settlement, closingBid), np.where(settled, settlement, closingOffer), settled
+
+    def run(self, tape):
+        """Backtests the rules over a tape (path, TapeReplayer or the dictionary returned by load).
+        Returns a dictionary with every trade, P&L and trade count per contract, total P&L and hit rate."""
+
+        start = time.perf_counter()
+        data = tape if isinstance(tape, dict) else self.load(tape)
+        signals = self.signals(data)
+        ticks, contracts = self.entryPoints(signals)
+        exitBid, exitOffer, settled = self.exits(data)
+
+        trades = np.zeros(len(ticks), dtype=self.trade)
+        side = signals[ticks, contracts]
+        trades['tick'] = ticks
+        trades['timestamp'] = data['timestamp'][ticks]
+        trades['contract'] = contracts
+        trades['side'] = side
+        trades['price'] = np.where(side == TradingRules.BUY, data['buy'][ticks, contracts], data['sell'][ticks, contracts])
+        trades['exit'] = np.where(side == TradingRules.BUY, exitBid[contracts], exitOffer[contracts])
+        trades['pnl'] = side*(trades['exit'] - trades['price'])
+        trades['settled'] = settled[contracts]
+
+        contractCount = len(data['names'])
+        closed = np.isfinite(trades['pnl'])
+        results = {'names': data['names'],
+                   'trades': trades,
+                   'tradesPerContract': np.bincount(contracts, minlength=contractCount),
+                   'pnlPerContract': np.bincount(contracts[closed], trades['pnl'][closed], minlength=contractCount),
+                   'totalPnl': float(trades['pnl'][closed].sum()),
+                   'hitRate': float((trades['pnl'][closed] > 0).mean()) if closed.any() else 0.0,
+                   'ticks': len(data['timestamp']),
+                   'contracts': contractCount,
+                   'seconds': time.perf_counter() - start}
+        metrics.record('backtest.run', results['seconds'])
+        return results
+
+    def report(self, results, top=20):
+        """Returns the results as a printable summary, with the contracts that traded most."""
+
+        trades = results['trades']
+        lines = ["%d ticks x %d contracts in %.3f seconds." % (results['ticks'], results['contracts'], results['seconds']),
+                 "Trades: %d (%d settled)   P&L: %.2f   Hit rate: %.1f%%" % (len(trades), trades['settled'].sum(),
+                                                                           results['totalPnl'], 100*results['hitRate'])]
+        traded = np.nonzero(results['tradesPerContract'])[0]
+        if len(traded):
+            lines.append("\n%-40s %8s %10s" % ("Contract", "Trades", "P&L"))
+            for c in traded[np.argsort(-results['tradesPerContract'][traded], kind='stable')][:top]:
+                lines.append("%-40s %8d %10.2f" % (results['names'][c], results['tradesPerContract'][c],
+                                                   results['pnlPerContract'][c]))
+        return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtests the analyzeData rules over a recorded tape.")
+    parser.add_argument('tape')
+    parser.add_argument('--entries', choices=('first', 'changes'), default='first')
+    parser.add_argument('--top', type=int, default=20, help="Contracts to list.")
+    parser.add_argument('--rates', help="Rate curve file (see RateCurve); flat default rates if not given.")
+    args = parser.parse_args()
+
+    backtester = Backtester(entries=args.entries, rateCurve=RateCurve(args.rates))
+    print(backtester.report(backtester.run(args.tape), args.top))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import numpy as np
+
+
+class BinaryPricer:
+    """Prices Nadex binaries as cash-or-nothing calls: payout dollars at expiry if the underlying is above the strike.
+    value = payout*exp(-r_domestic*T)*N(d2), with d1 and d2 as in Garman-Kohlhagen.
+    Every input may be a NumPy array, so a whole watchlist is priced in one call; the Greeks share
+    the discount factor, N(d2) and the normal density, which are evaluated once."""
+
+    SQRT_TWOPI = np.sqrt(2*np.pi)
+    fields = ('price', 'delta', 'gamma', 'vega', 'theta')
+
+    def __init__(self, payout=100.0):
+        self.payout = payout
+
+    def d1d2(self, underlying, strike, expiry, volatility, r_domestic, r_foreign):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            deviation = volatility*np.sqrt(expiry)
+            d1 = (np.log(underlying/strike) + (r_domestic - r_foreign)*expiry)/deviation + 0.5*deviation
+            return d1, d1 - deviation
+
+    def price(self, underlying, strike, expiry, volatility, r_domestic, r_foreign):
+        """Value of one binary in dollars."""
+
+        from scipy.special import ndtr
+
+        d1, d2 = self.d1d2(underlying, strike, expiry, volatility, r_domestic, r_foreign)
+        return self.payout*np.exp(-r_domestic*np.asarray(expiry, dtype=float))*ndtr(d2)
+
+    def compute(self, underlying, strike, expiry, volatility, r_domestic, r_foreign, discount=None):
+        """Returns a dictionary of arrays, one entry per name in BinaryPricer.fields:
+        price, delta and gamma (per unit of underlying), vega (per unit of volatility)
+        and theta (per year of time passing). discount, exp(-r_domestic*expiry), is computed if not given
+        (e.g. from a RateCurve)."""
+
+        from scipy.special import ndtr
+
+        underlying, strike, expiry, volatility, r_domestic, r_foreign = np.broadcast_arrays(
+            *[np.asarray(a, dtype=float) for a in (underlying, strike, expiry, volatility, r_domestic, r_foreign)])
+        d1, d2 = self.d1d2(underlying, strike, expiry, volatility, r_domestic, r_foreign)
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            sqrtExpiry = np.sqrt(expiry)
+            deviation = volatility*sqrtExpiry
+            discounted = self.payout*(np.exp(-r_domestic*expiry) if discount is None else discount)
+            price = discounted*ndtr(d2)
+            density = discounted*np.exp(-0.5*d2*d2)/self.SQRT_TWOPI  # discounted*n(d2)
+            delta = density/(underlying*deviation)
+            # How fast d2 moves as time passes (minus its derivative with respect to time to expiry).
+            d2Decay = d1/(2*expiry) - (r_domestic - r_foreign)/deviation
+
+            return {'price': price,
+                    'delta': delta,
+                    'gamma': -delta*d1/(underlying*deviation),
+                    'vega': -density*d1/volatility,
+                    'theta': r_domestic*price + density*d2Decay}
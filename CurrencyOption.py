@@ -1,60 +1,120 @@
-from math import exp, log, sqrt, pi
-from scipy.stats import norm
-from multiprocessing import Process
+from math import pi
+
+import numpy as np
+
+
+def column(name, doc=None, convert=float):
+    """A CurrencyOption attribute stored in the OptionBook column called name."""
+
+    def get(self):
+        return convert(getattr(self.book, name)[self.row])
+
+    def set(self, value):
+        getattr(self.book, name)[self.row] = value
+
+    return property(get, set, doc=doc)
 
 
 class CurrencyOption:
+    """One contract of an OptionBook. Only the book and the row are stored here;
+    every field is read from and written to the book's columns, so views are cheap to make and pass around."""
+
+    __slots__ = ('book', 'row')
+
     TWOPI = 2*pi
+    # Flat rates RateCurve falls back on for currencies without a curve file entry.
     riskFreeRates = {'AUD': 0.0371, 'CAD': 0.0225, 'CHF': 0.0075, 'EUR': 0.0256,
                      'GBP': 0.0256, 'JPY': 0.0057, 'USD': 0.0252}
 
-    def __init__(self, name, buy, sell, exchangeRate, expireTime, indicative, pipe, buyHistory, sellHistory, underlyingHistory):
-
-        self.name = name
-        self.buyPrice = buy
-        self.sellPrice = sell
-
-        self.buyHistory = buyHistory
-        self.sellHistory = sellHistory
-        self.underlyingHistory = underlyingHistory
-
-        self.expiry = expireTime
-        self.doExpiry = None
-        if isinstance(indicative, float):
-            self.underlying = indicative
-            self.doExpiry = True
-        else:
-            self.underlying = exchangeRate
-            self.doExpiry = False
-        self.updateProcess = Process(target=self.updateFields, args=(pipe))
-        self.updateProcess.start()
-
-        self.strike = float(name.split(" ")[-2].replace(">", ""))
-        self.countries = [c for c in name.split(" ")[0].split("/")]
-        self.conversionFactor = 1/self.underlying
-        self.r_domestic = self.riskFreeRates[self.countries[0]]
-        self.r_foreign = self.riskFreeRates[self.countries[1]]
-
-        self.d1 = 0  # Will be set to correct value from function call below.
-        self.d2 = 0
-        self.d1Squared = 0
-        self.d1d2 = 0
-        self.d2Squared = 0
-        self.volatility = self.calculateVolatility(0.05)
-
-    def updateFields(self, pipe):
-        """Updates the buy, sell, expire time, and underlying value for the option."""
-
-        while self.doExpiry:
-            self.sellPrice = pipe.recv()[0][-1]
-            self.buyPrice = pipe.recv()[1][-1]
-            self.expiry = pipe.recv()[2]
-            self.underlying = pipe.recv()[3]
-
-        while not self.doExpiry:
-            self.buyPrice = self.buyHistory[-1]
-            self.sellPrice = self.sellHistory[-1]
-            self.underlying = self.underlyingHistory
+    buyPrice = column('buy')
+    sellPrice = column('sell')
+    underlying = column('underlying')
+    expiry = column('expiry')
+    strike = column('strike')
+    r_domestic = column('r_domestic')
+    r_foreign = column('r_foreign')
+    volatility = column('volatility')
+    d1 = column('d1')
+    d2 = column('d2')
+    converged = column('converged', convert=bool)
+    doExpiry = column('doExpiry', "Whether the underlying follows the indicative price.", bool)
+    index = column('tickIndex', "This option's column in the book's TickBuffer.", int)
+
+    def __init__(self, book, row):
+        self.book = book
+        self.row = row
+
+    def __repr__(self):
+        return "CurrencyOption(" + repr(self.name) + ")"
+
+    @staticmethod
+    def parseName(name):
+        """Returns the strike and the two currencies of a contract name such as 'EUR/USD >1.0850 (3PM)'."""
+
+        return float(name.split(" ")[-2].replace(">", "")), [c for c in name.split(" ")[0].split("/")]
+
+    @property
+    def name(self):
+        return self.book.names[self.row]
+
+    @property
+    def countries(self):
+        return self.book.countries[self.row]
+
+    @property
+    def tickBuffer(self):
+        return self.book.tickBuffer
+
+    @property
+    def tickTime(self):
+        """When the tick last read by refresh() was recorded, or None."""
+
+        tickTime = self.book.tickTime[self.row]
+        return None if np.isnan(tickTime) else float(tickTime)
+
+    @property
+    def conversionFactor(self):
+        return 1/self.underlying
+
+    @property
+    def d1Squared(self):
+        return self.d1*self.d1
+
+    @property
+    def d1d2(self):
+        return self.d1*self.d2
+
+    @property
+    def d2Squared(self):
+        return self.d2*self.d2
+
+    @property
+    def greeksCache(self):
+        """The cached Greeks as a dictionary, or None if they have to be computed again. Set to None to clear."""
+
+        if not self.book.greeksValid[self.row]:
+            return None
+        return dict(zip(self.book.greeksEngine.fields, self.book.greekValues[:, self.row].tolist()))
+
+    @greeksCache.setter
+    def greeksCache(self, value):
+        if value is not None:
+            raise ValueError("The Greeks are cached by the OptionBook; greeksCache can only be cleared.")
+        self.book.greeksValid[self.row] = False
+
+    @property
+    def binaryGreeksCache(self):
+        """The cached binary Greeks (see binaryGreeks) as a dictionary, or None, like greeksCache."""
+
+        if not self.book.greeksValid[self.row]:
+            return None
+        return dict(zip(self.book.binaryPricer.fields, self.book.binaryValues[:, self.row].tolist()))
+
+    def refresh(self):
+        """Updates the buy, sell, expire time, and underlying value for the option from the latest tick.
+        Returns the time the tick was recorded, or None if there is no tick yet."""
+
+        return self.book.refresh([self.row])
 
     def convertUnits(self):
         """Returns the correct conversion factor, aka exchange rate, for the given currencies."""
@@ -62,129 +122,144 @@ class CurrencyOption:
         return 1.0/self.underlying
 
     def calculateVolatility(self, precision):
-        """Calculates volatility using the bisection method on the Garman-Kohlhagen model.
+        """Calculates volatility with the book's VolatilitySolver, by default as a cash-or-nothing binary.
         This function is also responsible for calculating d1 and d2.
         Unit problems have mostly been ironed out, but there may be some left."""
 
-        low = 0.01
-        high = 300.0
+        with self.book.lock:  # The inputs and the result belong to the same state of the row.
+            self.book.updateRates([self.row])
+            previous = self.volatility if self.converged else float('nan')  # Warm start from the last solve.
+            volatility, d1, d2, converged, warm = self.book.solver.resolve(self.buyPrice, self.strike,
+                                                                           self.underlying, self.expiry,
+                                                                           self.r_domestic, self.r_foreign,
+                                                                           previous, precision,
+                                                                           self.book.domesticDiscount[self.row])
+            self.setVolatility(float(volatility), float(d1), float(d2), bool(converged))
+            return self.volatility
 
-        while True:
-            self.volatility = (high + low)/2.0
+    def setVolatility(self, volatility, d1, d2, converged=True):
+        """Stores a volatility solved elsewhere (e.g. by VolatilitySolver for the whole watchlist)."""
 
-            self.d1 = ((log(self.underlying/self.strike) + (self.r_domestic - self.r_foreign + 0.5*self.volatility*self.volatility)*self.expiry) / (self.volatility*sqrt(self.expiry)))
+        self.book.setVolatility([self.row], volatility, d1, d2, converged)
 
-            value = exp(-self.r_domestic*self.expiry)*norm.cdf(self.d1, 0, 1)*self.buyPrice*self.conversionFactor
+#   """  GREEKS      """
 
-            if (abs(self.buyPrice - value) <= precision) or (high <= 0.1) or (low >= 299.9):
-                break
-            elif value < self.buyPrice:
-                low = self.volatility
-            elif value > self.buyPrice:
-                high = self.volatility
+    def greeks(self):
+        """Returns every Greek at once as a dictionary.
+        Computed once and cached in the book; if the price, underlying or expiry has moved since the volatility
+        was solved (see OptionBook.stale), the volatility is solved again and the Greeks are recomputed.
+        While trading, NadexSearch.solveTick has done both for the whole book by the time this is called."""
 
-        self.d2 = self.d1 - self.volatility*sqrt(self.expiry)
-        self.d1Squared = self.d1*self.d1
-        self.d1d2 = self.d1*self.d2
-        self.d2Squared = self.d2*self.d2
+        values = self.book.greeks([self.row])
+        return {field: float(value[0]) for field, value in values.items()}
 
-        return self.volatility
+    def binaryGreeks(self):
+        """Returns the binary price, delta, gamma, vega and theta as a dictionary (see BinaryPricer).
+        These are the Greeks of the $100 binary itself, unlike the Garman-Kohlhagen ones of greeks(),
+        and are what the trading rules use. They are cached in the book together with greeks()."""
 
-#   """  GREEKS      """
+        values = self.book.binaryGreeks([self.row])
+        return {field: float(value[0]) for field, value in values.items()}
+
+    @classmethod
+    def batchGreeks(cls, options):
+        """Computes the Greeks of many options of one book in one vectorized call.
+        Returns a dictionary of arrays in the order of options, and fills the book's cache."""
+
+        if not options:
+            return {}
+        book = options[0].book
+        return book.greeks(book.rowsOf(options))
 
     def printGreeks(self):
         """Simply calculates all of the major Greeks and prints them out.
         Used for debugging purposes."""
 
+        greeks = self.greeks()
         print("d1 =\t\t\t", self.d1)
         print("d2 =\t\t\t", self.d2)
         print("Volatility =\t", self.volatility)
-        print("Delta (call) =\t", self.delta(short=False))
-        print("Delta (put) =\t", self.delta(short=True))
-        print("Leverage (call) =\t", self.leverage(short=False))
-        print("Leverage (put) =\t", self.leverage(short=True))
-        print("Theta (call)=\t", self.theta(short=False))
-        print("Theta (put)=\t", self.theta(short=True))
-        print("Vega =\t\t\t", self.vega())
-        print("Rho (call)=\t\t", self.rho(short=True))
-        print("Rho (put)=\t\t", self.rho(short=False))
-        print("Gamma =\t\t\t", self.gamma())
-        print("Vanna =\t\t\t", self.vanna())
-        print("Vomma =\t\t\t", self.vomma())
-        print("Speed =\t\t\t", self.speed())
-        print("Zomma =\t\t\t", self.zomma())
-        print("Ultima =\t\t", self.ultima())
+        print("Delta (call) =\t", greeks['deltaCall'])
+        print("Delta (put) =\t", greeks['deltaPut'])
+        print("Leverage (call) =\t", greeks['leverageCall'])
+        print("Leverage (put) =\t", greeks['leveragePut'])
+        print("Theta (call)=\t", greeks['thetaCall'])
+        print("Theta (put)=\t", greeks['thetaPut'])
+        print("Vega =\t\t\t", greeks['vega'])
+        print("Rho (call)=\t\t", greeks['rhoCall'])
+        print("Rho (put)=\t\t", greeks['rhoPut'])
+        print("Gamma =\t\t\t", greeks['gamma'])
+        print("Vanna =\t\t\t", greeks['vanna'])
+        print("Vomma =\t\t\t", greeks['vomma'])
+        print("Speed =\t\t\t", greeks['speed'])
+        print("Zomma =\t\t\t", greeks['zomma'])
+        print("Ultima =\t\t", greeks['ultima'])
+
+        binary = self.binaryGreeks()
+        print("Binary value =\t", binary['price'])
+        print("Binary delta =\t", binary['delta'])
+        print("Binary gamma =\t", binary['gamma'])
+        print("Binary vega =\t", binary['vega'])
+        print("Binary theta =\t", binary['theta'])
 
     def delta(self, short=False):
         """Derivative of the value with respect to the underlying."""
 
-        if short:
-            return -exp(-self.r_foreign * self.expiry) * norm.cdf(-self.d1)
-        else:
-            return exp(-self.r_foreign * self.expiry) * norm.cdf(self.d1)
+        return self.greeks()['deltaPut' if short else 'deltaCall']
 
     def leverage(self, short=False):
         """Delta * underlying/price."""
 
-        if short:
-            return -exp(-self.r_foreign * self.expiry) * norm.cdf(-self.d1) * (self.underlying/self.strike)
-        else:
-            return exp(-self.r_foreign * self.expiry) * norm.cdf(self.d1) * (self.underlying/self.strike)
+        return self.greeks()['leveragePut' if short else 'leverageCall']
 
     def theta(self, short=False):
         """Minus one times the derivative of value with respect to time."""
 
-        if short:
-            return (-exp(-self.r_foreign * self.expiry - (self.d1Squared)/2) * self.underlying * self.volatility/(2*sqrt(self.TWOPI*self.expiry)))-(self.r_foreign*exp(-self.r_foreign*self.expiry)*norm.cdf(-self.d1))+(self.r_domestic*exp(self.r_domestic*self.expiry)*self.strike*norm.cdf(-self.d2))
-        else:
-            return (-exp(-self.r_foreign * self.expiry - (self.d1Squared)/2) * self.underlying * self.volatility/(2*sqrt(self.TWOPI*self.expiry)))+(self.r_foreign*exp(-self.r_foreign*self.expiry)*norm.cdf(self.d1))-(self.r_domestic*exp(self.r_domestic*self.expiry)*self.strike*norm.cdf(self.d2))
+        return self.greeks()['thetaPut' if short else 'thetaCall']
 
     def vega(self):
         """Derivative of value with respect to volatility."""
 
-        return exp(-self.r_foreign * self.expiry - (self.d1Squared)/2)*self.underlying*sqrt(self.expiry/(self.TWOPI))
+        return self.greeks()['vega']
 
     def rho(self, short=False):
         """Derivative of value with respect to the interest rate."""
 
-        if short:
-            return -self.expiry * exp(-self.r_domestic*self.expiry) * self.strike * norm.cdf(-self.d2)
-        else:
-            return self.expiry * exp(-self.r_domestic*self.expiry) * self.strike * norm.cdf(self.d2)
+        return self.greeks()['rhoPut' if short else 'rhoCall']
 
     def gamma(self):
         """Derivative of delta with respect to underlying.
         Second Derivative of with value respect to underlying."""
 
-        return exp(-self.r_foreign * self.expiry - (self.d1Squared)/2)/(self.underlying * self.volatility * sqrt(self.TWOPI*self.expiry))
+        return self.greeks()['gamma']
 
     def vanna(self):
         """Derivative of delta with respect to volatility.
         Derivative of vega with respect to underlying.
         Second Derivative of value with respect once to underlying and volatility."""
 
-        return -exp(-self.r_foreign * self.expiry - (self.d1Squared)/2) * self.d2 /(self.volatility * sqrt(self.TWOPI))
+        return self.greeks()['vanna']
 
     def vomma(self):
         """Derivative of vega with respect to volatility.
         Second Derivative of value with respect to volatility."""
 
-        return self.underlying * exp(-self.r_foreign * self.expiry - (self.d1Squared)/2) * sqrt(self.expiry) * self.d1d2 / self.volatility
+        return self.greeks()['vomma']
 
     def speed(self):
         """Derivative of gamma with respect to underlying.
         Third Derivative of value with respect to underlying."""
 
-        return -((exp(-self.r_foreign * self.expiry - (self.d1Squared)/2)/(self.underlying * self.volatility * sqrt(self.TWOPI*self.expiry)))/self.underlying) * (1 + self.d1/(self.volatility*sqrt(self.expiry)))
+        return self.greeks()['speed']
 
     def zomma(self):
         """Derivative of gamma with respect to volatility.
         Third Derivative of value with respect twice to underlying and once to volatility."""
 
-        return (exp(-self.r_foreign * self.expiry - (self.d1Squared)/2)/(self.underlying * self.volatility * sqrt(self.TWOPI*self.expiry))) * ((self.d1d2 -1)/self.volatility)
+        return self.greeks()['zomma']
 
     def ultima(self):
         """Derivative of vomma with respect to volatility.
         Third Derivative of value with respect to volatility."""
 
-        return ((-exp(-self.r_foreign*self.expiry - self.d1Squared/2)*self.underlying*sqrt(self.expiry/self.TWOPI))/(self.volatility*self.volatility)) * (self.d1d2*(1 - self.d1d2) + self.d1Squared + self.d2Squared)
+        return self.greeks()['ultima']
@@ -0,0 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import queue
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+class ConnectionPool:
+    """Keeps a few persistent HTTP connections to one host so requests don't reconnect every time."""
+
+    def __init__(self, baseUrl, size=10, timeout=5.0):
+        parts = urlsplit(baseUrl)
+        self.connectionClass = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.timeout = timeout
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def get(self, path):
+        """Returns (status, body) of a GET request. Connections that fail are dropped, not reused."""
+
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            connection = self.connectionClass(self.host, self.port, timeout=self.timeout)
+
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            body = response.read().decode("utf-8", errors="replace")
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            raise
+
+        try:
+            self.idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+        return response.status, body
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class YahooRateSource:
+    """Reads exchange rates from Yahoo quote pages.
+    baseUrl can point at a local stand-in server serving the same markup."""
+
+    def __init__(self, baseUrl='http://finance.yahoo.com', poolSize=10, timeout=5.0):
+        self.pool = ConnectionPool(baseUrl, poolSize, timeout)
+        self.patterns = {}
+
+    def fetch(self, pair):
+        """Returns the rate for a pair like 'EUR/USD', or None if the page has no quote."""
+
+        pair = pair.replace("/", "")
+        pattern = self.patterns.get(pair)
+        if pattern is None:
+            pattern = self.patterns[pair] = re.compile('<span id="yfs_l10_' + pair.lower() + '=x">(.+?)</span>')
+
+        status, html = self.pool.get('/q?s=' + pair + '=X')
+        match = pattern.search(html) if status == 200 else None
+        if match is None:
+            return None
+        return float(match.group(1).replace(',', ''))
+
+    def close(self):
+        self.pool.close()
+
+
+class ExchangeRateProvider:
+    """Fetches exchange rates for many pairs concurrently and caches them for ttl seconds.
+    Failed fetches are retried with exponential backoff until the deadline, after which the last known
+    rate is used if there is one. The source is any object with a fetch(pair) method."""
+
+    def __init__(self, source=None, ttl=60.0, workers=10, backoff=0.1, deadline=10.0):
+        self.source = source if source is not None else YahooRateSource()
+        self.ttl = ttl
+        self.workers = workers
+        self.backoff = backoff
+        self.deadline = deadline
+        self.cache = {}  # pair -> (rate, time fetched)
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def getRate(self, pair):
+        return self.getRates((pair,)).get(pair)
+
+    def getRates(self, pairs):
+        """Returns {pair: rate} for every pair that could be fetched or is cached."""
+
+        now = time.time()
+        rates = {}
+        stale = []
+        with self.lock:
+            for pair in pairs:
+                cached = self.cache.get(pair)
+                if cached is not None and now - cached[1] < self.ttl:
+                    rates[pair] = cached[0]
+                else:
+                    stale.append(pair)
+
+        deadline = now + self.deadline
+        for pair, rate in zip(stale, self.executor.map(lambda p: self.fetchWithRetry(p, deadline), stale)):
+            with self.lock:
+                if rate is not None:
+                    self.cache[pair] = (rate, time.time())
+                elif pair in self.cache:
+                    rate = self.cache[pair][0]
+            if rate is not None:
+                rates[pair] = rate
+
+        return rates
+
+    def fetchWithRetry(self, pair, deadline):
+        """Returns the fetched rate, or None if the deadline passed first."""
+
+        delay = self.backoff
+        while True:
+            try:
+                rate = self.source.fetch(pair)
+            except (OSError, http.client.HTTPException, ValueError):
+                rate = None
+            if rate is not None:
+                return rate
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            time.sleep(min(delay, remaining))
+            delay *= 2
+
+    def invalidate(self):
+        with self.lock:
+            self.cache.clear()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        if hasattr(self.source, 'close'):
+            self.source.close()
@@ -0,0 +1,44 @@
+import numpy as np
+
+
+class ExpiryParser:
+    """Converts the watchlist's time-to-expiry cells ("1h:05m", "12m:30s", "45s", "-") to years.
+    The same few strings show up on many rows and on every tick, so each distinct string is only parsed once."""
+
+    SECONDS_PER_YEAR = 31536000.0
+    unitSeconds = {'d': 86400.0, 'h': 3600.0, 'm': 60.0, 's': 1.0}
+
+    def __init__(self, maxCacheSize=100000):
+        self.cache = {}
+        self.maxCacheSize = maxCacheSize
+
+    def parse(self, text):
+        """Returns the time to expiry in years, or NaN for '-' and anything unrecognised."""
+
+        try:
+            return self.cache[text]
+        except KeyError:
+            pass
+
+        years = np.nan
+        cell = text.replace(" ", "")
+        if cell and cell != '-':
+            seconds = 0.0
+            for part in cell.split(':'):
+                unit = self.unitSeconds.get(part[-1:])
+                if unit is None or not part[:-1].isdigit():
+                    seconds = None
+                    break
+                seconds += int(part[:-1])*unit
+            if seconds is not None:
+                years = seconds/self.SECONDS_PER_YEAR
+
+        if len(self.cache) >= self.maxCacheSize:
+            self.cache.clear()
+        self.cache[text] = years
+        return years
+
+    def parseAll(self, texts):
+        """Returns a float array of years, one entry per cell."""
+
+        return np.fromiter((self.parse(t) for t in texts), dtype=float, count=len(texts))
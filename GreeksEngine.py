@@ -0,0 +1,60 @@
+import numpy as np
+
+
+class GreeksEngine:
+    """Computes every Garman-Kohlhagen Greek in one pass.
+    The exponentials, square roots and normal CDFs the Greeks have in common are evaluated once,
+    and every input may be a NumPy array so the whole watchlist can be done in a single call."""
+
+    TWOPI = 2*np.pi
+    fields = ('deltaCall', 'deltaPut', 'leverageCall', 'leveragePut', 'thetaCall', 'thetaPut', 'vega',
+              'rhoCall', 'rhoPut', 'gamma', 'vanna', 'vomma', 'speed', 'zomma', 'ultima')
+
+    def compute(self, underlying, strike, expiry, volatility, d1, d2, r_domestic, r_foreign,
+                domesticDiscount=None, foreignDiscount=None):
+        """Returns a dictionary of arrays, one entry per name in GreeksEngine.fields.
+        Formulas are the same as the individual methods of CurrencyOption. The discount factors
+        exp(-r*expiry) are computed if not given (e.g. from a RateCurve)."""
+
+        from scipy.special import ndtr
+
+        underlying, strike, expiry, volatility, d1, d2, r_domestic, r_foreign = np.broadcast_arrays(
+            *[np.asarray(a, dtype=float) for a in (underlying, strike, expiry, volatility, d1, d2, r_domestic, r_foreign)])
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            sqrtExpiry = np.sqrt(expiry)
+            sqrtTwoPiExpiry = np.sqrt(self.TWOPI*expiry)
+            if foreignDiscount is None:
+                foreignDiscount = np.exp(-r_foreign*expiry)
+            if domesticDiscount is None:
+                domesticDiscount = np.exp(-r_domestic*expiry)
+            d1Squared = d1*d1
+            d1d2 = d1*d2
+            kernel = foreignDiscount*np.exp(-d1Squared/2)
+
+            cdf = ndtr(np.stack((d1, -d1, d2, -d2)))
+            nd1, nMinusD1, nd2, nMinusD2 = cdf[0], cdf[1], cdf[2], cdf[3]
+
+            deltaCall = foreignDiscount*nd1
+            deltaPut = -foreignDiscount*nMinusD1
+            moneyness = underlying/strike
+            decay = -kernel*underlying*volatility/(2*sqrtTwoPiExpiry)
+            domesticCarry = r_domestic*strike/domesticDiscount  # r_domestic*exp(r_domestic*expiry)*strike
+            vega = kernel*underlying*sqrtExpiry/np.sqrt(self.TWOPI)
+            gamma = kernel/(underlying*volatility*sqrtTwoPiExpiry)
+
+            return {'deltaCall': deltaCall,
+                    'deltaPut': deltaPut,
+                    'leverageCall': deltaCall*moneyness,
+                    'leveragePut': deltaPut*moneyness,
+                    'thetaCall': decay + r_foreign*foreignDiscount*nd1 - domesticCarry*nd2,
+                    'thetaPut': decay - r_foreign*foreignDiscount*nMinusD1 + domesticCarry*nMinusD2,
+                    'vega': vega,
+                    'rhoCall': expiry*domesticDiscount*strike*nd2,
+                    'rhoPut': -expiry*domesticDiscount*strike*nMinusD2,
+                    'gamma': gamma,
+                    'vanna': -kernel*d2/(volatility*np.sqrt(self.TWOPI)),
+                    'vomma': kernel*underlying*sqrtExpiry*d1d2/volatility,
+                    'speed': -(gamma/underlying)*(1 + d1/(volatility*sqrtExpiry)),
+                    'zomma': gamma*(d1d2 - 1)/volatility,
+                    'ultima': (-vega/(volatility*volatility))*(d1d2*(1 - d1d2) + d1Squared + d2*d2)}
@@ -0,0 +1,112 @@
+import numpy as np
+
+from Metrics import metrics
+from VolatilitySolver import VolatilitySolver
+
+
+class IncrementalVolatility:
+    """Keeps the implied volatility of a watchlist between ticks and only solves the contracts that changed.
+    A contract is dirty when its price or underlying moved, or when its expiry moved by more than
+    expiryTolerance (relative), since a second less to expiry barely moves the volatility.
+    Dirty contracts are warm-started from their previous volatility (VolatilitySolver.resolve);
+    counts holds how many were skipped, warm-started and solved from scratch on the last update."""
+
+    def __init__(self, solver=None, expiryTolerance=0.005):
+        self.solver = solver or VolatilitySolver()
+        self.expiryTolerance = expiryTolerance
+        self.keys = None
+        self.inputs = None  # (price, underlying, expiry) of the last solve of each contract.
+        self.volatility = None
+        self.d1 = None
+        self.d2 = None
+        self.converged = None
+        self.counts = {'skipped': 0, 'warm': 0, 'cold': 0}
+
+    def reset(self):
+        """Forgets every contract, so the next update solves them all from scratch."""
+
+        self.keys = None
+        self.inputs = None
+        self.volatility = None
+        self.d1 = None
+        self.d2 = None
+        self.converged = None
+        self.counts = {'skipped': 0, 'warm': 0, 'cold': 0}
+
+    def follow(self, keys):
+        """Switches to the contracts of keys, carrying over the last solve of those followed before.
+        Returns which of them were known."""
+
+        previous = {} if self.keys is None else {key: x for x, key in enumerate(self.keys.tolist())}
+        index = np.array([previous.get(key, -1) for key in keys.tolist()], dtype=np.int64).reshape(keys.shape)
+        known = index >= 0
+
+        def carry(array, fill, dtype=float):
+            result = np.full(keys.shape, fill, dtype=dtype)
+            if array is not None:
+                result[known] = array[index[known]]
+            return result
+
+        self.inputs = tuple(carry(old, np.nan) for old in (self.inputs or (None,)*3))
+        self.volatility = carry(self.volatility, np.nan)
+        self.d1 = carry(self.d1, np.nan)
+        self.d2 = carry(self.d2, np.nan)
+        self.converged = carry(self.converged, False, bool)
+        self.keys = keys
+        return known
+
+    def dirty(self, price, underlying, expiry):
+        """Contracts whose inputs changed meaningfully since they were last solved."""
+
+        return self.changed((price, underlying, expiry), self.inputs)
+
+    def changed(self, inputs, lastInputs):
+        """Contracts whose (price, underlying, expiry) inputs moved meaningfully away from lastInputs."""
+
+        price, underlying, expiry = inputs
+        lastPrice, lastUnderlying, lastExpiry = lastInputs
+        with np.errstate(invalid='ignore', divide='ignore'):
+            expiryMoved = np.abs(expiry - lastExpiry) > self.expiryTolerance*np.abs(lastExpiry)
+            # NaN never equals itself, so missing inputs count as changed, and are skipped below if they stay missing.
+            return (~((price == lastPrice) | (np.isnan(price) & np.isnan(lastPrice))) |
+                    ~((underlying == lastUnderlying) | (np.isnan(underlying) & np.isnan(lastUnderlying))) |
+                    (expiryMoved | (np.isnan(expiry) != np.isnan(lastExpiry))))
+
+    def update(self, keys, price, strike, underlying, expiry, r_domestic, r_foreign, precision=0.05,
+               discount=None):
+        """Brings every contract up to date. keys (e.g. book rows or contract names) identify the contracts;
+        if they change, the contracts that were already followed keep their last solve (see follow), and only the
+        new ones are solved from scratch. discount, exp(-r_domestic*expiry), is passed on to the solver.
+        Returns (volatility, d1, d2, converged, solved) arrays, where solved marks the contracts that were
+        actually solved on this call."""
+
+        price, strike, underlying, expiry, r_domestic, r_foreign = np.broadcast_arrays(
+            *[np.asarray(a, dtype=float) for a in (price, strike, underlying, expiry, r_domestic, r_foreign)])
+        if discount is not None:
+            discount = np.broadcast_to(np.asarray(discount, dtype=float), price.shape)
+        keys = np.asarray(keys)
+
+        if self.keys is None or not np.array_equal(keys, self.keys):
+            known = self.follow(keys)
+            solved = ~known | self.dirty(price, underlying, expiry)
+        else:
+            solved = self.dirty(price, underlying, expiry)
+
+        warmCount = 0
+        if solved.any():
+            # Only converged volatilities are worth starting from.
+            previous = np.where(self.converged[solved], self.volatility[solved], np.nan)
+            volatility, d1, d2, converged, warm = self.solver.resolve(price[solved], strike[solved],
+                                                                      underlying[solved], expiry[solved],
+                                                                      r_domestic[solved], r_foreign[solved],
+                                                                      previous, precision,
+                                                                      None if discount is None else discount[solved])
+            self.volatility[solved], self.d1[solved], self.d2[solved], self.converged[solved] = (volatility, d1, d2,
+                                                                                                 converged)
+            self.inputs = tuple(np.where(solved, new, old) for new, old in zip((price, underlying, expiry), self.inputs))
+            warmCount = int(warm.sum())
+
+        self.counts = {'skipped': int(price.size - solved.sum()), 'warm': warmCount,
+                       'cold': int(solved.sum()) - warmCount}
+        metrics.increment('iv.skipped', self.counts['skipped'])
+        return self.volatility.copy(), self.d1.copy(), self.d2.copy(), self.converged.copy(), solved
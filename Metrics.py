@@ -0,0 +1,169 @@
+import json
+import math
+import os
+import threading
+import time
+
+
+class Histogram:
+    """Fixed-memory histogram of positive values (usually seconds) with log-spaced buckets.
+    Recording is O(1) and memory does not grow with the number of samples;
+    percentiles are accurate to about one bucket width (roughly 6% with the defaults)."""
+
+    def __init__(self, minValue=1e-6, maxValue=1e4, bucketsPerDecade=40):
+        self.minLog = math.log10(minValue)
+        self.bucketsPerDecade = bucketsPerDecade
+        self.buckets = [0]*(int(math.ceil((math.log10(maxValue) - self.minLog)*bucketsPerDecade)) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, value):
+        if value > 0:
+            bucket = int((math.log10(value) - self.minLog)*self.bucketsPerDecade) + 1
+            bucket = min(max(bucket, 0), len(self.buckets) - 1)
+        else:
+            bucket = 0
+        with self.lock:
+            self.buckets[bucket] += 1
+            self.count += 1
+            self.total += value
+            if value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile (0-100), capped at the largest value seen."""
+
+        with self.lock:
+            if not self.count:
+                return 0.0
+            rank = p/100.0*self.count
+            seen = 0
+            for bucket, n in enumerate(self.buckets):
+                seen += n
+                if n and seen >= rank:
+                    if bucket == 0:
+                        return max(self.min, 0.0)
+                    return min(10**(self.minLog + bucket/self.bucketsPerDecade), self.max)
+            return self.max
+
+    @property
+    def mean(self):
+        return self.total/self.count if self.count else 0.0
+
+    def summary(self):
+        return {'count': self.count, 'mean': self.mean, 'p50': self.percentile(50),
+                'p90': self.percentile(90), 'p99': self.percentile(99), 'max': self.max}
+
+
+class Timer:
+    """Context manager that records the time spent inside it into a histogram."""
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = 0.0
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.record(self.elapsed)
+        return False
+
+
+class Metrics:
+    """Named timers (histograms) and counters, cheap enough to leave on.
+    Each process has its own registry; use startDumping to write it to a JSON file periodically."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.dumpPath = None
+        self.dumpInterval = None
+        self.dumper = None
+        self.stopped = threading.Event()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def timer(self, name):
+        """Use as: with metrics.timer('scrape.snapshot'): ..."""
+
+        return Timer(self.histogram(name))
+
+    def record(self, name, seconds):
+        self.histogram(name).record(seconds)
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self):
+        return {'time': time.time(),
+                'pid': os.getpid(),
+                'timers': {name: h.summary() for name, h in sorted(self.histograms.items())},
+                'counters': dict(sorted(self.counters.items()))}
+
+    def report(self):
+        """Returns the timers (in milliseconds) and counters as a printable table."""
+
+        lines = ["%-28s %8s %10s %10s %10s %10s" % ("Timer", "Count", "p50 ms", "p90 ms", "p99 ms", "max ms")]
+        for name, h in sorted(self.histograms.items()):
+            lines.append("%-28s %8d %10.3f %10.3f %10.3f %10.3f" % (name, h.count, 1e3*h.percentile(50),
+                                                                 1e3*h.percentile(90), 1e3*h.percentile(99), 1e3*h.max))
+        for name, value in sorted(self.counters.items()):
+            lines.append("%-28s %8d" % (name, value))
+        return "\n".join(lines)
+
+    def dump(self, path=None):
+        path = path or self.dumpPath
+        with open(path + ".tmp", 'w') as f:
+            json.dump(self.summary(), f, indent=1)
+        os.replace(path + ".tmp", path)
+
+    def startDumping(self, path, interval=60.0):
+        """Writes the summary to path every interval seconds from a background thread."""
+
+        self.stopDumping()
+        self.dumpPath = path
+        self.dumpInterval = interval
+        self.stopped.clear()
+        self.dumper = threading.Thread(target=self.dumpLoop, daemon=True)
+        self.dumper.start()
+
+    def dumpLoop(self):
+        while not self.stopped.wait(self.dumpInterval):
+            self.dump()
+
+    def stopDumping(self):
+        if self.dumper is not None:
+            self.stopped.set()
+            self.dumper.join()
+            self.dumper = None
+            self.dump()
+
+    def afterFork(self):
+        """Starts a forked process off with an empty registry of its own. The parent's locks may have been
+        held at the fork, and its dumper thread did not come along, so stopDumping would only write the
+        child's numbers over the parent's file."""
+
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.dumper = None
+        self.stopped = threading.Event()
+
+
+metrics = Metrics()
@@ -1,18 +1,30 @@
-from CurrencyOption import CurrencyOption
-
-import datetime
-from multiprocessing import Process, Pipe, Manager
+from ArbitrageScanner import ArbitrageScanner
+from ExchangeRates import ExchangeRateProvider, YahooRateSource
+from ExpiryParser import ExpiryParser
+from OptionBook import OptionBook
+from OrderPipeline import OrderPipeline
+from PositionMonitor import PositionMonitor
+from PriceObserver import PriceObserver
+from ProcessLauncher import ProcessLauncher
+from RateCurve import RateCurve
+from RiskAggregator import RiskAggregator
+from SessionManager import SessionManager
+from SessionPool import SessionPool
+from SpreadIndex import SpreadIndex
+from Metrics import metrics
+from StrategyScheduler import StrategyScheduler
+from TapeRecorder import TapeRecorder, TapeReplayer
+from TickBuffer import TickBuffer
+from TradingRules import TradingRules
+from VolatilitySolver import VolatilitySolver
+from VolatilitySurface import VolatilitySurface
+
+import argparse
+from multiprocessing import Condition, Lock, Process, Manager
 import numpy as np
 import os
-import re
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support import expected_conditions as EC
-import selenium.webdriver.support.ui as ui
-from sys import exit
+import threading
 import time
-import urllib
 
 
 class NadexSearch:
@@ -23,93 +35,186 @@ class NadexSearch:
     iFrames = ('default', 'ifrMyPrices', 'ifrFinder', 'ifrDealingRates', 'ifrBetslip-0')
     currentFrame = iFrames[0]
 
+    # Reads every column getSnapshot needs in a single pass over the ifrMyPrices frame.
+    snapshotScript = """var doc = window.parent.frames['ifrMyPrices'].document;
+                        function column(className){
+                            var cells = doc.getElementsByClassName(className);
+                            var text = [];
+                            for(var i = 0; i < cells.length; i++){
+                                text.push(cells[i].textContent);
+                            }
+                            return text;
+                        }
+                        return {names: column('floatLeft tableIcon dealOpen'),
+                                prices: column('price dealOpen'),
+                                times: column('yui-dt0-col-timeToExpiry yui-dt-col-timeToExpiry yui-dt-sortable'),
+                                indicatives: column('yui-dt0-col-underlyingIndicativePrice yui-dt-col-underlyingIndicativePrice')};"""
+
+    # Menu options that need the browser, turned away in pricing-only mode.
+    browserOptions = ('0', '2', '3', '4', '5', '9', 'p')
+
     """                     FUNCTIONS                   """
 
-    def __init__(self):
-        self.driver = webdriver.Firefox()
+    def __init__(self, driver=None, sessionPool=None, driverLock=None):
+        self.sessionPool = sessionPool  # Reads the watchlist across several sessions instead of self.driver.
+        if sessionPool is not None:
+            driver = sessionPool.orderDriver
+            driverLock = sessionPool.orderSession.lock
+        self.driver = driver  # None in pricing-only mode, where snapshots only come from a replayed tape.
+        # Held by everything that uses self.driver (scrapes, orders, the position monitor and re-logins),
+        # so that a command never runs in the middle of another's page or betslip. The scrapes run in the
+        # priceHistory process, so it is a multiprocessing lock, made before that process is forked.
+        self.driverLock = driverLock if driverLock is not None else Lock()
         self.username = ""  # NOTE: Enter demo username here.
         self.password = ""  # NOTE: Enter demo password here.
+        self.sessionManager = SessionManager(self.username, self.password)  # Saves cookies to session.json.
         self.balance = -1
-        self.purchaseInProgress = False
         self.optionList = []
         self.exchangeRates = {}
+        self.unpricedPairs = set()  # Pairs makeOptions has already reported as missing an exchange rate.
+        self.orderPipeline = OrderPipeline(self.driver, lock=self.driverLock)
+        self.rateProvider = ExchangeRateProvider()
+        self.volatilitySolver = VolatilitySolver()
+        self.rateCurve = RateCurve()  # Flat default rates until loadRates() reads a curve file.
+        self.optionBook = OptionBook(solver=self.volatilitySolver, rateCurve=self.rateCurve)
+        self.volatilitySurface = VolatilitySurface()
+        self.expiryParser = ExpiryParser()
+        self.snapshotLatency = 0.0
+        self.tickBuffer = None
+        self.priceHistoryProcess = None
+        self.launcher = None  # Forks priceHistory from a process without threads, once startLauncher has run.
+        self.tickCondition = None  # Wakes the strategies on new ticks; made before the launcher so it inherits it.
+        self.scheduler = None
+        self.processIDs = None  # Shared list of the helper processes, if the caller provides one.
+        self.manager = None  # The multiprocessing Manager behind processIDs, shut down with everything else.
+        self.replayer = None
+        self.tradingRules = TradingRules(payout=self.volatilitySolver.payout)
+        self.arbitrageScanner = ArbitrageScanner(self.currencyPairs)
+        self.spreadIndex = SpreadIndex()  # Follows tickBuffer once price data is being gathered.
+        self.positionMonitor = None
+        self.riskAggregator = RiskAggregator(self.optionBook)  # Set its limits to hold analyzeData within them.
 
     def getExchangeRates(self):
-        """Iterate over all currency pairs and save their exchange rates."""
+        """Fetches the exchange rates of all currency pairs concurrently and saves them."""
 
+        self.exchangeRates.update(self.rateProvider.getRates(self.currencyPairs))
         for pair in self.currencyPairs:
-            self.exchangeRates[pair] = self.YahooExchangeRates(pair)
-            # Try again if the page does not load correctly.
-            while self.exchangeRates[pair] == 'Error.':
-                self.exchangeRates[pair] = self.YahooExchangeRates(pair)
-
-    def YahooExchangeRates(self, pair):
-        """Uses regex to gather exchange rates for all currency pairs."""
-
-        pair = pair.replace("/", "")
-        url = 'http://finance.yahoo.com/q?s=' + pair + '=X'
-        regex = '<span id="yfs_l10_' + pair.lower() + '=x">(.+?)</span>'
-        pattern = re.compile(regex)
-        htmltext = urllib.request.urlopen(url).read().decode("utf-8")
-        results = re.findall(pattern, htmltext)
-
-        try:
-            exchangeRate = float(results[0])
-        except IndexError:
-            exchangeRate = "Error."
-
-        return exchangeRate
-
-    def signIn(self):
-        """Goes to the Nadex website and signs in to a demo account."""
-
-        self.driver.get("http://www.nadex.com/login.html")
-        ui.WebDriverWait(self.driver, 30).until(EC.presence_of_element_located((By.ID, "account_id")))
-
-        # wait = ui.WebDriverWait(driver, 15)  # Times out after 15 seconds.
-
-        elem = self.driver.find_element_by_id("account_id")
-        elem.send_keys(self.username)
-        elem = self.driver.find_element_by_id("password")
-        elem.send_keys(self.password)
-        elem.send_keys(Keys.RETURN)
-
-        print("Waiting for page to load...")
-
-        ui.WebDriverWait(self.driver, 30).until(EC.presence_of_element_located((By.ID, "ifrMyPrices")))
-        time.sleep(2)
+            if pair not in self.exchangeRates:
+                print("Could not get the exchange rate for", pair)
+
+    def signIn(self, driver=None):
+        """Signs in to a demo account, reusing the saved session if it is still good (see SessionManager).
+        Signs in another session (e.g. one of a SessionPool) if driver is given; the welcome is only for the main one.
+        Returns False if the login failed."""
+
+        main = driver is None
+        driver = self.driver if main else driver
+        others = []
+        if main and self.sessionPool is not None:  # The pool's data sessions sign in at the same time.
+            others = [threading.Thread(target=self.signIn, args=(other,)) for other in self.sessionPool.drivers
+                      if other is not self.driver]
+            for thread in others:
+                thread.start()
+
+        if main:
+            print("Waiting for page to load...")
+        how = self.sessionManager.ensure(driver)
+        if not main:
+            return how is not None
+        for thread in others:
+            thread.join()
+        if how is None:
+            print("\rCould not sign in.")
+            return False
+        if self.sessionPool is not None:
+            self.sessionPool.selectWatchlists()
 
         self.balance = self.getBalance()
 
-        print("\rPage open.")
-        time.sleep(1.2)
+        print({'login': "\rPage open.", 'restored': "\rSaved session restored."}.get(how, "\rSigned in."))
         print("\nWelcome. Your starting balance is: \t$" + str('%.2f' % self.balance))
 
         # For switching to custom watchlist.
         # driver.find_element_by_id("selectWatchlist_currVal").click()
         # driver.find_element_by_xpath('//*[@id="selectWatchlist_ddScroll"]/ul/li[16]').click()
         # time.sleep(10)
+        return True
+
+    def keepSignedIn(self, interval=30.0):
+        """Probes every browser session every interval seconds in the background, signing it in again if it expired."""
+
+        if self.sessionPool is None:
+            self.sessionManager.watch(self.driver, self.driverLock, interval, self.signedInAgain)
+            return
+        sessions = self.sessionPool.dataSessions + [self.sessionPool.orderSession]
+        for session in {id(session): session for session in sessions}.values():
+            self.sessionManager.watch(session.driver, session.lock, interval, self.signedInAgain)
+
+    def signedInAgain(self, driver):
+        if self.sessionPool is not None:
+            for session in self.sessionPool.dataSessions:
+                if session.driver is driver:
+                    session.selectWatchlist()
+        print("\nThe session expired and was signed in again.")
 
     def getBalance(self):
         """Returns the account's current balance as a floating point."""
 
-        currentBalance = self.driver.execute_script("return parent.document.getElementById('rsrcBalance').textContent")
+        with self.driverLock:
+            currentBalance = self.driver.execute_script("return parent.document.getElementById('rsrcBalance').textContent")
         currentBalance = currentBalance.replace('$', '')
         currentBalance = currentBalance.replace(',', '')
         currentBalance = float(currentBalance)
         return currentBalance
 
+    def startPositionMonitor(self, interval=1.0):
+        """Starts following positions, working orders and the balance on a thread of its own (see PositionMonitor).
+        Fills, closes and cancels are printed as they happen, and balance is kept up to date."""
+
+        if self.positionMonitor is None:
+            self.positionMonitor = PositionMonitor(self.driver, interval, callback=self.accountEvent,
+                                                   lock=self.driverLock)
+            self.positionMonitor.poll()  # The first read reports the positions that are already open.
+            self.positionMonitor.start()
+        return self.positionMonitor
+
+    def accountEvent(self, event):
+        if event['type'] == 'balance':
+            self.balance = event['balance']
+        if event['type'] in ('opened', 'filled', 'closed'):
+            self.riskAggregator.setPosition(event['market'], event['size'])
+            self.riskAggregator.refresh([event['market']])
+        if event['type'] in ('opened', 'filled', 'closed', 'orderFilled', 'orderCancelled'):
+            print("\n" + event['type'] + ":", event['market'], "size", event['size'], "at", event['level'])
+
+    def loadRates(self, path=None):
+        """Reads the rate curves again, from path if given (see RateCurve). The option book picks the new rates up
+        on its next solve, solving every volatility again. Returns False if the file could not be read."""
+
+        previous = self.rateCurve.path
+        if path is not None:
+            self.rateCurve.path = path
+        try:
+            self.rateCurve.reload()
+        except (OSError, ValueError) as error:
+            self.rateCurve.path = previous
+            print("Could not load the rate curves:", error)
+            return False
+        print("Rate curves loaded" + (" from " + self.rateCurve.path if self.rateCurve.path else "") + ".")
+        return True
+
     def getOptionNames(self, clean=False):
         """Return a list of option names from the main Watchlist.
         Useful because the names of options are always changing.
         Clean=True will remove unpriced options."""
 
-        names = self.driver.execute_script("""adrNames = window.parent.frames['ifrMyPrices'].document.getElementsByClassName('floatLeft tableIcon dealOpen');
-                                              namesText = "";
-                                              for(var i = 0; i < adrNames.length; i++){
-                                                  namesText += adrNames[i].textContent + ",";
-                                              }
-                                              return namesText;""")
+        with self.driverLock, metrics.timer('scrape.optionNames'):
+            names = self.driver.execute_script("""adrNames = window.parent.frames['ifrMyPrices'].document.getElementsByClassName('floatLeft tableIcon dealOpen');
+                                                  namesText = "";
+                                                  for(var i = 0; i < adrNames.length; i++){
+                                                      namesText += adrNames[i].textContent + ",";
+                                                  }
+                                                  return namesText;""")
 
         nameList = [n for n in names.split(",")]
 
@@ -133,12 +238,13 @@ class NadexSearch:
         Useful for obvious reasons.
         Clean=True will remove unpriced options."""
 
-        prices = self.driver.execute_script("""adrPrices = window.parent.frames['ifrMyPrices'].document.getElementsByClassName('price dealOpen');
-                                               priceText = "";
-                                               for(var j = 0; j < adrPrices.length; j++){
-                                                   priceText += adrPrices[j].textContent + ",";
-                                               }
-                                               return priceText;""")
+        with self.driverLock, metrics.timer('scrape.prices'):
+            prices = self.driver.execute_script("""adrPrices = window.parent.frames['ifrMyPrices'].document.getElementsByClassName('price dealOpen');
+                                                   priceText = "";
+                                                   for(var j = 0; j < adrPrices.length; j++){
+                                                       priceText += adrPrices[j].textContent + ",";
+                                                   }
+                                                   return priceText;""")
 
         priceList = [p for p in prices.split(",")]
 
@@ -165,208 +271,353 @@ class NadexSearch:
         return priceList
 
     def getExpireTimes(self):
-        """Returns expire time in years.
+        """Returns expire time in years as a float array, NaN for rows showing '-'.
         Why years? The interest rates are expressed in years, and the units must be consistent."""
 
-        times = self.driver.execute_script("""adrTimes = window.parent.frames['ifrMyPrices'].document.getElementsByClassName('yui-dt0-col-timeToExpiry yui-dt-col-timeToExpiry yui-dt-sortable');
-                                              timeText = "";
-                                              for(var k = 0; k < adrTimes.length; k++){
-                                              timeText += adrTimes[k].textContent + ",";
-                                              }
-                                              return timeText;""")
-        timeList = [t.replace(" ", "") for t in times.split(',')]
+        with self.driverLock, metrics.timer('scrape.expireTimes'):
+            times = self.driver.execute_script("""adrTimes = window.parent.frames['ifrMyPrices'].document.getElementsByClassName('yui-dt0-col-timeToExpiry yui-dt-col-timeToExpiry yui-dt-sortable');
+                                                  timeText = "";
+                                                  for(var k = 0; k < adrTimes.length; k++){
+                                                  timeText += adrTimes[k].textContent + ",";
+                                                  }
+                                                  return timeText;""")
+        timeList = times.split(',')
         del timeList[0]  # Needed to remove title and empty string.
         del timeList[-1]
 
-        for x in range(0, len(timeList)):
-            if timeList[x] == '-':
-                continue
-
-            t = timeList[x]
-            if any('h' == c for c in t):  # Not all timestamps are given in the same format.
-                t = t.replace("h", "")
-                t = t.replace("m", "")
-                t = time.strptime(t, "%H:%M")
-                t = datetime.timedelta(hours=t.tm_hour, minutes=t.tm_min).total_seconds()
-
-            elif any('m' == c for c in t):
-                t = t.replace("m", "")
-                t = t.replace("s", "")
-
-                try:
-                    t = time.strptime(t, "%M:%S")
-                    t = datetime.timedelta(minutes=t.tm_min, seconds=t.tm_sec).total_seconds()
-                except:  # FIX ME: catch actual exception
-                    t = "0"+t
-                    t = time.strptime(t, "%M:%S")
-                    t = datetime.timedelta(minutes=t.tm_min, seconds=t.tm_sec).total_seconds()
-
-            else:
-                t = t.replace("s", "")
-                t = time.strptime(t, "%S")
-                t = datetime.timedelta(seconds=t.tm_sec).total_seconds()
-
-            t /= 31536000.0
-            timeList[x] = t
-
-        return timeList
+        return self.expiryParser.parseAll(timeList)
 
     def getIndicatives(self):
         """Returns the underlying indicative values."""
 
-        indicatives = self.driver.execute_script("""adrUnd = window.parent.frames['ifrMyPrices'].document.getElementsByClassName('yui-dt0-col-underlyingIndicativePrice yui-dt-col-underlyingIndicativePrice');
-                                            undText = "";
-                                            for(var l = 1; l < adrUnd.length; l++){
-                                                undText += adrUnd[l].textContent + ",";
-                                            }
-                                            return undText;""")
+        with self.driverLock, metrics.timer('scrape.indicatives'):
+            indicatives = self.driver.execute_script("""adrUnd = window.parent.frames['ifrMyPrices'].document.getElementsByClassName('yui-dt0-col-underlyingIndicativePrice yui-dt-col-underlyingIndicativePrice');
+                                                undText = "";
+                                                for(var l = 1; l < adrUnd.length; l++){
+                                                    undText += adrUnd[l].textContent + ",";
+                                                }
+                                                return undText;""")
         indicativesList = [float(i) if ('.' in i) else i for i in indicatives.split(',')]
         return indicativesList
 
-    def makeOptions(self, childPipes):
-        """Not really sure what this does.
-        Makes instances of my option class for each open contract?"""
+    def getSnapshot(self):
+        """Reads name, sell, buy, time to expiry and indicative of every watchlist row in one script call.
+        All columns come from the same DOM state, unlike calling getOptionNames, getPrices,
+        getExpireTimes and getIndicatives one after another.
+        The round trip time of the call is stored in snapshotLatency and returned with the snapshot.
+        While replaying a tape (see replay) the snapshots come from the tape instead, and None marks its end.
+        Without a browser or a tape there is nothing to read, so None is returned."""
+
+        if self.replayer is not None:
+            return self.replayer.getSnapshot()
+        if self.driver is None and self.sessionPool is None:
+            return None
+
+        start_time = time.time()
+        if self.sessionPool is not None:
+            table = self.sessionPool.readTable()
+        else:
+            with self.driverLock:
+                table = self.driver.execute_script(self.snapshotScript)
+        self.snapshotLatency = time.time() - start_time
+        metrics.record('scrape.snapshot', self.snapshotLatency)
 
-        names = self.getOptionNames(False)
-        if not names:
+        prices = []
+        for p in table['prices']:
+            try:
+                prices.append(float(p))
+            except ValueError:
+                prices.append(p)
+
+        return {'names': table['names'],
+                'sell': prices[0::2],
+                'buy': prices[1::2],
+                'expiry': self.expiryParser.parseAll(table['times'][1:]),  # First cell is the title.
+                'indicative': [float(i) if ('.' in i) else i for i in table['indicatives'][1:]],
+                'timestamp': start_time,
+                'latency': self.snapshotLatency}
+
+    def replay(self, tapePath, realtime=False, speed=1.0):
+        """Feeds a recorded tape through getSnapshot instead of the live watchlist,
+        at the recorded pace (sped up by speed) or as fast as possible."""
+
+        self.replayer = TapeReplayer(tapePath, realtime, speed)
+        print("Replaying", len(self.replayer), "ticks from", tapePath)
+
+    def makeOptions(self, tickBuffer, snapshot=None):
+        """Adds each open, priced Forex contract on the watchlist to optionBook, reading its ticks from tickBuffer.
+        optionList holds a CurrencyOption view of every contract in the book."""
+
+        if snapshot is None:
+            snapshot = self.getSnapshot()
+        if not snapshot or not snapshot['names']:
+            print("There are no open contracts.")
             return None
-        expiry = self.getExpireTimes()
-        underlying = self.getIndicatives()
-        prices = self.getPrices(False)
+        names = snapshot['names']
+        expiry = snapshot['expiry']
+        underlying = snapshot['indicative']
 
+        self.optionBook.tickBuffer = tickBuffer
+        newOptions = []
+        unpriced = set()  # Pairs with rows that have neither an indicative price nor an exchange rate.
         for x, name in enumerate(names):
             currentPair = name.split(" ")[0]
             if not any(currentPair == pair for pair in self.currencyPairs):
                 continue
-            if prices[2*x] == '-' or prices[2*x+1] == '-':
+            if snapshot['sell'][x] == '-' or snapshot['buy'][x] == '-' or np.isnan(expiry[x]):
+                continue
+            indicative = underlying[x]
+            if not isinstance(indicative, float) or np.isnan(indicative):
+                indicative = '-'
+            exchangeRate = self.exchangeRates.get(currentPair)
+            if indicative == '-' and exchangeRate is None:
+                unpriced.add(currentPair)
                 continue
 
-            newOption = CurrencyOption(name,
-									   prices[2*x],
-									   prices[2*x + 1],
-									   self.exchangeRates[currentPair],
-									   expiry[x],
-									   underlying[x],
-									   childPipes[x],
-									   motherOfAllBuyPrices[x],
-									   motherOfAllSellPrices[x],
-									   motherOfAllUnderlying[x])
-            self.optionList.append(newOption)
-
-    def scanner(self, spread):
-        """Displays options with specified spread. Useful for making trades manually."""
-
-        names = self.getOptionNames(False)
-        if not names:
+            newOptions.append(self.optionBook.add(name,
+                                                  snapshot['buy'][x],
+                                                  snapshot['sell'][x],
+                                                  exchangeRate if exchangeRate is not None else np.nan,
+                                                  expiry[x],
+                                                  indicative,
+                                                  x))
+
+        if unpriced - self.unpricedPairs:
+            print("Skipped the contracts of", ", ".join(sorted(unpriced - self.unpricedPairs)),
+                  "without an indicative price or exchange rate.")
+        self.unpricedPairs |= unpriced
+
+        # The whole book, like solveTick, so the first tick starts from these volatilities.
+        self.optionList = list(self.optionBook)
+        self.solveVolatilities(self.optionList)
+
+    def solveVolatilities(self, options, precision=0.05):
+        """Brings the volatility of every option up to date in one vectorized pass over the book's columns.
+        Only options whose price, underlying or expiry changed since the last call are solved again, starting
+        from their previous volatility; optionBook.incrementalVolatility.counts has the skipped/warm/cold counts.
+        The smiles of volatilitySurface are then refitted where enough volatilities moved, the Greeks of the
+        options are computed where they are out of date, and those of the positions held are brought up to date
+        in riskAggregator."""
+
+        if not options:
             return
 
-        prices = self.getPrices(True)
-        if not prices:
+        with self.optionBook.lock:
+            rows = self.optionBook.rowsOf(options)
+            changed = self.optionBook.solve(rows, precision)
+            self.volatilitySurface.update(self.optionBook, changed)
+            self.optionBook.greeks(rows)
+        self.riskAggregator.refresh()  # Outside the book's lock: the aggregator takes its own lock first.
+
+    def scanner(self, spread, snapshot=None, pair=None):
+        """Displays options (of one currency pair, if given) with a spread of at most spread, tightest first.
+        Useful for making trades manually. While price data is being gathered the spreads come from the
+        tick buffer, so no extra scrape is needed; otherwise the watchlist is read once."""
+
+        fromBuffer = snapshot is None and self.tickBuffer is not None and self.spreadIndex.refresh(self.tickBuffer)
+        if not fromBuffer:
+            if snapshot is None:
+                snapshot = self.getSnapshot()
+            if not snapshot or not snapshot['names']:
+                print("There are no open contracts.")
+                return
+            self.spreadIndex.update(snapshot)
+
+        if not len(self.spreadIndex):
             print("There are no priced contracts.")
             return
 
         print("Name", '%44s' % "Sell", "   Buy       Spread\n")
-        n = 0
-        p = 0
         frmt = "%*s%*s%*s%*s"
 
-        while n < len(names):
-            try:  # try is necessary to prevent errors from '-' prices.
-                differential = abs(float(prices[p]) - float(prices[p+1]))
-                if differential <= spread:
-                    print(frmt % (0, names[n], 50-len(names[n]), prices[p], 7, prices[p+1], 9, differential))
-            except TypeError:
-                pass
-
-            n += 1
-            p += 2
-
-    def priceHistory(self, length, optionConnections, timeConnection, gatheringConnection):
-        """This function has not been tested yet!
-        I believe this was supposed to be run in a separate process and simply collect price data.
-        Probably not useful for arbitrage."""
-
-        global processIDs
-        proxyList = processIDs
-        proxyList.append(os.getpid())
-        processIDs = proxyList
-
-        buyList = []
-        sellList = []
-        times = []
-
-        currentPrices = self.getPrices(False)
-
-        for x in range(0, len(currentPrices)//2):
-            buyList.append([currentPrices[2*x + 1]])
-            sellList.append([currentPrices[2*x]])
-
-        gatheringConnection.send(True)
-        counter = 0
-
-        while True:
-            start_time = time.time()
-            print("Start")
+        for name, sell, buy, differential in self.spreadIndex.under(spread, pair):
+            print(frmt % (0, name, 50-len(name), sell, 7, buy, 9, differential))
 
-            if len(currentPrices) != length:
-                gatheringConnection.send(False)
-                print("The amount of open contracts has changed.")
-                exit()
+    def arbitrage(self, snapshot=None):
+        """Displays every strike-ladder arbitrage on the watchlist (see ArbitrageScanner)."""
 
-            else:
-                currentTimes = self.getExpireTimes()
-                currentUnderlying = self.getIndicatives()
-                currentPrices = self.getPrices(False)
-
-                for p in range(0, len(currentPrices)//2):
-                    buyList[p].append(currentPrices[p*2 + 1])
-                    sellList[p].append(currentPrices[p*2])
-                    print(sellList[p], buyList[p], currentTimes[p], currentUnderlying[p])
-                    optionConnections[p].send((sellList[p], buyList[p], currentTimes[p], currentUnderlying[p]))
-
-                times.append(time.time() - start_time)
-
-                timeConnection.send(times)
-
-                print("End ", counter)
-                counter += 1
+        if snapshot is None:
+            snapshot = self.getSnapshot()
+        if not snapshot or not snapshot['names']:
+            print("There are no open contracts.")
+            return
+        self.arbitrageScanner.update(snapshot)
+        print(self.arbitrageScanner.report())
+
+    def startPriceHistory(self, capacity=4096, tapePath=None, push=False):
+        """Starts priceHistory in its own process, writing into a new shared TickBuffer.
+        If tapePath is given every snapshot is also recorded to that tape file.
+        With push=True prices are pushed from the browser by a PriceObserver instead of polling the whole watchlist.
+        Does nothing if it is already running."""
+
+        if self.priceHistoryProcess is not None and self.priceHistoryProcess.is_alive():
+            print("This process is already running.")
+            return self.tickBuffer
+
+        # A replayed tape is only peeked at, so its first tick still reaches the buffer.
+        snapshot = self.replayer.peekSnapshot() if self.replayer is not None else self.getSnapshot()
+        if not snapshot or not snapshot['names']:
+            print("There are no open contracts.")
+            return None
 
-    def startTrading(self, childPipes):
-        """Launches processes for each option."""
+        if self.tickBuffer is not None:
+            self.tickBuffer.close()
+            self.tickBuffer.unlink()
+        self.tickBuffer = TickBuffer(len(snapshot['names']), capacity, newTick=self.tickCondition)
+        self.spreadIndex.reset(snapshot['names'])
+        if self.launcher is not None:
+            replay = None
+            if self.replayer is not None:
+                replay = (self.replayer.path, self.replayer.realtime, self.replayer.speed,
+                          self.replayer.position, self.replayer.startTime)
+            self.priceHistoryProcess = self.launcher.launch('launchedPriceHistory', self.tickBuffer.name, tapePath,
+                                                            push, replay, metrics.dumpPath, metrics.dumpInterval)
+        else:
+            # Forked from here, which is only safe while no other thread is running; see ProcessLauncher.
+            self.priceHistoryProcess = Process(target=self.priceHistory, args=(self.tickBuffer, tapePath, push))
+            self.priceHistoryProcess.start()
+        return self.tickBuffer
+
+    def startLauncher(self):
+        """Forks the process that startPriceHistory starts priceHistory from. Call it before any thread is started,
+        and after the browser locks are made, so priceHistory shares them (see build)."""
+
+        self.tickCondition = Condition()
+        self.launcher = ProcessLauncher(self).start()
+
+    def launchedPriceHistory(self, tickBufferName, tapePath, push, replay, dumpPath, dumpInterval):
+        """Runs priceHistory in a process started by the launcher, which was forked before the buffer,
+        the replay position and the metrics file were known, so they are passed in here."""
+
+        self.replayer = None
+        if replay is not None:
+            path, realtime, speed, position, startTime = replay
+            self.replayer = TapeReplayer(path, realtime, speed)
+            self.replayer.position, self.replayer.startTime = position, startTime
+        metrics.dumpPath, metrics.dumpInterval = dumpPath, dumpInterval
+        tickBuffer = TickBuffer.attach(tickBufferName, self.tickCondition)
+        try:
+            self.priceHistory(tickBuffer, tapePath, push)
+        finally:
+            tickBuffer.close()
+
+    def priceHistory(self, tickBuffer, tapePath=None, push=False, backoff=0.1, maxBackoff=5.0):
+        """Meant to be run in a separate process: records every watchlist snapshot in tickBuffer,
+        and on a tape at tapePath if one is given.
+        Options and strategies read the latest ticks from the shared buffer instead of pipes.
+        With push=True the snapshots come from a PriceObserver, which only transfers the cells that changed.
+        Each snapshot is also checked for strike-ladder arbitrage, and new violations are printed as they appear.
+        A scrape that fails, e.g. while the page is on the login form during a re-login, is retried after a
+        backoff that doubles up to maxBackoff seconds; in push mode the observer is then installed again.
+        Stops when the amount of open contracts changes, because the buffer columns would no longer line up,
+        or when a replayed tape ends."""
+
+        if self.processIDs is not None:
+            self.processIDs.append(os.getpid())
+
+        # Metrics are per process, so this process writes its own file next to the main one.
+        metrics.afterFork()
+        if metrics.dumpPath is not None:
+            metrics.startDumping(metrics.dumpPath.replace(".json", "-priceHistory.json"), metrics.dumpInterval)
+
+        recorder = TapeRecorder(tapePath) if tapePath else None
+        # The observer lives in one page, so it is not used while the watchlist is split across a SessionPool.
+        source = PriceObserver(self) if push and self.replayer is None and self.sessionPool is None else self
+        try:
+            from selenium.common.exceptions import WebDriverException
+            scrapeErrors = (WebDriverException, KeyError, TypeError)  # Or a page that is not the platform.
+        except ImportError:  # Replaying a tape without Selenium.
+            scrapeErrors = (KeyError, TypeError)
+        failures = 0
+        try:
+            while True:
+                try:
+                    snapshot = source.getSnapshot()
+                except scrapeErrors as error:
+                    metrics.increment('priceHistory.errors')
+                    if not failures:
+                        print("\nCould not read the watchlist, trying again:", str(error).strip() or repr(error))
+                    time.sleep(min(backoff*2**failures, maxBackoff))
+                    failures += 1
+                    if source is not self:
+                        source.reset()
+                    continue
+                failures = 0
+
+                if snapshot is None:
+                    print("End of the tape.")
+                    break
+
+                if len(snapshot['names']) != tickBuffer.contracts:
+                    print("The amount of open contracts has changed.")
+                    break
+
+                metrics.increment('priceHistory.ticks')
+                tickBuffer.append(snapshot['timestamp'],
+                                  snapshot['sell'],
+                                  snapshot['buy'],
+                                  snapshot['indicative'],
+                                  snapshot['expiry'])
+                if recorder is not None:
+                    with metrics.timer('tape.record'):
+                        recorder.record(snapshot)
+
+                self.arbitrageScanner.update(snapshot)
+                if self.arbitrageScanner.opened:
+                    print("\nArbitrage!\n" + self.arbitrageScanner.report(self.arbitrageScanner.opened))
+        finally:
+            if recorder is not None:
+                recorder.close()
+            metrics.stopDumping()
+
+    def startTrading(self, tickBuffer):
+        """Subscribes analyzeData for every option to the strategy scheduler.
+        Each option is evaluated whenever a new tick for it arrives, on a worker pool sized to the machine."""
 
         if not self.optionList:
-            self.makeOptions(childPipes)
+            self.makeOptions(tickBuffer)
+
+        if self.scheduler is None:
+            self.scheduler = StrategyScheduler(tickBuffer, onTick=self.solveTick)
 
         for option in self.optionList:
-            Process(target=self.analyzeData, args=(option,)).start()
-            time.sleep(1)
+            self.scheduler.subscribe(option, self.analyzeData)
+        self.scheduler.start()
 
         print("Analysis has begun.")
 
-    def analyzeData(self, option):
-        """This is a place for *very* basic trading algorithms for testing, not for winning.
-        Currently does nothing interesting. Make it trade off of the Greeks or something."""
+    def solveTick(self):
+        """Run by the scheduler once per new tick, before the strategies see it: reads the tick into every row of
+        optionBook, solves the volatilities that moved and computes their Greeks, all in one batch,
+        so the strategies only read their row."""
 
-        # global processIDs
-        # proxyList = processIDs
-        # currentProcess = os.getpid()
-        # proxyList.append(currentProcess)
-        # processIDs = proxyList
+        self.optionBook.refresh()
+        self.solveVolatilities(self.optionList)
 
-        while True:
-            if abs(option.buyPrice - option.sellPrice) <= 5:
-                if option.strike/option.underlying <= 0.9 and option.delta() <= 0.5:
-                    option.buy(lotSize=1, short=True)
-                    exit()
-                elif 1 >= option.strike/option.underlying >= 0.995 and option.delta() > 0:
-                    option.buy(lotSize=1, short=False)
-                    exit()
-                elif 1 >= option.strike/option.underlying >= 0.995 and option.delta() < 0:
-                    option.buy(lotSize=1, short=True)
-                    exit()
-                elif 1.01 >= option.strike/option.underlying >= 1 and option.delta() < 0:
-                    option.buy(lotSize=1, short=True)
-                    exit()
+    def analyzeData(self, option):
+        """This is a place for *very* basic trading algorithms for testing, not for winning.
+        Currently does nothing interesting. Make it trade off of the Greeks or something.
+        Called by the scheduler on every new tick for the option; returns True once an order is placed.
+        The rules themselves are in TradingRules, which the Backtester runs over recorded ticks."""
+
+        # One state of the row, copied at once; the other workers only wait for the copy, not for this strategy.
+        with self.optionBook.lock:
+            buy, sell, strike, underlying = option.buyPrice, option.sellPrice, option.strike, option.underlying
+            binary = option.binaryGreeksCache  # Computed by solveTick for this tick.
+        if not self.tradingRules.tradable(buy, sell):
+            return False
+        if binary is None:  # Called outside the scheduler, before solveTick has run.
+            binary = option.binaryGreeks()
+        signal = self.tradingRules.signals(buy, sell, strike, underlying, binary['price'], binary['delta'])
+        if signal == TradingRules.NONE:
+            return False
+        if self.riskAggregator.limits:
+            self.riskAggregator.refresh([option.name])
+            if not self.riskAggregator.allows(option.name, -1 if signal == TradingRules.SELL else 1):
+                return False
+
+        self.buy(option, lotSize=1, short=bool(signal == TradingRules.SELL), wait=False)
+        return True
 
     def placeOrderExample(self):
         """Places an order with no strategy, just to demonstrate that it works."""
@@ -375,99 +626,64 @@ class NadexSearch:
             return "There are no contracts to order."
 
         for option in self.optionList:
-            start_time = time.time()
-            option.buy(lotSize=1, short=False)
-            timeTracker[9].append(time.time() - start_time)
-            print("Average time: ", np.mean(timeTracker[9]))
+            with metrics.timer('menu.placeOrder') as timer:
+                print(self.buy(option, lotSize=1, short=False))
+            self.printTime(timer)
 
-    def buy(self, option, lotSize=1, short=False):
-        """Buys the option."""
+        print("Average stage times: ", self.orderPipeline.averageStages())
 
-        global ticketsOpen
+    def buy(self, option, lotSize=1, short=False, wait=True):
+        """Buys the option through the order pipeline.
+        With wait=False the queued Order is returned immediately instead of the result."""
 
-        while self.purchaseInProgress:
-            pass
-        self.purchaseInProgress = True
-
-        try:
-            self.driver.find_element_by_link_text(option.name).click()
-            ticketsOpen += 1
-            ticket = str(ticketsOpen)
-        except:  # FIX ME: catch actual exception
-            return "Link_text not found."
-
-        # This is here to prevent the code from executing before the order form has even opened.
-        loaded = False
-        while not loaded:
-            try:
-                float(self.driver.execute_script("return window.parent.frames['ifrBetslip-"+ticket+"'].document.getElementById('dmaPriceCurrent').textContent"))
-                loaded = True
-            except:  # FIX ME: catch actual exception
-                pass
-
-        # This chunk actually places the order.
-        # The above chunk of code doesn't slow the execution enough.
-        # Unfortunately I cannot come up with a better way of further slowing it down enough other than time.sleep().
-        time.sleep(0.45)
-        try:
-            self.driver.execute_script("window.parent.frames['ifrBetslip-"+ticket+"'].document.getElementById('directionChange').click()")  # Once for buy, twice for sell.
-            self.driver.execute_script("window.parent.frames['ifrBetslip-"+ticket+"'].document.getElementById('size').value = "+str(lotSize))
-            if short:
-                self.driver.execute_script("window.parent.frames['ifrBetslip-"+ticket+"'].document.getElementById('directionChange').click()")
-                self.driver.execute_script("window.parent.frames['ifrBetslip-"+ticket+"'].document.getElementById('level').value = "+str(option.sellPrice))
-            else:
-                self.driver.execute_script("window.parent.frames['ifrBetslip-"+ticket+"'].document.getElementById('level').value = "+str(option.buyPrice))
-            self.driver.execute_script("window.parent.frames['ifrBetslip-"+ticket+"'].document.getElementById('btnSubmit').click()")
-            loaded = False
-        except:  # FIX ME: catch actual exception
-            print("Error filling buyslip.")
-
-        while not loaded:
-            try:
-                self.driver.execute_script("window.parent.frames['ifrBetslip-"+ticket+"'].document.getElementById('betslipBtnClose').click()")
-                loaded = True
-            except:  # FIX ME: catch actual exception
-                pass
-
-        ticketsOpen -= 1
-        self.purchaseInProgress = False
+        maxWait = self.orderPipeline.maxWait
+        order = self.orderPipeline.submit(option, lotSize, short, option.tickTime)
+        if not wait:
+            return order
+        result = order.wait(maxWait)
+        return result if order.finished.is_set() else "Order timed out."
 
     def fillWatchlist(self):
         """Code looks awful, I'll have to overhaul it when it comes time I finally need it.
         Used for creating a custom watchlist, filled with every Forex binary option.
         This is useful because Nadex does not save the entire watchlist, and thus it needs to be updated from time to time."""
 
-        self.driver.switch_to_default_content()
-        self.driver.switch_to_frame("ifrFinder")
-        self.currentFrame = 'ifrFinder'
-        ui.WebSelf.DriverWait(self.driver, 20).until(EC.presence_of_element_located((By.ID, "ygtvt4")))
-        self.driver.find_element_by_id("ygtvt4").click()
-        ui.WebSelf.DriverWait(self.driver, 20).until(EC.presence_of_element_located((By.ID, "ygtvt8")))
-
-        for number in range(8, 17):
-            ID = "ygtvt" + str(number)
-            self.driver.find_element_by_id(ID).click()
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        import selenium.webdriver.support.ui as ui
 
-        for number in range(18, 87):
-
-            ID = "ygtvlabelel" + str(number)
-            self.driver.find_element_by_id(ID).click()
+        with self.driverLock:  # Switches frames, which would send any other command to the wrong one.
             self.driver.switch_to_default_content()
-            self.driver.switch_to_frame("ifrDealingRates")
-            time.sleep(3)
+            self.driver.switch_to_frame("ifrFinder")
+            self.currentFrame = 'ifrFinder'
+            ui.WebSelf.DriverWait(self.driver, 20).until(EC.presence_of_element_located((By.ID, "ygtvt4")))
+            self.driver.find_element_by_id("ygtvt4").click()
+            ui.WebSelf.DriverWait(self.driver, 20).until(EC.presence_of_element_located((By.ID, "ygtvt8")))
 
-            buttons = self.driver.find_elements_by_css_selector(".optionsBtn")
+            for number in range(8, 17):
+                ID = "ygtvt" + str(number)
+                self.driver.find_element_by_id(ID).click()
 
-            for button in buttons:
+            for number in range(18, 87):
 
-                button.click()
+                ID = "ygtvlabelel" + str(number)
+                self.driver.find_element_by_id(ID).click()
                 self.driver.switch_to_default_content()
-                ui.WebSelf.DriverWait(self.driver, 20).until(EC.presence_of_element_located((By.ID, "PORTFOLIO")))
-                self.driver.find_element_by_xpath('//*[@id="PORTFOLIO"]/a').click()
                 self.driver.switch_to_frame("ifrDealingRates")
+                time.sleep(3)
 
-            self.driver.switch_to_default_content()
-            self.driver.switch_to_frame("ifrFinder")
+                buttons = self.driver.find_elements_by_css_selector(".optionsBtn")
+
+                for button in buttons:
+
+                    button.click()
+                    self.driver.switch_to_default_content()
+                    ui.WebSelf.DriverWait(self.driver, 20).until(EC.presence_of_element_located((By.ID, "PORTFOLIO")))
+                    self.driver.find_element_by_xpath('//*[@id="PORTFOLIO"]/a').click()
+                    self.driver.switch_to_frame("ifrDealingRates")
+
+                self.driver.switch_to_default_content()
+                self.driver.switch_to_frame("ifrFinder")
 
     def JStest(self):
         """Starts running a JavaScript 'console' for debugging purposes."""
@@ -477,9 +693,11 @@ class NadexSearch:
 
         while command != 'exit JS':
             try:
-                self.driver.execute_script(command)
+                with self.driverLock:
+                    self.driver.execute_script(command)
                 try:
-                    print(self.driver.execute_script(command))
+                    with self.driverLock:
+                        print(self.driver.execute_script(command))
                 except:  # FIX ME: catch actual exception
                     pass
             except:  # FIX ME: catch actual exception
@@ -487,62 +705,74 @@ class NadexSearch:
 
             command = input('>>>')
 
+    def shutdown(self):
+        """Stops every thread and process that was started and frees the shared tick buffer."""
+
+        self.sessionManager.stop()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        if self.positionMonitor is not None:
+            self.positionMonitor.stop()
+        self.orderPipeline.stop()
+        if self.priceHistoryProcess is not None and self.priceHistoryProcess.is_alive():
+            self.priceHistoryProcess.terminate()
+            self.priceHistoryProcess.join()
+        if self.launcher is not None:
+            self.launcher.stop()
+            self.launcher = None
+        if self.tickBuffer is not None:
+            self.tickBuffer.close()
+            self.tickBuffer.unlink()
+            self.tickBuffer = None
+        if self.sessionPool is not None:
+            self.sessionPool.quit()
+        if self.manager is not None:
+            self.manager.shutdown()
+            self.manager = None
+
+    def printTime(self, timer):
+        """Prints how long a timed menu action took, next to the typical and worst case so far."""
+
+        histogram = timer.histogram
+        print("\nTime elapsed: ", timer.elapsed, "seconds.")
+        print("Median time: ", histogram.percentile(50), "seconds.  99th percentile: ", histogram.percentile(99), "seconds.")
+
     def mainMenu(self):
         """The main menu of the program where the user can manually tell it what to do.
         Mostly for debuging purposes, since most of these things should be automated eventually."""
 
-        global optionConnectionParent, optionConnectionChild, priceGatheringChild, priceGatheringParent
-        global motherOfAllUnderlying, currentExpiries
-        global price_time_parent, price_time_child
-
-        priceGatheringChild.send(False)
-
         while True:
             print("\nPress 1 to scan for options.\nPress 2 to fill the watchlist with open Forex binaries.")
             print("Press 3 to demonstrate purchasing.\nPress 4 to print option names.\nPress 5 to print option prices.")
             print("Press 6 to start gathering price data.\nPress 7 to print sell price data.\nPress 8 to print buy price data.")
-            menu = str(input("Press 9 to start trading.\nPress 0 to enter JavaScript console.")).lower()
-
-            if menu == "1":
-                spread = eval(input("Enter a spread: "))
-                start_time = time.time()
+            print("Press 9 to start trading.\nPress m to print latency metrics.\nPress r to replay a recorded tape.")
+            print("Press a to scan for arbitrage.\nPress v to print the volatility surface.")
+            print("Press p to print positions and working orders.\nPress c to reload the rate curves.")
+            menu = str(input("Press 0 to enter JavaScript console.")).lower()
 
-                self.scanner(spread)
+            if menu in self.browserOptions and self.driver is None:
+                print("Not available in pricing-only mode.")
 
-                timeTracker[1].append(time.time() - start_time)
-                print("\nTime elapsed: ", timeTracker[1][-1], "seconds.")
-                print("Average time: ", np.mean(timeTracker[1]), "seconds.")
+            elif menu == "1":
+                spread = eval(input("Enter a spread: "))
+                pair = input("Currency pair (leave blank for all): ").strip().upper() or None
+                with metrics.timer('menu.scanner') as timer:
+                    self.scanner(spread, pair=pair)
+                self.printTime(timer)
 
             elif menu == "2":
-                start_time = time.time()
-                self.fillWatchlist()
-                timeTracker[2].append(time.time() - start_time)
-                print("\nTime elapsed: ", timeTracker[2][-1], "seconds.")
-                print("Average time: ", np.mean(timeTracker[2]), "seconds.")
+                with metrics.timer('menu.fillWatchlist') as timer:
+                    self.fillWatchlist()
+                self.printTime(timer)
 
             elif menu == "3":
-                if not priceGatheringParent.recv():
-                    currentPrices = self.getPrices()
-                    if currentPrices:
-
-                        for x in range(0, len(currentPrices)):
-                            newParent, newChild = Pipe()
-                            optionConnectionParent.append(newParent)
-                            optionConnectionChild.append(newChild)
-
-                        priceHistoryProcess = Process(target=self.priceHistory,
-                                                      args=(len(currentPrices),
-                                                            optionConnectionChild,
-                                                            price_time_child,
-                                                            priceGatheringChild))
-                        priceHistoryProcess.start()
+                if self.tickBuffer is None:
+                    self.startPriceHistory()
 
                 if not self.optionList:
-                    self.makeOptions(optionConnectionChild)
+                    self.makeOptions(self.tickBuffer)
 
-                purchasingDemonstration = Process(target=self.placeOrderExample, args=())
-                purchasingDemonstration.start()
-                purchasingDemonstration.join()
+                self.placeOrderExample()
 
             elif menu == "4":
                 clean = input("Remove unpriced options? [0/1]")
@@ -556,13 +786,9 @@ class NadexSearch:
                     clean = True
 
                 try:
-                    start_time = time.time()
-
-                    print(self.getOptionNames(clean))
-
-                    timeTracker[4].append(time.time() - start_time)
-                    print("\nTime elapsed: ", timeTracker[4][-1], "seconds.")
-                    print("Average time: ", np.mean(timeTracker[4]), "seconds.")
+                    with metrics.timer('menu.optionNames') as timer:
+                        print(self.getOptionNames(clean))
+                    self.printTime(timer)
 
                 except:  # FIX ME: catch actual exception
                     print("Invalid input")
@@ -578,111 +804,183 @@ class NadexSearch:
                     print("Invalid input, assuming 1.")
 
                 try:
-                    start_time = time.time()
-
-                    print(self.getPrices(clean))
-                    timeTracker[5].append(time.time() - start_time)
-                    print("\nTime elapsed: ", timeTracker[5][-1], "seconds.")
-                    print("Average time: ", np.mean(timeTracker[5]), "seconds.")
+                    with metrics.timer('menu.prices') as timer:
+                        print(self.getPrices(clean))
+                    self.printTime(timer)
 
                 except:  # FIX ME: catch actual exception
                     print("Invalid input")
 
             elif menu == "6":
-                if not priceGatheringParent.recv():
-                    currentPrices = self.getPrices()
-                    if currentPrices:
-                        # optionConnectionParent, optionConnectionChild = [Pipe() for p in currentPrices]
-                        for x in range(0, len(currentPrices)):
-                            newParent, newChild = Pipe()
-                            optionConnectionParent.append(newParent)
-                            optionConnectionChild.append(newChild)
-
-                        priceHistoryProcess = Process(target=self.priceHistory, args=(len(currentPrices), optionConnectionChild, price_time_child, priceGatheringChild))
-                        priceHistoryProcess.start()
-                else:
-                    print("This process is already running.")
+                tapePath = input("Record to tape file (leave blank to not record): ").strip()
+                push = input("Push price changes from the browser instead of polling? [0/1]") == '1'
+                self.startPriceHistory(tapePath=tapePath or None, push=push)
 
             elif menu == "7":
-                for pipe in optionConnectionParent:
-                    print(pipe.recv())
+                if self.tickBuffer is not None:
+                    print(self.tickBuffer.latest(10)['sell'])
 
             elif menu == "8":
-                for pipe in optionConnectionParent:
-                    print(pipe.recv())
+                if self.tickBuffer is not None:
+                    print(self.tickBuffer.latest(10)['buy'])
 
             elif menu == "9":
-                if not priceGatheringParent.recv():
-                    currentPrices = self.getPrices()
-                    if currentPrices:
-                        # optionConnectionParent, optionConnectionChild = [Pipe() for p in currentPrices]
-                        for x in range(0, len(currentPrices)):
-                            newParent, newChild = Pipe()
-                            optionConnectionParent.append(newParent)
-                            optionConnectionChild.append(newChild)
-
-                        priceHistoryProcess = Process(target=self.priceHistory,
-                                                      args=(len(currentPrices),
-                                                            optionConnectionChild,
-                                                            price_time_child,
-                                                            priceGatheringChild))
-                        priceHistoryProcess.start()
-                        while not motherOfAllSellPrices:
-                            pass
-
-                self.startTrading(optionConnectionChild)
+                if self.tickBuffer is None and self.startPriceHistory() is not None:
+                    while self.tickBuffer.count == 0:
+                        time.sleep(0.01)
 
-            elif menu == "0":
-                self.JStest()
+                self.startTrading(self.tickBuffer)
 
-            elif menu.lower() in ("exit", "quit", "stop", "abort", "end"):
-                break
-
-            else:
-                print("Invalid input.")
+            elif menu == "m":
+                print(metrics.report())
+                if self.scheduler is not None:
+                    print("Strategy queue depth: ", self.scheduler.queueDepth)
+                print("Order queue depth: ", self.orderPipeline.queueDepth)
+                print("Last volatility update: ", self.optionBook.incrementalVolatility.counts)
 
+            elif menu == "a":
+                with metrics.timer('menu.arbitrage') as timer:
+                    self.arbitrage()
+                self.printTime(timer)
 
-"""                     GLOBAL VARIABLES            """
-manager = Manager()
-motherOfAllBuyPrices = manager.list()
-motherOfAllContractNames = manager.list()
-motherOfAllSellPrices = manager.list()
-motherOfAllUnderlying = manager.list()
-currentExpiries = manager.list()
-nadex = NadexSearch()
-processIDs = manager.list()
-queueList = []
-
-# EUR rate is incorrect. I don't know how to find the risk-free rate for the EU as a whole.
-# I'm making the approximation that it's equal to the UK's.
-ticketsOpen = -1
-timeTracker = [[] for i in range(1, 11)]
+            elif menu == "v":
+                if not self.optionList:
+                    self.makeOptions(self.tickBuffer)
+                print(self.volatilitySurface.report())
+                print("Last surface update: ", self.volatilitySurface.counts)
 
-"""                     PIPES                       """
+            elif menu == "p":
+                print(self.startPositionMonitor().report())
+                print("\n" + self.riskAggregator.report())
 
-optionConnectionParent = []
-optionConnectionChild = []  # Later these are turned into arrays of pipes
-priceGatheringParent, priceGatheringChild = Pipe()
-price_time_parent, price_time_child = Pipe()
+            elif menu == "c":
+                self.loadRates()
 
-"""                     MAIN                        """
+            elif menu == "r":
+                tapePath = input("Tape file: ").strip()
+                realtime = input("Replay at the recorded pace? [0/1]") == '1'
+                try:
+                    self.replay(tapePath, realtime)
+                except (OSError, ValueError) as error:
+                    print("Could not open the tape:", error)
 
-# Gather exchange rates headlessly while the browser signs in.
-rates = Process(target=nadex.getExchangeRates, args=())
-rates.start()
+            elif menu == "0":
+                self.JStest()
 
-nadex.signIn()
+            elif menu.lower() in ("exit", "quit", "stop", "abort", "end"):
+                break
 
-rates.join()
+            else:
+                print("Invalid input.")
 
-nadex.mainMenu()
 
-print("\nFinished.")
+def build(pricingOnly=False, dataSessions=1, driverFactory=None, watchlists=None):
+    """Constructs a NadexSearch and the components it runs on, without signing in or reading any prices.
+    Pricing-only skips the browser and the Manager entirely: prices come from a replayed tape.
+    Otherwise driverFactory (webdriver.Firefox by default) makes the browser sessions, and more than one
+    dataSessions splits the watchlist across that many of them (see SessionPool). watchlists gives each data
+    session the position of a watchlist holding only its shard; without them every session still reads the
+    whole watchlist and only leaves out the other shards' rows."""
+
+    if pricingOnly:
+        return NadexSearch()
+
+    manager = Manager()  # Started before any browser, so its server process is forked from a single thread.
+    if driverFactory is None:
+        from selenium import webdriver  # Only the browser mode pays for importing Selenium.
+        driverFactory = webdriver.Firefox
+    # The session locks are multiprocessing locks made here, before startLauncher forks the process that
+    # priceHistory is started from, so the scrapes there take the same locks as the orders and re-logins here.
+    if dataSessions > 1:
+        if watchlists is None:
+            print("Warning: without --watchlists every data session reads the whole watchlist.")
+        pool = SessionPool(driverFactory, NadexSearch.currencyPairs, dataSessions, watchlists, lockFactory=Lock).start()
+        nadex = NadexSearch(sessionPool=pool)
+    else:
+        nadex = NadexSearch(driverFactory(), driverLock=Lock())
+    nadex.manager = manager
+    nadex.processIDs = manager.list()
+    return nadex
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Scans, prices and trades Nadex Forex binaries from a menu.")
+    parser.add_argument('--pricing-only', action='store_true',
+                        help="No browser, sign-in, Manager or rate fetch; prices come from --replay or menu option r.")
+    parser.add_argument('--replay', metavar='TAPE', help="Replays a recorded tape instead of the live watchlist.")
+    parser.add_argument('--realtime', action='store_true', help="Replays the tape at the recorded pace.")
+    parser.add_argument('--data-sessions', type=int, default=1,
+                        help="Browser sessions to split the watchlist across (see SessionPool).")
+    parser.add_argument('--watchlists', type=int, nargs='+', metavar='POSITION',
+                        help="Position in the watchlist drop-down of each data session's own watchlist, which "
+                             "should hold only the pairs of its shard (see SessionPool).")
+    parser.add_argument('--metrics', default='metrics.json', help="File the latency metrics are dumped to.")
+    parser.add_argument('--cookies', default='session.json', help="File the session cookies are saved to.")
+    parser.add_argument('--rates', help="Rate curve file (see RateCurve); flat default rates if not given.")
+    parser.add_argument('--rate-url', help="Server of the Yahoo quote pages the exchange rates are read from.")
+    args = parser.parse_args(argv)
+    if args.watchlists is not None and len(args.watchlists) != args.data_sessions:
+        parser.error("--watchlists needs one position for each of the %d data sessions." % args.data_sessions)
+    return args
+
+
+def start(args, driverFactory=None):
+    """Builds a NadexSearch for the parsed arguments and gets it as far as the menu: the tape is opened,
+    the rate curves loaded and the browser signed in. Exchange rates are only waited for when nothing else
+    prices the contracts; a replayed tape has the indicative prices, and pricing-only does not fetch them at all."""
+
+    nadex = build(args.pricing_only, args.data_sessions, driverFactory, args.watchlists)
+    nadex.sessionManager.cookiePath = args.cookies
+    if args.rate_url:
+        nadex.rateProvider = ExchangeRateProvider(YahooRateSource(args.rate_url))
+    if args.replay:
+        nadex.replay(args.replay, args.realtime)
+
+    # EUR rate is incorrect. I don't know how to find the risk-free rate for the EU as a whole.
+    # I'm making the approximation that it's equal to the UK's. A curve file given with --rates replaces it.
+    if args.rates:
+        nadex.loadRates(args.rates)
+
+    # The last point at which no thread is running yet.
+    nadex.startLauncher()
+
+    # Gather exchange rates headlessly while the browser signs in.
+    rates = None
+    if not args.pricing_only:
+        rates = threading.Thread(target=nadex.getExchangeRates, args=(), daemon=True)
+        rates.start()
+
+    if nadex.driver is not None and nadex.signIn():
+        nadex.keepSignedIn()
+
+    if rates is not None and not args.replay:
+        rates.join()
+    return nadex
+
+
+def main(argv=None):
+    """Runs the menu. SciPy and Selenium are imported inside the functions that use them (the pricers, the
+    solver, the browser components), so --pricing-only and a plain import never pay for them."""
+
+    args = parseArguments(argv)
+    nadex = start(args)
+
+    metrics.startDumping(args.metrics, 60.0)
+    try:
+        nadex.mainMenu()
+    finally:
+        nadex.shutdown()
+        metrics.stopDumping()
+
+    print("\nFinished.")
+
+
+if __name__ == "__main__":
+    main()
 
 """
                             THINGS TO CLEAN UP:
 
--Remove all globals and make them attributes of the class.
 -Make all exceptions specify a type of exeption.
 -Look for an remove redundant/useless code.
 
@@ -691,20 +989,10 @@ print("\nFinished.")
 """
                             KNOWN BUGS:
 
-# priceHistory() is broken: doesn't return times or underlying; prices stop being appended to the list after a short while.
-
                             TO DO:
 
-# Remove global variables and place them inside the class.
-
 # Create a "process manager" class to control the processes.
 
 #
 
-# Arbitrage!
-
-# A function is needed to monitor working orders.
-
-# A function is needed to monitor open positions.
-
 """
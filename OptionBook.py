@@ -0,0 +1,290 @@
+import threading
+
+import numpy as np
+
+from BinaryPricer import BinaryPricer
+from CurrencyOption import CurrencyOption
+from GreeksEngine import GreeksEngine
+from IncrementalVolatility import IncrementalVolatility
+from RateCurve import RateCurve
+from VolatilitySolver import VolatilitySolver
+
+
+class OptionBook:
+    """Every contract of the watchlist, stored as NumPy columns with one row per contract.
+    Static fields (strike, currencies, tick buffer column) are set once when a contract is added; live fields
+    (prices, underlying, expiry, volatility, d1, d2 and the Greeks) are updated for many rows at a time.
+    The rates and discount factors of both currencies follow each contract's expiry on rateCurve. Rows whose expiry
+    moved are looked up again in one go before they are next solved or priced (see updateRates), and so is every
+    row once the curve is reloaded.
+    Contracts are addressed by row or by name: book[3] and book['EUR/USD >1.0850 (3PM)'] both return
+    a CurrencyOption, which is only a view of its row.
+
+    The strategy workers solve and price rows while the main thread adds contracts (which may reallocate every
+    column) and refreshes them, so every method that writes the columns holds lock. Hold it as well to read
+    several fields of a row that must belong together."""
+
+    floatColumns = ('strike', 'r_domestic', 'r_foreign', 'domesticDiscount', 'foreignDiscount', 'buy', 'sell',
+                    'underlying', 'expiry', 'tickTime', 'volatility', 'd1', 'd2', 'solvedBuy', 'solvedUnderlying',
+                    'solvedExpiry')
+    boolColumns = ('doExpiry', 'converged', 'solved', 'greeksValid', 'ratesValid')
+
+    def __init__(self, tickBuffer=None, capacity=64, solver=None, rateCurve=None):
+        self.tickBuffer = tickBuffer  # Shared TickBuffer written by NadexSearch.priceHistory.
+        self.lock = threading.RLock()
+        self.solver = solver or VolatilitySolver()
+        self.greeksEngine = GreeksEngine()
+        self.binaryPricer = BinaryPricer(self.solver.payout)
+        self.incrementalVolatility = IncrementalVolatility(self.solver)
+        self.rateCurve = rateCurve or RateCurve()
+        self.rateVersion = self.rateCurve.version
+        self.currencies = []  # Every currency in the book; domesticCode and foreignCode index it.
+        self.currencyCodes = {}
+        self.names = []
+        self.countries = []
+        self.rows = {}  # Name to row.
+        self.count = 0
+        self.capacity = 0
+        for column in self.floatColumns:
+            setattr(self, column, np.empty(0))
+        for column in self.boolColumns:
+            setattr(self, column, np.zeros(0, dtype=bool))
+        self.tickIndex = np.zeros(0, dtype=np.int64)  # Each contract's column in tickBuffer.
+        self.domesticCode = np.zeros(0, dtype=np.int64)
+        self.foreignCode = np.zeros(0, dtype=np.int64)
+        self.greekValues = np.empty((len(GreeksEngine.fields), 0))
+        self.binaryValues = np.empty((len(BinaryPricer.fields), 0))  # Valid along with greekValues.
+        self.grow(capacity)
+
+    def grow(self, capacity):
+        """Makes room for capacity contracts. Columns are reallocated, so arrays taken from them earlier go stale;
+        CurrencyOption views stay valid since they look their row up every time."""
+
+        def resize(array, fill):
+            grown = np.full(array.shape[:-1] + (capacity,), fill, dtype=array.dtype)
+            grown[..., :self.count] = array[..., :self.count]
+            return grown
+
+        with self.lock:
+            for column in self.floatColumns:
+                setattr(self, column, resize(getattr(self, column), np.nan))
+            for column in self.boolColumns:
+                setattr(self, column, resize(getattr(self, column), False))
+            self.tickIndex = resize(self.tickIndex, -1)
+            self.domesticCode = resize(self.domesticCode, -1)
+            self.foreignCode = resize(self.foreignCode, -1)
+            self.greekValues = resize(self.greekValues, np.nan)
+            self.binaryValues = resize(self.binaryValues, np.nan)
+            self.capacity = capacity
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, name):
+        return name in self.rows
+
+    def __getitem__(self, key):
+        """Returns the CurrencyOption view of a row number or contract name."""
+
+        row = self.rows[key] if isinstance(key, str) else int(key)
+        if not -self.count <= row < self.count:
+            raise IndexError("No contract in row " + str(row) + ".")
+        return CurrencyOption(self, row % self.count)
+
+    def __iter__(self):
+        for row in range(self.count):
+            yield CurrencyOption(self, row)
+
+    def rowsOf(self, options):
+        """Row numbers of a list of views (or all rows for None), as an index array."""
+
+        if options is None:
+            return np.arange(self.count)
+        return np.fromiter((option.row for option in options), dtype=np.int64)
+
+    def add(self, name, buy, sell, exchangeRate, expiry, indicative, tickIndex):
+        """Adds a contract, or updates the prices of the one with that name, and returns its view.
+        Like the original CurrencyOption, the underlying follows the indicative price if there is one,
+        and otherwise stays at exchangeRate."""
+
+        with self.lock:
+            row = self.rows.get(name)
+            if row is None:
+                # Everything that can raise comes first, so an unsupported pair leaves no half-added row.
+                strike, countries = CurrencyOption.parseName(name)
+                domesticCode = self.currencyCode(countries[0])
+                foreignCode = self.currencyCode(countries[1])
+                if self.count == self.capacity:
+                    self.grow(2*self.capacity)
+                row = self.rows[name] = self.count
+                self.count += 1
+                self.names.append(name)
+                self.countries.append(countries)
+                self.strike[row] = strike
+                self.domesticCode[row] = domesticCode
+                self.foreignCode[row] = foreignCode
+
+            self.tickIndex[row] = tickIndex
+            self.buy[row] = buy
+            self.sell[row] = sell
+            if self.expiry[row] != expiry:
+                self.expiry[row] = expiry
+                self.ratesValid[row] = False
+            self.doExpiry[row] = isinstance(indicative, float)
+            self.underlying[row] = indicative if self.doExpiry[row] else exchangeRate
+            return CurrencyOption(self, row)
+
+    def currencyCode(self, currency):
+        if currency not in self.currencyCodes:
+            if currency not in self.rateCurve:
+                raise KeyError("No rate curve for " + currency + ".")
+            self.currencyCodes[currency] = len(self.currencies)
+            self.currencies.append(currency)
+        return self.currencyCodes[currency]
+
+    def setRates(self, rows):
+        """Looks up the rates and discount factors of both currencies of rows at their current expiry."""
+
+        with self.lock:
+            rows = np.asarray(rows)
+            expiry = self.expiry[rows]
+            self.r_domestic[rows], self.domesticDiscount[rows] = self.rateCurve.lookupEach(self.currencies,
+                                                                                           self.domesticCode[rows], expiry)
+            self.r_foreign[rows], self.foreignDiscount[rows] = self.rateCurve.lookupEach(self.currencies,
+                                                                                         self.foreignCode[rows], expiry)
+            self.ratesValid[rows] = True
+
+    def updateRates(self, rows):
+        """Brings the rates of rows up to date with their expiry. After the curve was reloaded every row is looked
+        up again, and every volatility and Greek is treated as out of date, since they were found with the old rates."""
+
+        with self.lock:
+            if self.rateVersion != self.rateCurve.version:
+                self.rateVersion = self.rateCurve.version
+                self.ratesValid[:self.count] = False
+                self.solved[:self.count] = False
+                self.greeksValid[:self.count] = False
+                self.incrementalVolatility.reset()  # Solves everything again on its next update.
+            rows = np.asarray(rows)
+            stale = rows[~self.ratesValid[rows]]
+            if len(stale):
+                self.setRates(stale)
+
+    def refresh(self, rows=None):
+        """Reads the latest tick of every contract (or of rows) from tickBuffer in one consistent copy.
+        Returns the time the tick was recorded, or None if there is no tick yet."""
+
+        with self.lock:
+            rows = np.arange(self.count) if rows is None else np.asarray(rows)
+            tick = self.tickBuffer.latestRows(self.tickIndex[rows])
+            if tick is None:
+                return None
+            self.tickTime[rows], self.sell[rows], self.buy[rows], underlying, expiry = tick
+            self.ratesValid[rows] &= self.expiry[rows] == expiry  # Like add(), only where the expiry moved.
+            self.expiry[rows] = expiry
+            self.underlying[rows] = np.where(self.doExpiry[rows], underlying, self.underlying[rows])
+            return float(tick[0, 0]) if len(rows) else None
+
+    def setVolatility(self, rows, volatility, d1, d2, converged=True):
+        """Stores volatilities solved elsewhere and marks the Greeks of those rows as out of date."""
+
+        with self.lock:
+            self.volatility[rows] = volatility
+            self.d1[rows] = d1
+            self.d2[rows] = d2
+            self.converged[rows] = converged
+            self.markSolved(rows)
+            self.greeksValid[rows] = False
+
+    def markSolved(self, rows):
+        with self.lock:
+            self.solvedBuy[rows] = self.buy[rows]
+            self.solvedUnderlying[rows] = self.underlying[rows]
+            self.solvedExpiry[rows] = self.expiry[rows]
+            self.solved[rows] = True
+
+    def stale(self, rows):
+        """Rows never solved, or whose price, underlying or expiry moved since their volatility was solved,
+        with the same tolerance on the expiry as incrementalVolatility."""
+
+        return ~self.solved[rows] | self.incrementalVolatility.changed(
+            (self.buy[rows], self.underlying[rows], self.expiry[rows]),
+            (self.solvedBuy[rows], self.solvedUnderlying[rows], self.solvedExpiry[rows]))
+
+    def solve(self, rows=None, precision=0.05):
+        """Brings the volatility of rows (default all) up to date in one vectorized pass.
+        Only contracts whose inputs changed since the last call are solved again, warm-started from their
+        previous volatility; incrementalVolatility.counts has the skipped/warm/cold counts of the call.
+        Returns the rows whose volatility was stored, i.e. the ones that may have moved."""
+
+        with self.lock:
+            rows = np.arange(self.count) if rows is None else np.asarray(rows)
+            if not len(rows):
+                return rows
+            self.updateRates(rows)
+            volatility, d1, d2, converged, solved = self.incrementalVolatility.update(
+                rows, self.buy[rows], self.strike[rows], self.underlying[rows],
+                self.expiry[rows], self.r_domestic[rows], self.r_foreign[rows], precision,
+                self.domesticDiscount[rows])
+
+            # Rows that were never solved take the stored result; the rest are close enough to their last solve,
+            # so they are marked solved to keep greeks() from solving them again on their own.
+            update = solved | ~self.solved[rows]
+            self.setVolatility(rows[update], volatility[update], d1[update], d2[update], converged[update])
+            self.markSolved(rows[~update])
+            return rows[update]
+
+    def resolveStale(self, rows, precision=0.05):
+        """Solves rows whose inputs moved since their volatility was solved again, from their last volatility."""
+
+        with self.lock:
+            rows = np.asarray(rows)
+            self.updateRates(rows)
+            stale = rows[self.stale(rows)]
+            if len(stale):
+                volatility, d1, d2, converged, warm = self.solver.resolve(self.buy[stale], self.strike[stale],
+                                                                          self.underlying[stale], self.expiry[stale],
+                                                                          self.r_domestic[stale], self.r_foreign[stale],
+                                                                          np.where(self.converged[stale],
+                                                                                   self.volatility[stale], np.nan),
+                                                                          precision, self.domesticDiscount[stale])
+                self.setVolatility(stale, volatility, d1, d2, converged)
+
+    def greeks(self, rows=None, precision=0.05):
+        """Returns every Greek of rows (default all) as a dictionary of arrays.
+        Rows whose inputs moved are solved again first, and only rows without valid Greeks are computed."""
+
+        with self.lock:
+            rows = np.arange(self.count) if rows is None else np.asarray(rows)
+            self.resolveStale(rows, precision)
+            self.computeGreeks(rows[~self.greeksValid[rows]])
+            return dict(zip(GreeksEngine.fields, self.greekValues[:, rows]))
+
+    def binaryGreeks(self, rows=None, precision=0.05):
+        """Returns the binary price, delta, gamma, vega and theta of rows (default all) as a dictionary of arrays
+        (see BinaryPricer). Like greeks(), rows whose inputs moved are solved again first, and only rows without
+        valid Greeks are computed."""
+
+        with self.lock:
+            rows = np.arange(self.count) if rows is None else np.asarray(rows)
+            self.resolveStale(rows, precision)
+            self.computeGreeks(rows[~self.greeksValid[rows]])
+            return dict(zip(BinaryPricer.fields, self.binaryValues[:, rows]))
+
+    def computeGreeks(self, rows):
+        """Computes the Greeks and the binary Greeks of rows from their current volatility into greekValues
+        and binaryValues."""
+
+        with self.lock:
+            if len(rows):
+                self.updateRates(rows)
+                columns = self.greeksEngine.compute(self.underlying[rows], self.strike[rows], self.expiry[rows],
+                                                    self.volatility[rows], self.d1[rows], self.d2[rows],
+                                                    self.r_domestic[rows], self.r_foreign[rows],
+                                                    self.domesticDiscount[rows], self.foreignDiscount[rows])
+                self.greekValues[:, rows] = [columns[field] for field in GreeksEngine.fields]
+                binary = self.binaryPricer.compute(self.underlying[rows], self.strike[rows], self.expiry[rows],
+                                                   self.volatility[rows], self.r_domestic[rows], self.r_foreign[rows],
+                                                   self.domesticDiscount[rows])
+                self.binaryValues[:, rows] = [binary[field] for field in BinaryPricer.fields]
+                self.greeksValid[rows] = True
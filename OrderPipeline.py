@@ -0,0 +1,181 @@
+from collections import deque
+import queue
+import threading
+import time
+
+from Metrics import metrics
+
+
+class Order:
+    """One order travelling through the OrderPipeline.
+    stages holds the seconds each step took; result is set once the order is finished."""
+
+    def __init__(self, option, lotSize, short, tickTime=None):
+        self.option = option
+        self.lotSize = lotSize
+        self.short = short
+        self.level = option.sellPrice if short else option.buyPrice
+        self.tickTime = tickTime  # When the tick that triggered the order was recorded.
+        self.queuedTime = time.time()
+        self.stages = {}
+        self.tickToOrder = None
+        self.result = None
+        self.finished = threading.Event()
+        self.maxWait = None  # Set by OrderPipeline.submit to the longest the order can take from then on.
+
+    def wait(self, timeout=None):
+        """Blocks until the order is finished, or for at most timeout (maxWait by default), and returns its result,
+        which is None if the order is not finished by then."""
+
+        self.finished.wait(timeout if timeout is not None else self.maxWait)
+        return self.result
+
+
+class OrderPipeline:
+    """Places orders one at a time from a queue on a dedicated thread.
+    Every step waits on the betslip's actual state with a timeout instead of sleeping or spinning,
+    the slip is filled and submitted in one script call, and each stage is timed:
+    openTicket, slipReady, submit and confirm.
+    lock (e.g. NadexSearch.driverLock) is held from opening the ticket until it is confirmed, so nothing else
+    on the same browser, such as a scrape or a re-login, runs while a betslip is open."""
+
+    stageNames = ('openTicket', 'slipReady', 'submit', 'confirm')
+
+    # Ready once the price is shown and every control the fill script touches exists.
+    slipReadyScript = """var doc = window.parent.frames['ifrBetslip-' + arguments[0]].document;
+                         var price = doc.getElementById('dmaPriceCurrent');
+                         return price !== null && !isNaN(parseFloat(price.textContent)) &&
+                                doc.getElementById('directionChange') !== null && doc.getElementById('size') !== null &&
+                                doc.getElementById('level') !== null && doc.getElementById('btnSubmit') !== null;"""
+
+    fillScript = """var doc = window.parent.frames['ifrBetslip-' + arguments[0]].document;
+                    doc.getElementById('directionChange').click();
+                    if(arguments[2]){
+                        doc.getElementById('directionChange').click();
+                    }
+                    doc.getElementById('size').value = arguments[1];
+                    doc.getElementById('level').value = arguments[3];
+                    doc.getElementById('btnSubmit').click();
+                    return true;"""
+
+    # Clicks the close button of the confirmation as soon as it shows up.
+    confirmScript = """var close = window.parent.frames['ifrBetslip-' + arguments[0]].document.getElementById('betslipBtnClose');
+                       if(close === null){
+                           return false;
+                       }
+                       close.click();
+                       return true;"""
+
+    def __init__(self, driver, timeout=10.0, pollInterval=0.01, historySize=1000, lock=None):
+        self.driver = driver
+        self.lock = lock or threading.Lock()
+        self.timeout = timeout
+        self.pollInterval = pollInterval
+        self.orders = queue.Queue()
+        self.history = deque(maxlen=historySize)  # Finished orders, newest last.
+        self.ticketsOpen = -1
+        self.worker = None  # Started by the first submit(), so a pipeline that never trades costs nothing.
+
+    @property
+    def maxWait(self):
+        """Longest an order submitted now can take: both waits of the order being placed, of those queued and its own."""
+
+        return 2*self.timeout*(self.queueDepth + 2)
+
+    def submit(self, option, lotSize=1, short=False, tickTime=None):
+        """Queues an order and returns it straight away; call order.wait() for the result."""
+
+        order = Order(option, lotSize, short, tickTime)
+        order.maxWait = self.maxWait
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.run, daemon=True)
+            self.worker.start()
+        self.orders.put(order)
+        return order
+
+    @property
+    def queueDepth(self):
+        return self.orders.qsize()
+
+    def run(self):
+        while True:
+            order = self.orders.get()
+            if order is None:
+                return
+            try:
+                with self.lock:
+                    order.result = self.place(order)
+            except Exception as error:  # E.g. a WebDriverException; the next order still gets placed.
+                order.result = "Error placing order: " + (str(error).strip() or repr(error))
+            finally:
+                metrics.increment('order.placed' if order.result == "Order placed." else 'order.failed')
+                self.history.append(order)
+                order.finished.set()
+
+    def stop(self):
+        if self.worker is None:
+            return
+        self.orders.put(None)
+        self.worker.join()
+        self.worker = None
+
+    def waitFor(self, script, *args):
+        """Runs script until it returns something truthy or the timeout passes."""
+
+        from selenium.common.exceptions import WebDriverException
+        import selenium.webdriver.support.ui as ui
+
+        wait = ui.WebDriverWait(self.driver, self.timeout, poll_frequency=self.pollInterval,
+                                ignored_exceptions=(WebDriverException,))
+        return wait.until(lambda driver: driver.execute_script(script, *args))
+
+    def place(self, order):
+        """Goes through every stage for one order and returns a short description of the outcome."""
+
+        from selenium.common.exceptions import NoSuchElementException, TimeoutException
+        from selenium.webdriver.common.by import By
+
+        start = time.time()
+        try:
+            self.driver.find_element(By.LINK_TEXT, order.option.name).click()
+        except NoSuchElementException:
+            return "Link_text not found."
+        self.ticketsOpen += 1
+        ticket = str(self.ticketsOpen)
+        last = self.mark(order, 'openTicket', start)
+
+        try:
+            try:
+                self.waitFor(self.slipReadyScript, ticket)
+            except TimeoutException:
+                return "Betslip did not load."
+            last = self.mark(order, 'slipReady', last)
+
+            self.driver.execute_script(self.fillScript, ticket, str(order.lotSize), order.short, str(order.level))
+            last = self.mark(order, 'submit', last)
+
+            try:
+                self.waitFor(self.confirmScript, ticket)
+            except TimeoutException:
+                return "Order was not confirmed."
+            self.mark(order, 'confirm', last)
+        finally:
+            self.ticketsOpen -= 1
+
+        metrics.record('order.total', time.time() - order.queuedTime)
+        if order.tickTime is not None:
+            order.tickToOrder = time.time() - order.tickTime
+            metrics.record('order.tickToOrder', order.tickToOrder)
+        return "Order placed."
+
+    def mark(self, order, stage, since):
+        now = time.time()
+        order.stages[stage] = now - since
+        metrics.record('order.' + stage, order.stages[stage])
+        return now
+
+    def averageStages(self):
+        """Average seconds per stage over every order that reached it."""
+
+        return {stage: metrics.histogram('order.' + stage).mean for stage in self.stageNames
+                if metrics.histogram('order.' + stage).count}
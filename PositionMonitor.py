@@ -0,0 +1,241 @@
+import math
+import queue
+import threading
+import time
+
+from Metrics import metrics
+
+
+class PositionMonitor:
+    """Follows the account's open positions, working orders and balance.
+    All three are read in one script call every interval, and each read is compared with the last one, so only
+    changes come out: positions opened, filled and closed, orders placed, filled and cancelled, P&L moves of at
+    least pnlStep dollars and balance changes. Events are dictionaries with a 'type'; they are put on the events
+    queue and passed to callback, if one is given.
+
+    Positions are kept by market, with the net size per currency pair and the working size per market kept
+    up to date as they change, so exposure(), pairExposure() and working() never touch the browser.
+    Sizes are signed: negative for short positions and sell orders. A size or level that cannot be read
+    (e.g. while the panel redraws) is taken to be unchanged instead of a new NaN on every read."""
+
+    positionsFrame = 'ifrOpenPositions'
+    ordersFrame = 'ifrWorkingOrders'
+    rowClass = 'yui-dt-rec'  # One record of a YUI data table, like the rows of the watchlist.
+    positionColumns = ('market', 'direction', 'size', 'openLevel', 'level', 'pnl')
+    orderColumns = ('market', 'direction', 'size', 'level')
+
+    readScript = """var top = window.parent;
+                    function panel(frameName){
+                        var frame = top.frames[frameName];
+                        if(!frame || !frame.document){
+                            return [];
+                        }
+                        var records = frame.document.getElementsByClassName('%s');
+                        var rows = [];
+                        for(var i = 0; i < records.length; i++){
+                            var cells = records[i].getElementsByTagName('td');
+                            var row = [];
+                            for(var j = 0; j < cells.length; j++){
+                                row.push(cells[j].textContent.trim());
+                            }
+                            rows.push(row);
+                        }
+                        return rows;
+                    }
+                    return {balance: top.document.getElementById('rsrcBalance').textContent,
+                            positions: panel('%s'),
+                            orders: panel('%s')};""" % (rowClass, positionsFrame, ordersFrame)
+
+    def __init__(self, driver, interval=1.0, pnlStep=1.0, callback=None, lock=None):
+        self.driver = driver
+        self.interval = interval
+        self.pnlStep = pnlStep
+        self.callback = callback
+        self.lock = lock or threading.Lock()  # Held while the script runs, e.g. a SessionPool session's lock.
+        self.balance = None
+        self.positions = {}  # Market to {'market', 'size', 'openLevel', 'level', 'pnl'}.
+        self.orders = {}  # (market, level) to signed size.
+        self.exposures = {}  # Currency pair to net signed size.
+        self.workingSizes = {}  # Market to net signed size of its working orders.
+        self.reportedPnl = {}  # Market to the P&L last reported for it.
+        self.events = queue.Queue()
+        self.reads = 0
+        self.running = False
+        self.worker = None
+
+    @staticmethod
+    def number(text):
+        try:
+            return float(text.replace('$', '').replace(',', ''))
+        except ValueError:
+            return float('nan')
+
+    def parse(self, table):
+        """Turns the cells read by readScript into (balance, positions, orders)."""
+
+        positions = {}
+        for row in table['positions']:
+            cells = dict(zip(self.positionColumns, row))
+            sign = -1 if cells.get('direction', '').lower().startswith('s') else 1
+            positions[cells['market']] = {'market': cells['market'],
+                                          'size': sign*self.number(cells.get('size', '')),
+                                          'openLevel': self.number(cells.get('openLevel', '')),
+                                          'level': self.number(cells.get('level', '')),
+                                          'pnl': self.number(cells.get('pnl', ''))}
+        orders = {}
+        for row in table['orders']:
+            cells = dict(zip(self.orderColumns, row))
+            sign = -1 if cells.get('direction', '').lower().startswith('s') else 1
+            key = (cells['market'], self.number(cells.get('level', '')))
+            if math.isnan(key[1]):  # NaN never equals itself, so the order is keyed without a level.
+                key = (cells['market'], None)
+            orders[key] = orders.get(key, 0.0) + sign*self.number(cells.get('size', ''))
+        return self.number(table['balance']), positions, orders
+
+    def read(self):
+        with self.lock:
+            with metrics.timer('positions.read'):
+                return self.driver.execute_script(self.readScript)
+
+    def poll(self):
+        """Reads the account once and returns the changes since the last read."""
+
+        events = self.apply(*self.parse(self.read()))
+        for event in events:
+            self.events.put(event)
+            if self.callback is not None:
+                self.callback(event)
+        return events
+
+    def apply(self, balance, positions, orders):
+        """Brings the state up to date with one read and returns what changed."""
+
+        now = time.time()
+        events = []
+        fills = {}  # Market to the change of its position.
+        self.reads += 1
+
+        if balance != self.balance and not math.isnan(balance):
+            if self.balance is not None:
+                events.append({'type': 'balance', 'time': now, 'balance': balance, 'change': balance - self.balance})
+            self.balance = balance
+
+        for market in self.positions.keys() | positions.keys():
+            old, new = self.positions.get(market), positions.get(market)
+            if new is not None and math.isnan(new['size']):  # Unreadable, e.g. mid-update: nothing changed yet.
+                self.keep(positions, market, old)
+                continue
+            oldSize = old['size'] if old is not None else 0.0
+            newSize = new['size'] if new is not None else 0.0
+            if newSize != oldSize:
+                kind = 'opened' if old is None else 'closed' if new is None else 'filled'
+                events.append({'type': kind, 'time': now, 'market': market, 'size': newSize,
+                               'change': newSize - oldSize, 'level': (new or old)['level'], 'pnl': (new or old)['pnl']})
+                fills[market] = newSize - oldSize
+                pair = market.split(" ")[0]
+                self.exposures[pair] = self.exposures.get(pair, 0.0) + newSize - oldSize
+            if new is None:
+                self.reportedPnl.pop(market, None)
+            elif abs(new['pnl'] - self.reportedPnl.get(market, 0.0)) >= self.pnlStep:
+                events.append({'type': 'pnl', 'time': now, 'market': market, 'pnl': new['pnl'],
+                               'change': new['pnl'] - self.reportedPnl.get(market, 0.0)})
+                self.reportedPnl[market] = new['pnl']
+
+        # The orders of a market with an unreadable level are taken to be as they were.
+        for market in {market for market, level in orders if level is None}:
+            for key in [key for key in orders if key[0] == market]:
+                del orders[key]
+            orders.update((key, size) for key, size in self.orders.items() if key[0] == market)
+
+        for key in self.orders.keys() | orders.keys():
+            market, level = key
+            oldSize, newSize = self.orders.get(key, 0.0), orders.get(key, 0.0)
+            if math.isnan(newSize):
+                self.keep(orders, key, self.orders.get(key))
+                continue
+            if newSize == oldSize:
+                continue
+            if not oldSize:
+                kind = 'orderPlaced'
+            elif newSize and abs(newSize) < abs(oldSize):
+                kind = 'orderPartlyFilled'
+            elif not newSize:
+                # An order that left the book while its position moved the same way was filled.
+                kind = 'orderFilled' if fills.get(market, 0.0)*oldSize > 0 else 'orderCancelled'
+            else:
+                kind = 'orderAmended'
+            events.append({'type': kind, 'time': now, 'market': market, 'level': level, 'size': newSize,
+                           'change': newSize - oldSize})
+            self.workingSizes[market] = self.workingSizes.get(market, 0.0) + newSize - oldSize
+
+        self.positions = positions
+        self.orders = orders
+        metrics.increment('positions.events', len(events))
+        return events
+
+    @staticmethod
+    def keep(table, key, old):
+        """Puts the previous entry of key back into a new read (or leaves it out, if there was none)."""
+
+        if old is None:
+            table.pop(key, None)
+        else:
+            table[key] = old
+
+    def exposure(self, market):
+        """Net signed size held in one market."""
+
+        position = self.positions.get(market)
+        return position['size'] if position is not None else 0.0
+
+    def pairExposure(self, pair):
+        """Net signed size held across every market of one currency pair."""
+
+        return self.exposures.get(pair, 0.0)
+
+    def working(self, market):
+        """Net signed size of the working orders in one market."""
+
+        return self.workingSizes.get(market, 0.0)
+
+    @property
+    def totalPnl(self):
+        return sum(position['pnl'] for position in self.positions.values())
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        self.running = False
+        if self.worker is not None:
+            self.worker.join()
+
+    def run(self):
+        from selenium.common.exceptions import WebDriverException
+
+        while self.running:
+            start = time.time()
+            try:
+                self.poll()
+            except (WebDriverException, KeyError, TypeError) as error:  # E.g. while the page reloads.
+                metrics.increment('positions.errors')
+                self.events.put({'type': 'error', 'time': start, 'error': str(error)})
+            time.sleep(max(self.interval - (time.time() - start), 0.0))
+
+    def report(self):
+        """Returns the positions and working orders as a printable table."""
+
+        lines = ["Balance: " + ("$%.2f" % self.balance if self.balance is not None else "unknown") +
+                 "   Open P&L: $%.2f" % self.totalPnl,
+                 "\n%-32s %6s %10s %10s %10s" % ("Position", "Size", "Open", "Level", "P&L")]
+        for market, position in sorted(self.positions.items()):
+            lines.append("%-32s %6g %10.2f %10.2f %10.2f" % (market, position['size'], position['openLevel'],
+                                                             position['level'], position['pnl']))
+        lines.append("\n%-32s %6s %10s" % ("Working order", "Size", "Level"))
+        for (market, level), size in sorted(self.orders.items()):
+            lines.append("%-32s %6g %10.2f" % (market, size, level))
+        return "\n".join(lines)
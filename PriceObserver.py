@@ -0,0 +1,163 @@
+import time
+
+import numpy as np
+
+from ExpiryParser import ExpiryParser
+from Metrics import metrics
+
+
+class PriceObserver:
+    """Push mode for the watchlist: a MutationObserver in the ifrMyPrices frame buffers every price and indicative
+    cell that changes, with the time it changed, and drain() collects the buffer in one WebDriver call.
+    The rest of the snapshot is kept from the last full read (NadexSearch.getSnapshot); times to expiry are
+    counted down locally instead of being watched, since every one of them changes each second.
+
+    getSnapshot() has the same form as NadexSearch.getSnapshot, so NadexSearch.priceHistory can use either.
+    A full read is done again when rows are added to or removed from the table, when the observer is gone
+    (e.g. after the page reloaded), and every resyncInterval seconds. Other mutations, such as the countdown
+    in the expiry cells, are ignored."""
+
+    priceClass = 'price dealOpen'
+    indicativeClass = 'yui-dt0-col-underlyingIndicativePrice yui-dt-col-underlyingIndicativePrice'
+    nameClass = 'floatLeft tableIcon dealOpen'
+    expiryClass = 'yui-dt0-col-timeToExpiry yui-dt-col-timeToExpiry yui-dt-sortable'
+
+    # Tags each watched cell with its column and row, so a mutation maps straight to a cell.
+    installScript = """var frame = window.parent.frames['ifrMyPrices'];
+                       var doc = frame.document;
+                       if(frame.ndxObserver){
+                           frame.ndxObserver.disconnect();
+                       }
+                       frame.ndxDeltas = [];
+                       frame.ndxResync = false;
+                       var columns = {prices: '%s', indicatives: '%s', expiry: '%s'};
+                       for(var key in columns){
+                           var cells = doc.getElementsByClassName(columns[key]);
+                           for(var i = 0; i < cells.length; i++){
+                               cells[i].setAttribute('data-ndx-column', key);
+                               cells[i].setAttribute('data-ndx-row', i);
+                           }
+                       }
+                       var table = doc.getElementsByClassName('%s')[0].closest('table');
+                       var hasRows = function(nodes){
+                           for(var n = 0; n < nodes.length; n++){
+                               if(nodes[n].nodeType === 1 &&
+                                  (nodes[n].nodeName === 'TR' || nodes[n].getElementsByTagName('tr').length)){
+                                   return true;
+                               }
+                           }
+                           return false;
+                       };
+                       frame.ndxObserver = new frame.MutationObserver(function(mutations){
+                           var now = Date.now()/1000;
+                           for(var m = 0; m < mutations.length; m++){
+                               var mutation = mutations[m];
+                               if(mutation.type === 'childList' &&
+                                  (hasRows(mutation.addedNodes) || hasRows(mutation.removedNodes))){
+                                   frame.ndxResync = true;  // Rows were added or removed.
+                                   continue;
+                               }
+                               var cell = mutation.target;
+                               if(cell.nodeType !== 1){
+                                   cell = cell.parentElement;
+                               }
+                               while(cell !== null && cell !== table && !cell.hasAttribute('data-ndx-column')){
+                                   cell = cell.parentElement;
+                               }
+                               if(cell === null || cell === table){
+                                   continue;
+                               }
+                               var column = cell.getAttribute('data-ndx-column');
+                               if(column === 'expiry'){
+                                   continue;  // Counted down locally; every one of them changes each second.
+                               }
+                               frame.ndxDeltas.push([now, column, parseInt(cell.getAttribute('data-ndx-row')),
+                                                     cell.textContent]);
+                           }
+                       });
+                       frame.ndxObserver.observe(table, {subtree: true, childList: true, characterData: true});
+                       return true;""" % (priceClass, indicativeClass, expiryClass, nameClass)
+
+    drainScript = """var frame = window.parent.frames['ifrMyPrices'];
+                     if(frame.ndxDeltas === undefined){
+                         return null;
+                     }
+                     var deltas = frame.ndxDeltas;
+                     frame.ndxDeltas = [];
+                     return {deltas: deltas, resync: frame.ndxResync};"""
+
+    def __init__(self, nadex, pollInterval=0.005, heartbeat=1.0, resyncInterval=60.0):
+        self.nadex = nadex
+        self.pollInterval = pollInterval  # How often to drain while nothing has changed.
+        self.heartbeat = heartbeat  # Longest wait for a change before a snapshot is returned anyway.
+        self.resyncInterval = resyncInterval
+        self.snapshot = None
+        self.readTime = 0.0
+        self.readExpiry = None
+        self.changes = 0  # Cells changed in the last drain.
+
+    def install(self):
+        """Reads the whole watchlist and starts observing it."""
+
+        self.snapshot = self.nadex.getSnapshot()
+        self.snapshot['sell'] = list(self.snapshot['sell'])
+        self.snapshot['buy'] = list(self.snapshot['buy'])
+        self.readTime = self.snapshot['timestamp']
+        self.readExpiry = np.asarray(self.snapshot['expiry'], dtype=float)
+        with self.nadex.driverLock:
+            self.nadex.driver.execute_script(self.installScript)
+        metrics.increment('push.installs')
+
+    def reset(self):
+        """Makes the next drain read the whole watchlist and install the observer again."""
+
+        self.snapshot = None
+
+    def drain(self):
+        """Applies every buffered change to the snapshot and returns how many cells changed.
+        Reinstalls the observer (a full read) when it is missing, the table changed or the resync interval passed."""
+
+        if self.snapshot is None or time.time() - self.readTime > self.resyncInterval:
+            self.install()
+            self.changes = len(self.snapshot['names'])
+            return self.changes
+
+        with self.nadex.driverLock, metrics.timer('scrape.drain'):
+            result = self.nadex.driver.execute_script(self.drainScript)
+        if result is None or result['resync']:
+            self.install()
+            self.changes = len(self.snapshot['names'])
+            return self.changes
+
+        snapshot = self.snapshot
+        for changed, column, row, text in result['deltas']:
+            if column == 'prices':
+                try:
+                    value = float(text)
+                except ValueError:
+                    value = text
+                snapshot['buy' if row % 2 else 'sell'][row//2] = value
+            elif row > 0:  # The first indicative cell is the title.
+                snapshot['indicative'][row - 1] = float(text) if '.' in text else text
+            snapshot['timestamp'] = max(snapshot['timestamp'], changed)
+
+        self.changes = len(result['deltas'])
+        metrics.increment('push.changes', self.changes)
+        return self.changes
+
+    def getSnapshot(self):
+        """Waits for the next change (or the heartbeat) and returns the watchlist in the getSnapshot form.
+        The lists in it are updated in place by later calls."""
+
+        start = time.time()
+        while not self.drain() and time.time() - start < self.heartbeat:
+            time.sleep(self.pollInterval)
+
+        now = time.time()
+        snapshot = self.snapshot
+        expiry = self.readExpiry - (now - self.readTime)/ExpiryParser.SECONDS_PER_YEAR
+        snapshot['expiry'] = np.where(expiry > 0, expiry, np.nan)
+        if not self.changes:
+            snapshot['timestamp'] = now
+        snapshot['latency'] = now - start
+        return snapshot
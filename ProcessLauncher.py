@@ -0,0 +1,102 @@
+from multiprocessing import Pipe, Process, resource_tracker
+import threading
+
+
+class LaunchedProcess:
+    """Handle on a process started by a ProcessLauncher, with the parts of the Process interface NadexSearch uses."""
+
+    def __init__(self, launcher, pid):
+        self.launcher = launcher
+        self.pid = pid
+
+    def is_alive(self):
+        return self.launcher.request('alive', self.pid)
+
+    def terminate(self):
+        self.launcher.request('terminate', self.pid)
+
+    def join(self, timeout=None):
+        self.launcher.request('join', self.pid, timeout)
+
+
+class ProcessLauncher:
+    """Forks helper processes from a process that was itself forked before any thread was started.
+    A process forked from the main one once threads are running inherits whatever locks those threads held at
+    that moment (the metrics registry, the session and order locks) and can hang on them for good.
+    start() should therefore be called early; launch() then runs a method of owner, as it was at start(),
+    in a new process, with arguments that are sent over a pipe and so must be picklable.
+    A launched process never runs in the same process as the caller, so any lock it shares with the caller
+    (e.g. NadexSearch.driverLock) has to be a multiprocessing lock that already exists when start() is called."""
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.connection = None
+        self.process = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        # Shared memory opened by a launched process is then tracked, and left alone, by the main process's
+        # tracker; one of its own would unlink the memory as soon as that process exits.
+        resource_tracker.ensure_running()
+        connection, child = Pipe()
+        self.process = Process(target=self.serve, args=(child,))
+        self.process.start()
+        child.close()
+        self.connection = connection
+        return self
+
+    def serve(self, connection):
+        processes = {}
+        try:
+            while True:
+                try:
+                    command, arguments = connection.recv()
+                except EOFError:
+                    break  # The main process is gone.
+                if command == 'stop':
+                    break
+                if command == 'launch':
+                    method, args = arguments
+                    process = Process(target=getattr(self.owner, method), args=args)
+                    process.start()
+                    processes[process.pid] = process
+                    connection.send(process.pid)
+                    continue
+
+                process = processes.get(arguments[0])
+                if command == 'alive':
+                    connection.send(process is not None and process.is_alive())
+                    continue
+                if process is not None:
+                    if command == 'terminate':
+                        process.terminate()
+                    elif command == 'join':
+                        process.join(arguments[1])
+                        if not process.is_alive():
+                            del processes[arguments[0]]
+                connection.send(None)
+        finally:
+            for process in processes.values():
+                process.terminate()
+                process.join()
+
+    def request(self, command, *arguments):
+        with self.lock:
+            self.connection.send((command, arguments))
+            return self.connection.recv()
+
+    def launch(self, method, *args):
+        """Runs owner.method(*args) in a new process and returns a handle on it."""
+
+        return LaunchedProcess(self, self.request('launch', method, args))
+
+    def stop(self):
+        """Ends the launcher and with it every process it launched."""
+
+        if self.process is None:
+            return
+        with self.lock:
+            self.connection.send(('stop', ()))
+            self.connection.close()
+        self.process.join()
+        self.process = None
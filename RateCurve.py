@@ -0,0 +1,169 @@
+import json
+import re
+import threading
+
+import numpy as np
+
+from CurrencyOption import CurrencyOption
+from ExpiryParser import ExpiryParser
+
+
+class RateCurve:
+    """Risk-free term structures per currency, read from a JSON file such as
+    {"USD": {"ON": 0.0250, "1W": 0.0251, "1M": 0.0252, "3M": 0.0255}, "EUR": {...}}.
+    Tenors are 'ON', a number of days, weeks, months or years ('2W', '6M', '1Y') or a plain number of years;
+    rates are continuously compounded. Between tenors the rate is interpolated linearly, outside them it is flat.
+    Currencies the file leaves out (or every currency, without a file) get a flat curve at CurrencyOption.riskFreeRates.
+
+    Rates and discount factors, exp(-rate*expiry), are kept per currency in tables of bucketSeconds wide expiry
+    buckets, filled the first time a bucket is asked for, so lookups are array indexing instead of an interpolation
+    and an exp. Expiries past tableDays are computed directly. reload() reads the file again, drops every table
+    and increments version, which is how an OptionBook notices that its rates are out of date."""
+
+    tenorPattern = re.compile(r"^(\d+(?:\.\d+)?)([DWMY])$")
+    tenorYears = {'D': 1/365.0, 'W': 7/365.0, 'M': 1/12.0, 'Y': 1.0}
+
+    def __init__(self, path=None, bucketSeconds=60.0, tableDays=31):
+        self.path = path
+        self.bucketWidth = bucketSeconds/ExpiryParser.SECONDS_PER_YEAR
+        self.tableBuckets = int(round(tableDays*86400/bucketSeconds)) + 1
+        self.lock = threading.Lock()
+        self.curves = {}  # Currency to (tenors in years, rates), sorted by tenor.
+        self.tables = {}  # Currency to (rates, discount factors) of buckets 0, 1, 2...; the (currency, bucket) cache.
+        self.grids = {}  # Tuple of currencies to their tables stacked into (currency x bucket) arrays.
+        self.version = 0
+        self.reload()
+
+    @classmethod
+    def tenor(cls, text):
+        """A tenor such as 'ON', '1W', '3M' or '0.5' in years."""
+
+        text = str(text).strip().upper()
+        if text in ('ON', 'O/N'):
+            return cls.tenorYears['D']
+        match = cls.tenorPattern.match(text)
+        if match is not None:
+            return float(match.group(1))*cls.tenorYears[match.group(2)]
+        return float(text)
+
+    def read(self, path):
+        with open(path) as file:
+            table = json.load(file)
+        curves = {}
+        for currency, points in table.items():
+            points = sorted((self.tenor(tenor), float(rate)) for tenor, rate in points.items())
+            if not points:
+                raise ValueError("The curve of " + currency + " has no points.")
+            curves[currency.upper()] = (np.array([t for t, r in points]), np.array([r for t, r in points]))
+        return curves
+
+    def reload(self):
+        """Reads the curve file again (or the flat defaults) and invalidates every cached rate and discount factor.
+        Raises OSError or ValueError, keeping the current curves, if the file cannot be read."""
+
+        curves = {currency: (np.zeros(1), np.array([rate])) for currency, rate in CurrencyOption.riskFreeRates.items()}
+        if self.path is not None:
+            curves.update(self.read(self.path))
+        with self.lock:
+            self.curves = curves
+            self.tables = {}
+            self.grids = {}
+            self.version += 1
+
+    def __contains__(self, currency):
+        return currency in self.curves
+
+    def rate(self, currency, expiry):
+        """Interpolated rate of currency at expiry (years, a number or an array); NaN for an unknown currency."""
+
+        curve = self.curves.get(currency)
+        if curve is None:
+            return np.full(np.shape(expiry), np.nan)
+        return np.interp(expiry, *curve)
+
+    def table(self, currency, buckets):
+        """The (rates, discount factors) table of currency, covering at least buckets buckets."""
+
+        table = self.tables.get(currency)
+        if table is not None and len(table[0]) >= buckets:
+            return table
+        with self.lock:  # A reload in the meantime must not be overwritten by a table of the old curves.
+            table = self.tables.get(currency)
+            if table is None or len(table[0]) < buckets:
+                size = min(max(buckets, 2*len(table[0]) if table is not None else 1024), self.tableBuckets)
+                expiry = np.arange(size)*self.bucketWidth
+                rates = self.rate(currency, expiry)
+                table = self.tables[currency] = (rates, np.exp(-rates*expiry))
+            return table
+
+    def grid(self, currencies, buckets):
+        """The tables of currencies (a tuple) stacked into (rates, discount factors) arrays with a row per currency,
+        so that elements of different currencies are looked up in one go."""
+
+        grid = self.grids.get(currencies)
+        if grid is not None and grid[0].shape[1] >= buckets:
+            return grid
+        tables = [self.table(currency, buckets) for currency in currencies]
+        width = min(len(rates) for rates, discounts in tables)
+        grid = (np.stack([rates[:width] for rates, discounts in tables]),
+                np.stack([discounts[:width] for rates, discounts in tables]))
+        with self.lock:
+            if all(self.tables.get(currency) is table for currency, table in zip(currencies, tables)):
+                self.grids[currencies] = grid  # Not kept if a reload came in between.
+        return grid
+
+    def lookup(self, currency, expiry):
+        """Returns (rates, discount factors) of currency at expiry (years, an array), NaN where expiry is not
+        a time to come or the currency is unknown."""
+
+        expiry = np.asarray(expiry, dtype=float)
+        rates = np.full(expiry.shape, np.nan)
+        discounts = np.full(expiry.shape, np.nan)
+        if currency not in self.curves:
+            return rates, discounts
+        with np.errstate(invalid='ignore'):
+            valid = np.isfinite(expiry) & (expiry >= 0)
+            position = np.rint(expiry/self.bucketWidth)
+            inTable = valid & (position < self.tableBuckets)
+        bucket = np.where(inTable, position, 0).astype(np.int64)
+        if inTable.any():
+            tableRates, tableDiscounts = self.table(currency, int(bucket[inTable].max()) + 1)
+            rates[inTable] = tableRates[bucket[inTable]]
+            discounts[inTable] = tableDiscounts[bucket[inTable]]
+        beyond = valid & ~inTable
+        if beyond.any():
+            rates[beyond] = self.rate(currency, expiry[beyond])
+            discounts[beyond] = np.exp(-rates[beyond]*expiry[beyond])
+        return rates, discounts
+
+    def lookupEach(self, currencies, codes, expiry):
+        """Like lookup, for a different currency per element: codes indexes the list currencies, -1 for none.
+        Every currency in currencies must have a curve."""
+
+        codes = np.asarray(codes)
+        expiry = np.asarray(expiry, dtype=float)
+        if not expiry.size:
+            return expiry.copy(), expiry.copy()
+        with np.errstate(invalid='ignore'):
+            position = np.rint(expiry/self.bucketWidth)
+            lowest, highest = position.min(), position.max()  # NaN if any expiry is.
+        if codes.min() >= 0 and lowest >= 0 and highest < self.tableBuckets:  # The usual case, in one gather.
+            gridRates, gridDiscounts = self.grid(tuple(currencies), int(highest) + 1)
+            flat = codes*gridRates.shape[1] + position.astype(np.int64)
+            return gridRates.take(flat), gridDiscounts.take(flat)
+
+        rates = np.full(expiry.shape, np.nan)
+        discounts = np.full(expiry.shape, np.nan)
+        with np.errstate(invalid='ignore'):
+            valid = (codes >= 0) & np.isfinite(expiry) & (expiry >= 0)
+            inTable = valid & (position < self.tableBuckets)
+        if inTable.any():
+            bucket = position[inTable].astype(np.int64)
+            gridRates, gridDiscounts = self.grid(tuple(currencies), int(bucket.max()) + 1)
+            rates[inTable] = gridRates[codes[inTable], bucket]
+            discounts[inTable] = gridDiscounts[codes[inTable], bucket]
+        beyond = valid & ~inTable
+        for code in np.unique(codes[beyond]).tolist():
+            mask = beyond & (codes == code)
+            rates[mask], discounts[mask] = self.lookup(currencies[code], expiry[mask])
+        return rates, discounts
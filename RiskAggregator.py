@@ -0,0 +1,155 @@
+import threading
+
+import numpy as np
+
+from CurrencyOption import CurrencyOption
+from Metrics import metrics
+
+
+class RiskAggregator:
+    """Net delta, gamma, vega and theta of the open positions, per currency pair, per currency and per expiry.
+    Each contract adds size times its own Greeks to the totals of its buckets; when its size or Greeks change,
+    only the difference is added, so an update costs the same however many positions are open.
+    A long EUR/USD binary counts towards EUR and, with the opposite sign, towards USD.
+
+    To add up across pairs the Greeks are in dollars: delta per 1% move of the underlying, gamma as the change
+    of that delta per 1% move, vega per volatility point and theta per day (see BinaryPricer for the raw ones).
+    The Greeks come from an OptionBook (see refresh), or are set one contract at a time with setGreeks.
+    limits maps a field to the largest absolute total any bucket may reach; allows() checks an order against it.
+
+    Positions are set from the PositionMonitor thread and Greeks from the main thread and the strategy workers,
+    so every update and every read of the totals holds lock; a lost update would stay in the totals for good.
+    Markets whose names do not parse as a single binary, such as spreads, are held but counted in no bucket."""
+
+    fields = ('delta', 'gamma', 'vega', 'theta')
+
+    def __init__(self, book=None, limits=None):
+        self.book = book
+        self.limits = limits or {}
+        self.sizes = {}  # Contract name to signed size.
+        self.greeks = {}  # Contract name to its Greeks per contract, in the order of fields.
+        self.bucketKeys = {}  # Contract name to ((bucket, sign), ...).
+        self.totals = {}  # ('pair', 'EUR/USD'), ('currency', 'EUR') or ('expiry', '(3PM)') to the net Greeks.
+        self.lock = threading.RLock()
+
+    def bucketsOf(self, name):
+        if name not in self.bucketKeys:
+            try:
+                strike, countries = CurrencyOption.parseName(name)
+                self.bucketKeys[name] = ((('pair', "/".join(countries)), 1), (('currency', countries[0]), 1),
+                                         (('currency', countries[1]), -1), (('expiry', name.split(" ")[-1]), 1))
+            except (ValueError, IndexError):
+                print("\nNot counted in the risk totals, not a binary:", name)
+                metrics.increment('risk.unparsed')
+                self.bucketKeys[name] = ()
+        return self.bucketKeys[name]
+
+    @staticmethod
+    def dollarGreeks(delta, gamma, vega, theta, underlying):
+        """Converts the Greeks of BinaryPricer.compute (numbers or arrays) to the units of the totals."""
+
+        return delta*underlying/100, gamma*underlying*underlying/10000, vega/100, theta/365
+
+    def apply(self, name, size, greeks):
+        """Moves one contract to a new size and Greeks, adding the difference to each of its buckets."""
+
+        with self.lock:
+            oldSize = self.sizes.get(name, 0.0)
+            oldGreeks = self.greeks.get(name, (0.0,)*len(self.fields))
+            change = [size*new - oldSize*old for new, old in zip(greeks, oldGreeks)]
+            for bucket, sign in self.bucketsOf(name):
+                total = self.totals.setdefault(bucket, [0.0]*len(self.fields))
+                for i, value in enumerate(change):
+                    total[i] += sign*value
+            if size:
+                self.sizes[name] = size
+            else:
+                self.sizes.pop(name, None)
+            self.greeks[name] = tuple(greeks)
+        metrics.increment('risk.updates')
+
+    def setPosition(self, name, size):
+        """Sets the signed size held in one contract (0 once it is closed)."""
+
+        with self.lock:
+            self.apply(name, size, self.greeks.get(name, (0.0,)*len(self.fields)))
+
+    def setGreeks(self, name, delta, gamma, vega, theta, underlying):
+        """Sets the Greeks of one contract, as BinaryPricer.compute returns them."""
+
+        greeks = self.dollarGreeks(delta, gamma, vega, theta, underlying)
+        with self.lock:
+            self.apply(name, self.sizes.get(name, 0.0), greeks)
+
+    def refresh(self, names=None):
+        """Takes the Greeks of the held contracts (or of names) from the book, in one vectorized call."""
+
+        book = self.book
+        if book is None:
+            return
+        with self.lock:
+            names = [name for name in (list(self.sizes) if names is None else names) if name in book]
+            if not names:
+                return
+            rows = np.array([book.rows[name] for name in names])
+            greeks = book.binaryGreeks(rows)
+            columns = self.dollarGreeks(greeks['delta'], greeks['gamma'], greeks['vega'], greeks['theta'],
+                                        book.underlying[rows])
+            for name, values in zip(names, zip(*[np.nan_to_num(column).tolist() for column in columns])):
+                self.apply(name, self.sizes.get(name, 0.0), values)
+
+    def rebuild(self):
+        """Adds every total up again from the positions, clearing any rounding the differences built up."""
+
+        with self.lock:
+            self.totals = {}
+            for name, size in self.sizes.items():
+                for bucket, sign in self.bucketsOf(name):
+                    total = self.totals.setdefault(bucket, [0.0]*len(self.fields))
+                    for i, value in enumerate(self.greeks.get(name, (0.0,)*len(self.fields))):
+                        total[i] += sign*size*value
+
+    def total(self, kind, key):
+        """Net Greeks of one bucket, e.g. total('pair', 'EUR/USD'), total('currency', 'JPY')
+        or total('expiry', '(3PM)')."""
+
+        with self.lock:
+            return dict(zip(self.fields, self.totals.get((kind, key), [0.0]*len(self.fields))))
+
+    def whatIf(self, name, size, greeks=None):
+        """The totals of every bucket of name if size more contracts were held, without changing anything.
+        greeks (in the units of the totals) is only needed for a contract that is not in the book."""
+
+        with self.lock:
+            if greeks is None and name not in self.greeks:
+                self.refresh([name])
+            greeks = greeks if greeks is not None else self.greeks.get(name, (0.0,)*len(self.fields))
+            return {bucket: {field: total + sign*size*value
+                             for field, total, value in zip(self.fields,
+                                                            self.totals.get(bucket, [0.0]*len(self.fields)), greeks)}
+                    for bucket, sign in self.bucketsOf(name)}
+
+    def allows(self, name, size, greeks=None):
+        """Whether buying (or, for a negative size, selling) size contracts keeps every bucket within limits.
+        An order that brings a total closer to zero is always allowed."""
+
+        if not self.limits:
+            return True
+        with self.lock:
+            for bucket, totals in self.whatIf(name, size, greeks).items():
+                current = self.total(*bucket)
+                for field, limit in self.limits.items():
+                    if abs(totals[field]) > limit and abs(totals[field]) > abs(current[field]):
+                        return False
+        return True
+
+    def report(self):
+        """Returns every non-empty bucket as a printable table."""
+
+        lines = ["%-10s %-8s %12s %12s %12s %12s" % (("Bucket", "") + self.fields)]
+        with self.lock:
+            items = sorted((bucket, tuple(totals)) for bucket, totals in self.totals.items())
+        for (kind, key), totals in items:
+            if any(totals):
+                lines.append("%-10s %-8s %12.2f %12.2f %12.2f %12.2f" % ((kind, key) + tuple(totals)))
+        return "\n".join(lines)
@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+import time
+
+from Metrics import metrics
+
+
+class SessionManager:
+    """Signs browsers in to Nadex and keeps them signed in, loading the login page only when nothing else works.
+    After every login the cookies are saved to cookiePath; the next browser (after a restart or a crash) loads
+    them and checks them with probeScript, a single script call, instead of typing the credentials again.
+
+    watch() probes the watched browsers every interval on a thread of its own and signs a browser in again
+    as soon as its session has expired, so trading carries on without a restart."""
+
+    loginUrl = "http://www.nadex.com/login.html"
+
+    # 'in' once the prices frame has loaded, 'out' on the login form and null while the page is still loading.
+    probeScript = """var doc = parent.document;
+                     if(doc.getElementById('account_id') !== null){
+                         return 'out';
+                     }
+                     var prices = parent.frames['ifrMyPrices'];
+                     if(doc.getElementById('ifrMyPrices') !== null && prices && prices.document &&
+                        prices.document.readyState === 'complete'){
+                         return 'in';
+                     }
+                     return null;"""
+
+    def __init__(self, username, password, cookiePath='session.json', timeout=30.0, pollInterval=0.05):
+        self.username = username
+        self.password = password
+        self.cookiePath = cookiePath
+        self.timeout = timeout
+        self.pollInterval = pollInterval
+        self.saveLock = threading.Lock()
+        self.watched = []  # (driver, lock) of every browser watch() keeps signed in.
+        self.callback = None
+        self.interval = 30.0
+        self.stopped = threading.Event()
+        self.worker = None
+        self.counts = {'valid': 0, 'restored': 0, 'login': 0, 'failed': 0, 'reauth': 0}
+
+    def probe(self, driver):
+        """'in', 'out' or None (still loading) for the page driver is on."""
+
+        with metrics.timer('session.probe'):
+            return driver.execute_script(self.probeScript)
+
+    def waitFor(self, driver, *states):
+        """Probes until the page is in one of states and returns that state, or None after the timeout."""
+
+        from selenium.common.exceptions import TimeoutException, WebDriverException
+        import selenium.webdriver.support.ui as ui
+
+        def reached(driver):
+            state = self.probe(driver)
+            return state if state in states else False
+
+        wait = ui.WebDriverWait(driver, self.timeout, poll_frequency=self.pollInterval,
+                                ignored_exceptions=(WebDriverException,))
+        try:
+            return wait.until(reached)
+        except TimeoutException:
+            return None
+
+    def save(self, driver):
+        saved = {'url': driver.current_url, 'saved': time.time(), 'cookies': driver.get_cookies()}
+        with self.saveLock:
+            temporary = self.cookiePath + '.tmp'
+            # The cookies sign in as well as the password does, so only the owner may read them.
+            descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(descriptor, 'w') as file:
+                json.dump(saved, file)
+            os.replace(temporary, self.cookiePath)
+
+    def restore(self, driver):
+        """Loads the saved cookies into driver and returns whether they still sign it in."""
+
+        from selenium.common.exceptions import WebDriverException
+
+        try:
+            with open(self.cookiePath) as file:
+                saved = json.load(file)
+            url, cookies = saved['url'], saved['cookies']
+        except (OSError, ValueError, KeyError, TypeError):  # No file, or a stale or partly written one.
+            return False
+
+        now = time.time()
+        with metrics.timer('session.restore'):
+            driver.get(url)  # Cookies can only be added for the site the browser is on.
+            for cookie in cookies:
+                if cookie.get('expiry', now + 1) <= now:
+                    continue
+                try:
+                    driver.add_cookie(cookie)
+                except WebDriverException:  # E.g. a cookie of another domain.
+                    continue
+            driver.get(url)
+            return self.waitFor(driver, 'in', 'out') == 'in'
+
+    def login(self, driver):
+        """Signs driver in through the login page, saves its cookies and returns whether it worked."""
+
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.common.keys import Keys
+
+        with metrics.timer('session.login'):
+            driver.get(self.loginUrl)
+            if self.waitFor(driver, 'in', 'out') == 'out':
+                driver.find_element(By.ID, "account_id").send_keys(self.username)
+                elem = driver.find_element(By.ID, "password")
+                elem.send_keys(self.password)
+                elem.send_keys(Keys.RETURN)
+            if self.waitFor(driver, 'in') is None:
+                return False
+        try:
+            self.save(driver)
+        except OSError as error:  # Still signed in; only the next start has to log in again.
+            print("\nCould not save the session cookies:", error)
+        return True
+
+    def ensure(self, driver):
+        """Makes sure driver is signed in, as cheaply as possible. Returns 'valid' if it already was,
+        'restored' if the saved cookies were enough, 'login' after a full login, or None if that failed too."""
+
+        if self.probe(driver) == 'in':
+            how = 'valid'
+        elif self.restore(driver):
+            how = 'restored'
+        elif self.login(driver):
+            how = 'login'
+        else:
+            how = None
+        self.counts[how or 'failed'] += 1
+        return how
+
+    def watch(self, driver, lock=None, interval=30.0, callback=None):
+        """Keeps driver signed in from a background thread, probing it every interval seconds.
+        lock is held while probing and signing in again; pass the lock every other user of driver takes
+        (NadexSearch.driverLock or the lock of a SessionPool session), so a re-login never cuts into their work.
+        callback(driver) is called after each time driver had to be signed in again."""
+
+        self.watched.append((driver, lock or threading.Lock()))
+        self.interval = interval
+        self.callback = callback
+        if self.worker is None:
+            self.stopped.clear()
+            self.worker = threading.Thread(target=self.run, daemon=True)
+            self.worker.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+
+    def run(self):
+        from selenium.common.exceptions import WebDriverException
+
+        while not self.stopped.wait(self.interval):
+            for driver, lock in list(self.watched):
+                try:
+                    with lock:
+                        # A page that is still loading is given time to settle before it counts as signed out.
+                        if self.waitFor(driver, 'in', 'out') == 'in':
+                            continue
+                        how = self.ensure(driver)
+                    self.counts['reauth'] += 1
+                    metrics.increment('session.reauth')
+                    if how is not None and self.callback is not None:
+                        self.callback(driver)
+                except WebDriverException:
+                    metrics.increment('session.errors')
+                except Exception as error:  # E.g. an OSError saving the cookies; the next round tries again.
+                    metrics.increment('session.errors')
+                    print("\nCould not keep the session signed in:", repr(error))
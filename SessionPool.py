@@ -0,0 +1,150 @@
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Lock
+import os
+import time
+
+from Metrics import metrics
+
+
+class Session:
+    """One browser session. Data sessions read the rows of their shard of currency pairs (all rows for None),
+    optionally from their own watchlist; the order session only places orders."""
+
+    def __init__(self, driver, pairs=None, watchlist=None, lock=None):
+        self.driver = driver
+        self.pairs = pairs
+        self.watchlist = watchlist  # Position in the watchlist drop-down, or None to keep the current one.
+        self.lock = lock if lock is not None else Lock()  # A WebDriver session runs one command at a time.
+        self.latency = 0.0
+
+    def selectWatchlist(self):
+        if self.watchlist is None:
+            return
+        from selenium.webdriver.common.by import By
+        with self.lock:
+            self.driver.find_element(By.ID, "selectWatchlist_currVal").click()
+            self.driver.find_element(By.XPATH, '//*[@id="selectWatchlist_ddScroll"]/ul/li[%d]' % self.watchlist).click()
+
+    def read(self, script):
+        start = time.time()
+        with self.lock:
+            table = self.driver.execute_script(script, self.pairs)
+        self.latency = time.time() - start
+        return table
+
+
+class SessionPool:
+    """Splits the watchlist across several browser sessions and merges what they read into one snapshot,
+    so scrape latency no longer grows with the whole watchlist; orders get a session of their own,
+    so a slow order ticket does not hold up market data.
+
+    driverFactory makes a WebDriver (e.g. webdriver.Firefox, or FakeDriver offline). The currency pairs are
+    dealt round-robin over dataSessions shards; watchlists optionally gives each data session its own watchlist.
+    lockFactory makes the lock of each session. The default multiprocessing Lock also keeps a forked process,
+    such as NadexSearch.priceHistory, off a session that is busy in this one, as long as the pool is started first."""
+
+    # Same columns as NadexSearch.snapshotScript; rows whose pair is not in arguments[0] are left out.
+    shardScript = """var doc = window.parent.frames['ifrMyPrices'].document;
+                     var shardPairs = arguments[0];
+                     function column(className){
+                         var cells = doc.getElementsByClassName(className);
+                         var text = [];
+                         for(var i = 0; i < cells.length; i++){
+                             text.push(cells[i].textContent);
+                         }
+                         return text;
+                     }
+                     var table = {names: column('floatLeft tableIcon dealOpen'),
+                                  prices: column('price dealOpen'),
+                                  times: column('yui-dt0-col-timeToExpiry yui-dt-col-timeToExpiry yui-dt-sortable'),
+                                  indicatives: column('yui-dt0-col-underlyingIndicativePrice yui-dt-col-underlyingIndicativePrice')};
+                     if(shardPairs === null){
+                         return table;
+                     }
+                     var shard = {names: [], prices: [], times: [table.times[0]], indicatives: [table.indicatives[0]]};
+                     for(var i = 0; i < table.names.length; i++){
+                         if(shardPairs.indexOf(table.names[i].split(' ')[0]) >= 0){
+                             shard.names.push(table.names[i]);
+                             shard.prices.push(table.prices[2*i], table.prices[2*i + 1]);
+                             shard.times.push(table.times[i + 1]);
+                             shard.indicatives.push(table.indicatives[i + 1]);
+                         }
+                     }
+                     return shard;"""
+
+    def __init__(self, driverFactory, pairs, dataSessions=2, watchlists=None, orderSession=True,
+                 lockFactory=Lock):
+        self.driverFactory = driverFactory
+        self.lockFactory = lockFactory
+        self.shards = [list(pairs[n::dataSessions]) for n in range(dataSessions)] if dataSessions > 1 else [None]
+        self.watchlists = watchlists or [None]*len(self.shards)
+        self.dataSessions = []
+        self.orderSession = None
+        self.separateOrders = orderSession
+        self.executor = None
+        self.pid = None
+
+    def start(self, signIn=None):
+        """Opens every session at once. If signIn is given, each session is signed in with signIn(driver)
+        and then selects its watchlist; otherwise call selectWatchlists once they are signed in."""
+
+        def openSession(pairs, watchlist):
+            session = Session(self.driverFactory(), pairs, watchlist, self.lockFactory())
+            if signIn is not None:
+                signIn(session.driver)
+                session.selectWatchlist()
+            return session
+
+        specs = list(zip(self.shards, self.watchlists))
+        if self.separateOrders:
+            specs.append((None, None))
+        with ThreadPoolExecutor(len(specs)) as starter:
+            sessions = list(starter.map(lambda spec: openSession(*spec), specs))
+
+        self.dataSessions = sessions[:len(self.shards)]
+        self.orderSession = sessions[-1] if self.separateOrders else sessions[0]
+        return self
+
+    def selectWatchlists(self):
+        for session in self.dataSessions:
+            session.selectWatchlist()
+
+    @property
+    def orderDriver(self):
+        return self.orderSession.driver
+
+    @property
+    def drivers(self):
+        sessions = self.dataSessions + ([self.orderSession] if self.separateOrders else [])
+        return [session.driver for session in sessions]
+
+    def readTable(self):
+        """Reads every shard concurrently and returns the merged columns in the form of NadexSearch.snapshotScript.
+        A contract that shows up in more than one shard is kept once."""
+
+        if self.pid != os.getpid():  # Threads do not survive a fork, e.g. into NadexSearch.priceHistory.
+            self.executor = ThreadPoolExecutor(len(self.dataSessions))
+            self.pid = os.getpid()
+
+        tables = list(self.executor.map(lambda session: session.read(self.shardScript), self.dataSessions))
+        merged = {'names': [], 'prices': [], 'times': [''], 'indicatives': ['']}  # Title cells, like the page.
+        seen = set()
+        for table in tables:
+            for x, name in enumerate(table['names']):
+                if name in seen:
+                    continue
+                seen.add(name)
+                merged['names'].append(name)
+                merged['prices'] += table['prices'][2*x:2*x + 2]
+                merged['times'].append(table['times'][x + 1])
+                merged['indicatives'].append(table['indicatives'][x + 1])
+
+        for n, session in enumerate(self.dataSessions):
+            metrics.record('scrape.shard%d' % n, session.latency)
+        return merged
+
+    def quit(self):
+        for driver in self.drivers:
+            driver.quit()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
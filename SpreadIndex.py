@@ -0,0 +1,104 @@
+import bisect
+
+import numpy as np
+
+from Metrics import metrics
+from TapeRecorder import TapeRecorder
+from TickBuffer import TickBuffer
+
+
+class SpreadIndex:
+    """Every priced watchlist row ranked by spread (|sell - buy|), overall and per currency pair.
+    The rankings are sorted lists of (spread, row) kept up to date with bisect, so a tick only moves the rows
+    whose prices changed, and tightest(k), under(spread) and byPair(pair) cost O(log n + k) instead of a pass
+    over the whole watchlist.
+
+    update() takes snapshots in the NadexSearch.getSnapshot form; refresh() reads the latest tick of a
+    TickBuffer instead, looking only at the contracts that changed since the last refresh, so strategy code
+    can query spreads without another scrape. Query results are (name, sell, buy, spread) tuples, tightest first."""
+
+    def __init__(self, names=None):
+        self.reset(names or [])
+
+    def reset(self, names):
+        """Starts over with a new set of watchlist rows, e.g. the columns of a new TickBuffer."""
+
+        self.names = list(names)
+        self.pairs = [name.split(" ")[0] for name in self.names]
+        self.sell = np.full(len(self.names), np.nan)
+        self.buy = np.full(len(self.names), np.nan)
+        self.spreads = np.full(len(self.names), np.nan)
+        self.ranked = []
+        self.pairRanked = {pair: [] for pair in self.pairs}
+        self.seen = 0  # Ticks of the TickBuffer already applied by refresh().
+
+    def __len__(self):
+        return len(self.ranked)
+
+    def set(self, row, sell, buy):
+        """Moves one row to its new place in the rankings. Rows without both prices are left out."""
+
+        old = self.spreads[row]
+        spread = abs(sell - buy)
+        self.sell[row], self.buy[row] = sell, buy
+        if old == spread or (np.isnan(old) and np.isnan(spread)):
+            return
+        for ranked in (self.ranked, self.pairRanked[self.pairs[row]]):
+            if not np.isnan(old):
+                del ranked[bisect.bisect_left(ranked, (old, row))]
+            if not np.isnan(spread):
+                bisect.insort(ranked, (spread, row))
+        self.spreads[row] = spread
+
+    def apply(self, rows, sell, buy):
+        for row, s, b in zip(rows.tolist(), sell.tolist(), buy.tolist()):
+            self.set(row, s, b)
+        metrics.increment('spreads.updated', len(rows))
+
+    def update(self, snapshot):
+        """Applies a snapshot, moving only the rows whose prices changed."""
+
+        with metrics.timer('spreads.update'):
+            if snapshot['names'] != self.names:
+                self.reset(snapshot['names'])
+            sell = np.asarray(TapeRecorder.toFloats(snapshot['sell']), dtype=float)
+            buy = np.asarray(TapeRecorder.toFloats(snapshot['buy']), dtype=float)
+            changed = np.flatnonzero(TickBuffer.moved(self.sell, sell) | TickBuffer.moved(self.buy, buy))
+            self.apply(changed, sell[changed], buy[changed])
+
+    def refresh(self, tickBuffer):
+        """Applies the latest tick of tickBuffer, whose columns must be the rows given to reset().
+        Returns False if nothing has been written to the buffer yet, or if its columns do not match."""
+
+        if tickBuffer.contracts != len(self.names):
+            return False
+        with metrics.timer('spreads.refresh'):
+            count = tickBuffer.count
+            changed = tickBuffer.changedSince(self.seen)
+            tick = tickBuffer.latestRows(changed)
+            if tick is None:
+                return False
+            self.apply(changed, tick[1], tick[2])
+            self.seen = count
+            return True
+
+    def entries(self, ranked):
+        return [(self.names[row], float(self.sell[row]), float(self.buy[row]), spread) for spread, row in ranked]
+
+    def tightest(self, k=10, pair=None):
+        """The k rows (of one pair, if given) with the narrowest spread."""
+
+        ranked = self.ranked if pair is None else self.pairRanked.get(pair, [])
+        return self.entries(ranked[:k])
+
+    def under(self, spread, pair=None):
+        """Every row (of one pair, if given) with a spread of at most spread."""
+
+        ranked = self.ranked if pair is None else self.pairRanked.get(pair, [])
+        return self.entries(ranked[:bisect.bisect_right(ranked, (spread, len(self.names)))])
+
+    def byPair(self, pair, k=None):
+        """Every row of one pair, or its k tightest, ranked by spread."""
+
+        ranked = self.pairRanked.get(pair, [])
+        return self.entries(ranked if k is None else ranked[:k])
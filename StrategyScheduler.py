@@ -0,0 +1,133 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+
+from Metrics import Timer, metrics
+
+
+class StrategyScheduler:
+    """Runs strategy callbacks only when a new tick arrives for a contract.
+    One dispatcher thread waits on the TickBuffer and hands the contracts that moved to a bounded
+    worker pool, instead of every option spinning in its own process.
+    A contract is never evaluated twice at the same time; ticks that arrive during an evaluation
+    are folded into one follow-up evaluation on the latest data.
+    onTick, if given, is called by the dispatcher once per new tick before any contract is evaluated, for work
+    that is cheaper done for the whole watchlist at once; the options are then not refreshed one by one."""
+
+    def __init__(self, tickBuffer, workers=None, onTick=None):
+        self.tickBuffer = tickBuffer
+        self.workers = workers or os.cpu_count() or 1
+        self.onTick = onTick
+        self.executor = None
+        self.dispatcher = None
+        self.running = False
+
+        self.lock = threading.Lock()
+        self.subscriptions = {}  # Buffer column -> (option, callback)
+        self.busy = set()  # Contracts queued or being evaluated.
+        self.dirty = set()  # Contracts that ticked again while busy.
+
+        self.submitted = 0
+        self.started = 0
+        self.latency = metrics.histogram('strategy.latency')  # From the tick being recorded to the callback finishing.
+        self.evaluation = metrics.histogram('strategy.evaluation')  # Time spent in the callback itself.
+
+    def subscribe(self, option, callback):
+        """Calls callback(option) after each new tick for the option.
+        The callback returns True once it is done with the contract (e.g. after placing an order)."""
+
+        with self.lock:
+            self.subscriptions[option.index] = (option, callback)
+
+    def unsubscribe(self, index):
+        with self.lock:
+            self.subscriptions.pop(index, None)
+
+    @property
+    def queueDepth(self):
+        """Evaluations submitted to the pool but not started yet."""
+
+        return self.submitted - self.started
+
+    def stats(self):
+        return {'subscriptions': len(self.subscriptions),
+                'queueDepth': self.queueDepth,
+                'evaluations': self.evaluation.count,
+                'latency': self.latency.summary(),
+                'evaluation': self.evaluation.summary()}
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def stop(self):
+        self.running = False
+        if self.dispatcher is not None:
+            self.dispatcher.join()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+    def dispatch(self):
+        """Waits for ticks and submits the subscribed contracts that changed."""
+
+        seen = 0
+        while self.running:
+            count = self.tickBuffer.waitForTick(seen, timeout=0.5)
+            if count <= seen:
+                continue
+
+            if self.onTick is not None:
+                try:
+                    self.onTick()
+                except Exception as error:
+                    metrics.increment('strategy.errors')
+                    print("Tick error:", error)
+
+            with self.lock:
+                for index in self.tickBuffer.changedSince(seen):
+                    index = int(index)
+                    if index not in self.subscriptions:
+                        continue
+                    if index in self.busy:
+                        self.dirty.add(index)
+                    else:
+                        self.submit(index)
+            seen = count
+
+    def submit(self, index):
+        """Queues one evaluation. Must be called with self.lock held."""
+
+        self.busy.add(index)
+        self.submitted += 1
+        self.executor.submit(self.evaluate, index)
+
+    def evaluate(self, index):
+        with self.lock:
+            self.started += 1
+            option, callback = self.subscriptions.get(index, (None, None))
+
+        done = False
+        if option is not None:
+            tickTime = option.refresh() if self.onTick is None else option.tickTime
+            with Timer(self.evaluation):
+                try:
+                    done = callback(option)
+                except Exception as error:
+                    metrics.increment('strategy.errors')
+                    print("Strategy error for", option.name, error)
+            if tickTime is not None:
+                self.latency.record(time.time() - tickTime)
+
+        with self.lock:
+            self.busy.discard(index)
+            if done:
+                self.subscriptions.pop(index, None)
+                self.dirty.discard(index)
+            elif index in self.dirty and self.running:
+                self.dirty.discard(index)
+                self.submit(index)
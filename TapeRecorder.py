@@ -0,0 +1,262 @@
+from bisect import bisect_left
+import mmap
+import struct
+import time
+
+import numpy as np
+
+
+class TapeFormat:
+    """Layout of a market-data tape. Everything is little-endian.
+
+    File:   MAGIC, then blocks, then (after a clean close) an 'E' block and a 16 byte footer.
+    'D':    contract id (u16), name length (u16), name (utf-8). Written the first time a name is seen.
+    'T':    tick number (u32), timestamp (f64), row count (u16), then that many fixed-width rows.
+    'I':    entry count (u32), previous index block offset (i64, -1 for none),
+            then (tick number u32, timestamp f64, offset u64) for each tick since the previous index block.
+    'E':    last index block offset (i64), name count (u32), then the whole dictionary as 'D' entries.
+            Footer: offset of the 'E' block (u64), END.
+    A tape that was not closed cleanly has no footer and is read by scanning the blocks instead.
+    Prices are stored as f64, so they replay exactly as they were recorded; version 1 tapes (MAGIC NDXTAPE1)
+    stored sell and buy as f32 and are still read with rowV1."""
+
+    MAGIC = b'NDXTAPE2'
+    END = b'NDXTEND1'
+    row = np.dtype([('id', '<u2'), ('sell', '<f8'), ('buy', '<f8'), ('underlying', '<f8'), ('expiry', '<f4')])
+    rowV1 = np.dtype([('id', '<u2'), ('sell', '<f4'), ('buy', '<f4'), ('underlying', '<f8'), ('expiry', '<f4')])
+    rowLayouts = {b'NDXTAPE1': rowV1, MAGIC: row}  # Row layout of each version.
+    dictionary = struct.Struct('<cHH')
+    tick = struct.Struct('<cIdH')
+    index = struct.Struct('<cIq')
+    indexEntry = np.dtype([('tick', '<u4'), ('timestamp', '<f8'), ('offset', '<u8')])
+    end = struct.Struct('<cqI')
+    footer = struct.Struct('<Q8s')
+
+
+class TapeRecorder(TapeFormat):
+    """Appends every watchlist snapshot (as returned by NadexSearch.getSnapshot) to a compact binary tape.
+    One tick costs a header plus 30 bytes per contract and a single write call.
+    Every indexInterval ticks an index block is written; the file is flushed every flushInterval ticks, so a
+    crash loses at most that many, and a tape that was not closed is still read up to its last whole tick."""
+
+    def __init__(self, path, indexInterval=256, flushInterval=1):
+        self.path = path
+        self.indexInterval = indexInterval
+        self.flushInterval = flushInterval
+        self.file = open(path, 'wb')
+        self.file.write(self.MAGIC)
+        self.offset = len(self.MAGIC)
+        self.ids = {}
+        self.ticks = 0
+        self.pending = []  # Index entries not written yet.
+        self.lastIndex = -1
+        self.lastNames = None  # The watchlist rarely changes, so the id column is usually reused.
+        self.lastIds = None
+
+    def write(self, data):
+        self.file.write(data)
+        self.offset += len(data)
+
+    def contractId(self, name):
+        contractId = self.ids.get(name)
+        if contractId is None:
+            contractId = self.ids[name] = len(self.ids)
+            encoded = name.encode('utf-8')
+            self.write(self.dictionary.pack(b'D', contractId, len(encoded)) + encoded)
+        return contractId
+
+    @staticmethod
+    def toFloats(values):
+        """Unpriced cells ('-') become NaN. Arrays, e.g. from generated tapes, are taken as they are."""
+
+        if isinstance(values, np.ndarray):
+            return values
+        return [v if isinstance(v, float) else np.nan for v in values]
+
+    def record(self, snapshot):
+        names = snapshot['names']
+        if names != self.lastNames:
+            self.lastNames = list(names)
+            self.lastIds = np.array([self.contractId(name) for name in names], dtype='<u2')
+        rows = np.empty(len(names), dtype=self.row)
+        rows['id'] = self.lastIds
+        rows['sell'] = self.toFloats(snapshot['sell'])
+        rows['buy'] = self.toFloats(snapshot['buy'])
+        rows['underlying'] = self.toFloats(snapshot['indicative'])
+        rows['expiry'] = snapshot['expiry']
+
+        self.pending.append((self.ticks, snapshot['timestamp'], self.offset))
+        self.write(self.tick.pack(b'T', self.ticks, snapshot['timestamp'], len(names)) + rows.tobytes())
+        self.ticks += 1
+
+        if len(self.pending) >= self.indexInterval:
+            self.writeIndex()
+        elif self.ticks % self.flushInterval == 0:
+            self.file.flush()
+
+    def writeIndex(self):
+        entries = np.array(self.pending, dtype=self.indexEntry)
+        offset = self.offset
+        self.write(self.index.pack(b'I', len(entries), self.lastIndex) + entries.tobytes())
+        self.lastIndex = offset
+        self.pending = []
+        self.file.flush()
+
+    def close(self):
+        if self.pending:
+            self.writeIndex()
+        offset = self.offset
+        names = b''.join(self.dictionary.pack(b'D', contractId, len(name.encode('utf-8'))) + name.encode('utf-8')
+                         for name, contractId in self.ids.items())
+        self.write(self.end.pack(b'E', self.lastIndex, len(self.ids)) + names)
+        self.write(self.footer.pack(offset, self.END))
+        self.file.close()
+
+
+class TapeReplayer(TapeFormat):
+    """Memory-maps a tape and plays it back through getSnapshot(), like the live scraper.
+    With realtime=True snapshots are released at the recorded pace (divided by speed);
+    otherwise as fast as they are asked for. getSnapshot() returns None at the end of the tape."""
+
+    def __init__(self, path, realtime=False, speed=1.0):
+        self.path = path
+        self.realtime = realtime
+        self.speed = speed
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.row = self.rowLayouts.get(self.data[:len(self.MAGIC)])
+        if self.row is None:
+            raise ValueError(path + " is not a market-data tape.")
+
+        self.names = {}
+        if not self.readIndex():
+            self.scan()
+
+        self.position = 0
+        self.startTime = None
+
+    def readIndex(self):
+        """Loads tick offsets from the index chain of a cleanly closed tape. Returns False if there is none."""
+
+        if len(self.data) < len(self.MAGIC) + self.footer.size:
+            return False
+        endOffset, end = self.footer.unpack_from(self.data, len(self.data) - self.footer.size)
+        if end != self.END:
+            return False
+
+        kind, lastIndex, count = self.end.unpack_from(self.data, endOffset)
+        offset = endOffset + self.end.size
+        for _ in range(count):
+            offset = self.readDictionary(offset)
+
+        chunks = []
+        while lastIndex >= 0:
+            kind, count, previous = self.index.unpack_from(self.data, lastIndex)
+            chunks.append(np.frombuffer(self.data, dtype=self.indexEntry, count=count, offset=lastIndex + self.index.size))
+            lastIndex = previous
+        entries = np.concatenate(chunks[::-1]) if chunks else np.empty(0, dtype=self.indexEntry)
+        self.tickOffsets = entries['offset'].astype(np.int64)
+        self.tickTimes = entries['timestamp'].copy()
+        return True
+
+    def scan(self):
+        """Walks every block; used for tapes whose recorder did not close them (e.g. after a crash)."""
+
+        offsets = []
+        times = []
+        offset = len(self.MAGIC)
+        size = len(self.data)
+        while offset < size:
+            kind = self.data[offset:offset + 1]
+            if kind == b'D':
+                if offset + self.dictionary.size > size:
+                    break
+                if offset + self.dictionary.size + self.dictionary.unpack_from(self.data, offset)[2] > size:
+                    break  # Partly written name.
+                offset = self.readDictionary(offset)
+            elif kind == b'T':
+                if offset + self.tick.size > size:
+                    break
+                nextOffset = offset + self.tickSize(offset)
+                if nextOffset > size:
+                    break  # Partly written last tick.
+                offsets.append(offset)
+                times.append(self.tick.unpack_from(self.data, offset)[2])
+                offset = nextOffset
+            elif kind == b'I':
+                if offset + self.index.size > size:
+                    break
+                kind, count, previous = self.index.unpack_from(self.data, offset)
+                if offset + self.index.size + count*self.indexEntry.itemsize > size:
+                    break  # Partly written index; every tick it lists was found above.
+                offset += self.index.size + count*self.indexEntry.itemsize
+            else:
+                break
+        self.tickOffsets = np.array(offsets, dtype=np.int64)
+        self.tickTimes = np.array(times, dtype=float)
+
+    def readDictionary(self, offset):
+        kind, contractId, length = self.dictionary.unpack_from(self.data, offset)
+        start = offset + self.dictionary.size
+        self.names[contractId] = self.data[start:start + length].decode('utf-8')
+        return start + length
+
+    def tickSize(self, offset):
+        return self.tick.size + self.tick.unpack_from(self.data, offset)[3]*self.row.itemsize
+
+    def __len__(self):
+        return len(self.tickOffsets)
+
+    def rows(self, i):
+        """Returns the raw record array of tick i (a view into the memory map) and its timestamp."""
+
+        offset = int(self.tickOffsets[i])
+        kind, number, timestamp, count = self.tick.unpack_from(self.data, offset)
+        return np.frombuffer(self.data, dtype=self.row, count=count, offset=offset + self.tick.size), timestamp
+
+    def snapshot(self, i):
+        """Returns tick i in the same form as NadexSearch.getSnapshot, with '-' for unpriced cells."""
+
+        rows, timestamp = self.rows(i)
+        return {'names': [self.names[int(c)] for c in rows['id']],
+                'sell': [float(v) if v == v else '-' for v in rows['sell']],
+                'buy': [float(v) if v == v else '-' for v in rows['buy']],
+                'expiry': rows['expiry'].astype(float),
+                'indicative': [float(v) if v == v else '-' for v in rows['underlying']],
+                'timestamp': timestamp,
+                'latency': 0.0}
+
+    def seek(self, timestamp):
+        """Moves playback to the first tick recorded at or after timestamp."""
+
+        self.position = bisect_left(self.tickTimes, timestamp)
+        self.startTime = None
+
+    def peekSnapshot(self):
+        """Returns the next snapshot without moving playback on, or None at the end of the tape."""
+
+        return self.snapshot(self.position) if self.position < len(self) else None
+
+    def getSnapshot(self):
+        if self.position >= len(self):
+            return None
+
+        if self.realtime:
+            if self.startTime is None:
+                self.startTime = (time.time(), self.tickTimes[self.position])
+            due = self.startTime[0] + (self.tickTimes[self.position] - self.startTime[1])/self.speed
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        snapshot = self.snapshot(self.position)
+        self.position += 1
+        return snapshot
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.snapshot(i)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
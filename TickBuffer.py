@@ -0,0 +1,181 @@
+from multiprocessing import Condition, shared_memory
+import time
+
+import numpy as np
+
+
+class TickBuffer:
+    """Fixed-capacity ring buffer of watchlist ticks kept in shared memory.
+    Each column (timestamp, sell, buy, underlying, expiry) is a (capacity, contracts) block of floats.
+    Every row is written twice, at row and row + capacity, so the latest n ticks are always one
+    contiguous slice and can be handed out as NumPy views without copying.
+    Other processes attach by name (or simply receive the buffer as a Process argument).
+    For every contract the buffer also remembers the tick at which sell, buy or underlying last changed,
+    so consumers can wake up on new ticks and only look at the contracts that moved."""
+
+    columns = ('timestamp', 'sell', 'buy', 'underlying', 'expiry')
+    HEADER = 4  # count, capacity, contracts, sequence
+
+    def __init__(self, contracts, capacity=4096, name=None, create=True, newTick=None):
+        self.contracts = contracts
+        self.capacity = capacity
+
+        size = 8*(self.HEADER + contracts + len(self.columns)*2*capacity*contracts)
+        if create:
+            self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+
+        self.header = np.ndarray((self.HEADER,), dtype=np.int64, buffer=self.memory.buf)
+        self.changed = np.ndarray((contracts,), dtype=np.int64, buffer=self.memory.buf, offset=8*self.HEADER)
+        self.data = np.ndarray((len(self.columns), 2*capacity, contracts), dtype=np.float64,
+                               buffer=self.memory.buf, offset=8*(self.HEADER + contracts))
+        # Only shared with processes started after the buffer was made, or forked after newTick was;
+        # attached buffers without one poll instead.
+        self.newTick = Condition() if newTick is None and create else newTick
+        if create:
+            self.header[:] = (0, capacity, contracts, 0)
+            self.changed.fill(0)
+            self.data.fill(np.nan)
+
+    @classmethod
+    def attach(cls, name, newTick=None):
+        """Opens a buffer created by another process, waking on newTick if it was passed the same Condition."""
+
+        memory = shared_memory.SharedMemory(name=name)
+        count, capacity, contracts, sequence = np.ndarray((cls.HEADER,), dtype=np.int64, buffer=memory.buf)
+        memory.close()
+        return cls(int(contracts), int(capacity), name=name, create=False, newTick=newTick)
+
+    def __getstate__(self):
+        return {'name': self.name, 'newTick': self.newTick}
+
+    def __setstate__(self, state):
+        attached = self.attach(state['name'])
+        self.__dict__.update(attached.__dict__)
+        self.newTick = state['newTick']
+
+    @property
+    def count(self):
+        """Number of ticks written since the buffer was created."""
+
+        return int(self.header[0])
+
+    @property
+    def sequence(self):
+        """Odd while a tick is being written, even otherwise."""
+
+        return int(self.header[3])
+
+    @staticmethod
+    def moved(old, new):
+        """Elementwise old != new, except that NaN never equals itself, so cells that stay unpriced
+        do not count as moves."""
+
+        return (old != new) & ~(np.isnan(old) & np.isnan(new))
+
+    def append(self, timestamp, sell, buy, underlying, expiry):
+        """Writes one tick. Values that are not numbers (e.g. '-') are stored as NaN."""
+
+        count = self.count
+        row = count % self.capacity
+        previous = (count - 1) % self.capacity
+        self.header[3] += 1
+        moved = np.zeros(self.contracts, dtype=bool)
+        for c, values in enumerate((timestamp, sell, buy, underlying, expiry)):
+            values = self.toFloats(values)
+            if self.columns[c] in ('sell', 'buy', 'underlying'):
+                old = self.data[c, previous]
+                moved |= self.moved(old, values)
+            self.data[c, row] = values
+            self.data[c, row + self.capacity] = values
+        self.changed[moved | (count == 0)] = count + 1
+        self.header[0] += 1
+        self.header[3] += 1
+
+        if self.newTick is not None:
+            with self.newTick:
+                self.newTick.notify_all()
+
+    def waitForTick(self, seen, timeout=None):
+        """Blocks until more than seen ticks have been written or timeout (seconds) passes.
+        Returns the current tick count."""
+
+        if self.newTick is not None:
+            with self.newTick:
+                self.newTick.wait_for(lambda: self.count > seen, timeout)
+        else:
+            deadline = None if timeout is None else time.time() + timeout
+            while self.count <= seen and (deadline is None or time.time() < deadline):
+                time.sleep(0.001)
+        return self.count
+
+    def changedSince(self, seen):
+        """Returns the indices of contracts whose sell, buy or underlying changed after tick number seen."""
+
+        return np.flatnonzero(self.changed > seen)
+
+    def toFloats(self, values):
+        """Converts a scalar or a list of cells to floats, using NaN for anything unpriced."""
+
+        if np.isscalar(values) and not isinstance(values, str):
+            return float(values)
+        return np.array([v if isinstance(v, (int, float)) else np.nan for v in values], dtype=float)
+
+    def latest(self, n=1):
+        """Returns the latest n ticks as {column: (n, contracts) view}, oldest first.
+        The views point into shared memory and change as new ticks are written."""
+
+        count = self.count
+        n = min(n, count, self.capacity)
+        end = (count - 1) % self.capacity + self.capacity + 1
+        return {column: self.data[c, end - n:end] for c, column in enumerate(self.columns)}
+
+    def latestRow(self, contract):
+        """Returns a consistent copy of (timestamp, sell, buy, underlying, expiry) for one contract,
+        or None if nothing has been written yet."""
+
+        while True:
+            sequence = self.sequence
+            count = self.count
+            if count == 0:
+                return None
+            if sequence % 2:
+                time.sleep(0)
+                continue
+            row = (count - 1) % self.capacity
+            values = tuple(float(v) for v in self.data[:, row, contract])
+            if self.sequence == sequence:
+                return values
+
+    def latestRows(self, contracts=None):
+        """Like latestRow, for many contracts at once (all of them by default):
+        returns a consistent copy of the latest tick as a (5, contracts) array, or None before the first tick."""
+
+        if contracts is None:
+            contracts = slice(None)
+        while True:
+            sequence = self.sequence
+            count = self.count
+            if count == 0:
+                return None
+            if sequence % 2:
+                time.sleep(0)
+                continue
+            values = self.data[:, (count - 1) % self.capacity, contracts].copy()
+            if self.sequence == sequence:
+                return values
+
+    def history(self, column, contract, n=None):
+        """Returns up to n of the latest values of one column for one contract (view)."""
+
+        return self.latest(self.capacity if n is None else n)[column][:, contract]
+
+    def close(self):
+        self.memory.close()
+
+    def unlink(self):
+        """Frees the shared memory. Only the creating process should call this."""
+
+        self.memory.unlink()
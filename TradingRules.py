@@ -0,0 +1,52 @@
+import numpy as np
+
+
+class TradingRules:
+    """The rules of NadexSearch.analyzeData as array predicates, so the live strategy and the
+    Backtester share one definition. Every input may be a scalar or a NumPy array of any shape
+    (e.g. time x contract); signals are 1 to buy, -1 to sell short and 0 to do nothing.
+    The rules read the Greeks of the binary itself (see BinaryPricer), the same model its volatility is implied
+    from; payout is what a binary pays in the money."""
+
+    BUY = 1
+    SELL = -1
+    NONE = 0
+
+    def __init__(self, maxSpread=5, payout=100.0):
+        self.maxSpread = maxSpread
+        self.payout = payout
+
+    def tradable(self, buy, sell):
+        """Contracts whose spread is tight enough for any rule to apply; no Greeks are needed for this."""
+
+        with np.errstate(invalid='ignore'):
+            return np.abs(np.asarray(buy, dtype=float) - np.asarray(sell, dtype=float)) <= self.maxSpread
+
+    def bands(self, strike, underlying):
+        """Returns the strike/underlying conditions: far below, at the money and just above."""
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.asarray(strike, dtype=float)/np.asarray(underlying, dtype=float)
+            return ratio <= 0.9, (ratio >= 0.995) & (ratio <= 1), (ratio >= 1) & (ratio <= 1.01)
+
+    def candidates(self, buy, sell, strike, underlying):
+        """Where a signal is possible at all, i.e. where the binary Greeks have to be known."""
+
+        farBelow, atTheMoney, justAbove = self.bands(strike, underlying)
+        return self.tradable(buy, sell) & (farBelow | atTheMoney | justAbove)
+
+    def signals(self, buy, sell, strike, underlying, value, delta):
+        """Applies the rules to the binary's value and delta; the first one that matches wins, like the if/elif chain
+        they came from. The first rule was written for a vanilla call delta, which is close to the chance of
+        finishing in the money; value/payout, the discounted chance that the binary pays out, takes its place."""
+
+        farBelow, atTheMoney, justAbove = self.bands(strike, underlying)
+        with np.errstate(invalid='ignore'):
+            chance = np.asarray(value, dtype=float)/self.payout
+            delta = np.asarray(delta, dtype=float)
+            conditions = [farBelow & (chance <= 0.5),
+                          atTheMoney & (delta > 0),
+                          atTheMoney & (delta < 0),
+                          justAbove & (delta < 0)]
+        choices = [self.SELL, self.BUY, self.SELL, self.SELL]
+        return np.where(self.tradable(buy, sell), np.select(conditions, choices, self.NONE), self.NONE).astype(np.int8)
@@ -0,0 +1,158 @@
+import time
+
+import numpy as np
+
+from Metrics import metrics
+
+
+class VolatilitySolver:
+    """Solves implied volatility for a whole watchlist at once, on NumPy arrays and with a safeguarded Newton method.
+
+    model='binary' (the default) prices contracts as the cash-or-nothing binaries they are (see BinaryPricer).
+    A binary's value falls with volatility above the forward and, below it, rises only up to a peak, so each
+    contract is solved on the branch where its value is monotonic. model='vanilla' is the original pricing of
+    CurrencyOption.calculateVolatility, exp(-r_domestic*T)*N(d1)*price/underlying, kept for comparison."""
+
+    SQRT_TWOPI = np.sqrt(2*np.pi)
+    models = ('binary', 'vanilla')
+
+    def __init__(self, low=0.01, high=300.0, maxIterations=100, model='binary', payout=100.0):
+        if model not in self.models:
+            raise ValueError("model must be 'binary' or 'vanilla'.")
+        self.low = low
+        self.high = high
+        self.maxIterations = maxIterations
+        self.model = model
+        self.payout = payout  # What a binary pays at expiry, in the units of price.
+        self.iterations = 0  # Iterations used by the last call to solve().
+
+    def branch(self, strike, underlying, expiry, r_domestic, r_foreign):
+        """Returns (direction, ceiling): direction is 1 where the value rises with volatility and -1 where it falls,
+        and ceiling is the highest volatility on that monotonic branch."""
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            drift = np.log(underlying/strike) + (r_domestic - r_foreign)*expiry
+            if self.model == 'vanilla':
+                return np.ones(drift.shape), np.full(drift.shape, self.high)
+            # Below the forward the value peaks where volatility*sqrt(expiry) = sqrt(-2*drift).
+            ceiling = np.where(drift < 0, np.sqrt(-2*drift/expiry), self.high)
+            return np.where(drift < 0, 1.0, -1.0), np.minimum(ceiling, self.high)
+
+    def middle(self, low, high):
+        """Where a bracket is split. The bracket spans decades, so binaries are split at the geometric mean."""
+
+        return np.sqrt(low*high) if self.model == 'binary' else 0.5*(low + high)
+
+    def solve(self, price, strike, underlying, expiry, r_domestic, r_foreign, precision=0.05, initial=None,
+              low=None, high=None, maxIterations=None, discount=None):
+        """Returns (volatility, d1, d2, converged) as arrays, one entry per contract.
+        converged is False where the price could not be matched within precision,
+        e.g. when the solution runs into the bracket bounds, the price is out of the model's reach
+        or an input is missing. low and high narrow the bracket (per contract if arrays);
+        by default it is [self.low, self.high]. discount is exp(-r_domestic*expiry), for callers that have it
+        already (OptionBook keeps it per row); otherwise it is computed here."""
+
+        from scipy.special import ndtr
+
+        start = time.perf_counter()
+        price, strike, underlying, expiry, r_domestic, r_foreign = np.broadcast_arrays(
+            *[np.asarray(a, dtype=float) for a in (price, strike, underlying, expiry, r_domestic, r_foreign)])
+
+        direction, ceiling = self.branch(strike, underlying, expiry, r_domestic, r_foreign)
+        low = np.broadcast_to(np.asarray(self.low if low is None else low, dtype=float), price.shape).copy()
+        high = np.broadcast_to(np.asarray(self.high if high is None else high, dtype=float), price.shape).copy()
+        high = np.fmin(high, ceiling)
+        maxIterations = self.maxIterations if maxIterations is None else maxIterations
+        binary = self.model == 'binary'
+        if initial is None:
+            volatility = self.middle(low, high)  # Same starting point as the bisection.
+        else:
+            volatility = np.clip(np.asarray(initial, dtype=float), low, high)
+            volatility = np.where(np.isfinite(volatility), volatility, self.middle(low, high))
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            sqrtExpiry = np.sqrt(expiry)
+            drift = np.log(underlying/strike) + (r_domestic - r_foreign)*expiry
+            discount = np.exp(-r_domestic*expiry) if discount is None else np.asarray(discount, dtype=float)
+            if binary:
+                scale = self.payout*discount  # value = scale * N(d2)
+            else:
+                scale = discount*price/underlying  # value = scale * N(d1)
+
+            # Contracts whose bracket closes in on the lower bound are given up. Binary volatilities are
+            # realistic (around 0.1), so only the bound itself counts for them.
+            floor = self.low if binary else 10*self.low
+            converged = np.zeros(price.shape, dtype=bool)
+            active = np.isfinite(drift) & np.isfinite(scale) & (expiry > 0)
+            if binary:
+                # Prices the bracket cannot reach are not worth iterating on.
+                active &= ((direction*self.error(low, price, strike, underlying, expiry, r_domestic, r_foreign,
+                                                 discount) <= precision) &
+                           (direction*self.error(high, price, strike, underlying, expiry, r_domestic, r_foreign,
+                                                 discount) >= -precision))
+
+            self.iterations = 0
+            work = 0
+            while active.any() and self.iterations < maxIterations:
+                self.iterations += 1
+                work += int(active.sum())
+                d1 = (drift + 0.5*volatility*volatility*expiry)/(volatility*sqrtExpiry)
+                if binary:
+                    d2 = d1 - volatility*sqrtExpiry
+                    error = scale*ndtr(d2) - price
+                    slope = -scale*np.exp(-0.5*d2*d2)/self.SQRT_TWOPI*d1/volatility
+                else:
+                    error = scale*ndtr(d1) - price
+                    slope = scale*np.exp(-0.5*d1*d1)/self.SQRT_TWOPI*(sqrtExpiry - d1/volatility)
+
+                converged |= active & (np.abs(error) <= precision)
+                # Same direction rule as the bisection, on the branch where the value is monotonic.
+                low = np.where(active & (direction*error < 0), volatility, low)
+                high = np.where(active & (direction*error > 0), volatility, high)
+                active &= ~converged & (high > floor) & (low < self.high - 0.1)
+
+                step = volatility - error/slope
+                # Newton is only trusted on the monotonic branch, otherwise it can leave the bracketed root.
+                bisect = ~(direction*slope > 0) | ~np.isfinite(step) | (step <= low) | (step >= high)
+                volatility = np.where(active, np.where(bisect, self.middle(low, high), step), volatility)
+
+            d1 = (drift + 0.5*volatility*volatility*expiry)/(volatility*sqrtExpiry)
+            d2 = d1 - volatility*sqrtExpiry
+
+        metrics.record('iv.solve', time.perf_counter() - start)
+        metrics.increment('iv.contracts', price.size)
+        metrics.increment('iv.unconverged', int(price.size - converged.sum()))
+        metrics.increment('iv.iterations', work)  # Contract-iterations, i.e. Newton/bisection steps.
+        return volatility, d1, d2, converged
+
+    def error(self, volatility, price, strike, underlying, expiry, r_domestic, r_foreign, discount=None):
+        """Model value minus price at the given volatility; the quantity solve() drives to zero."""
+
+        from scipy.special import ndtr
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            sqrtExpiry = np.sqrt(expiry)
+            d1 = (np.log(underlying/strike) + (r_domestic - r_foreign)*expiry + 0.5*volatility*volatility*expiry)/(
+                volatility*sqrtExpiry)
+            if discount is None:
+                discount = np.exp(-r_domestic*expiry)
+            if self.model == 'binary':
+                return self.payout*discount*ndtr(d1 - volatility*sqrtExpiry) - price
+            return discount*price/underlying*ndtr(d1) - price
+
+    def resolve(self, price, strike, underlying, expiry, r_domestic, r_foreign, previous, precision=0.05,
+                discount=None):
+        """Solves again for contracts that already have a volatility (previous, NaN where there is none).
+        Newton starts from the previous volatility instead of the middle of the bracket, so after a small move of
+        the inputs it takes a step or two; the bracket is still the full one, so a large move cannot strand it.
+        discount is passed on to solve(). Returns (volatility, d1, d2, converged, warm), where warm marks the
+        contracts started from previous."""
+
+        previous = np.asarray(previous, dtype=float)
+        warm = np.broadcast_to(np.isfinite(previous), np.broadcast(price, previous).shape).copy()
+        volatility, d1, d2, converged = self.solve(price, strike, underlying, expiry, r_domestic, r_foreign,
+                                                   precision, previous, discount=discount)
+
+        metrics.increment('iv.warm', int(warm.sum()))
+        metrics.increment('iv.cold', int(warm.size - warm.sum()))
+        return volatility, d1, d2, converged, warm
@@ -0,0 +1,207 @@
+import time
+
+import numpy as np
+
+from Metrics import metrics
+
+
+class Smile:
+    """A quadratic fit of volatility against log-moneyness, ln(strike/underlying), for one pair and expiry.
+    Outside the fitted strikes the wings are flat, so the quadratic cannot run away."""
+
+    def __init__(self):
+        self.coefficients = None  # (c0, c1, c2) of c0 + c1*x + c2*x**2, or None before the first fit.
+        self.low = 0.0
+        self.high = 0.0
+        self.expiry = np.nan
+        self.underlying = np.nan
+        self.points = 0
+        self.rows = None  # Book rows and volatilities the fit was made from.
+        self.fitted = None
+        self.fitTime = 0.0
+
+    def stale(self, rows, volatility, tolerance, fraction):
+        """Whether enough of the solved volatilities moved (by more than tolerance, relative) to fit again."""
+
+        if self.rows is None or not np.array_equal(rows, self.rows):
+            return True
+        with np.errstate(invalid='ignore'):
+            moved = np.abs(volatility - self.fitted) > tolerance*np.abs(self.fitted)
+        moved |= np.isnan(volatility) != np.isnan(self.fitted)
+        return moved.sum() > fraction*len(rows)
+
+    def fit(self, rows, moneyness, volatility):
+        self.rows, self.fitted = rows, volatility
+        usable = np.isfinite(moneyness) & np.isfinite(volatility)
+        x, y = moneyness[usable], volatility[usable]
+        self.points = len(x)
+        if not self.points:
+            self.coefficients = None
+            return
+        degree = min(2, len(np.unique(x)) - 1)
+        self.coefficients = np.zeros(3)
+        self.coefficients[:degree + 1] = np.polyfit(x, y, degree)[::-1]
+        self.low, self.high = x.min(), x.max()
+        self.fitTime = time.time()
+
+    def __call__(self, moneyness):
+        x = np.clip(moneyness, self.low, self.high)
+        c0, c1, c2 = self.coefficients
+        return c0 + x*(c1 + x*c2)
+
+
+class VolatilitySurface:
+    """A smooth volatility smile per (pair, expiry) fitted to the volatilities solved in an OptionBook, so that
+    neighbouring strikes get consistent volatilities and strikes that are not on the watchlist can be priced
+    without a solve.
+
+    update() only fits a smile again when more than refitFraction of its contracts moved by more than
+    tolerance (relative) since the last fit, or its contracts changed; other smiles are kept as they are.
+    Given the rows whose volatility was solved again, it does not even look at the smiles without one of them.
+    volatility() looks up any strikes and expiries at once, interpolating total variance between the
+    expiries of a pair. Expiries are the labels at the end of the contract names, such as '(3PM)'."""
+
+    def __init__(self, tolerance=0.01, refitFraction=0.2):
+        self.tolerance = tolerance
+        self.refitFraction = refitFraction
+        self.smiles = {}  # (pair, expiry label) to Smile.
+        self.groups = {}  # (pair, expiry label) to the book rows of that smile.
+        self.members = np.empty((0, 0), dtype=np.int64)  # The rows of every group, padded with -1, in groups order.
+        self.indexed = 0  # Book rows grouped so far; rows are only ever added to a book.
+        self.terms = {}  # Pair to (expiries, smiles) sorted by expiry, for lookups across expiries.
+        self.counts = {'refit': 0, 'kept': 0, 'skipped': 0}
+
+    def index(self, book):
+        groups = {}
+        for row in range(book.count):
+            groups.setdefault(("/".join(book.countries[row]), book.names[row].split(" ")[-1]), []).append(row)
+        self.groups = {key: np.array(rows) for key, rows in groups.items()}
+        self.members = np.full((len(groups), max(map(len, groups.values()), default=0)), -1, dtype=np.int64)
+        for members, rows in zip(self.members, self.groups.values()):
+            members[:len(rows)] = rows
+        self.indexed = book.count
+
+    def medians(self, column, groups):
+        """Median of column over the values that are not NaN, for the given groups (positions in self.groups)
+        at once; NaN for a group without any. np.nanmedian does the same along an axis, but far more slowly."""
+
+        values = np.sort(np.where(self.members[groups] >= 0, column[self.members[groups]], np.nan), axis=1)
+        count = (~np.isnan(values)).sum(axis=1)  # NaN sorts last.
+        middle = np.arange(len(values))
+        low = values[middle, np.maximum((count - 1)//2, 0)]
+        high = values[middle, count//2]
+        return np.where(count > 0, 0.5*(low + high), np.nan)
+
+    def update(self, book, changed=None):
+        """Brings the smiles up to date with the volatilities in book, refitting only the ones that moved.
+        changed, if given, holds the rows whose volatility may have moved since the last update (as returned by
+        OptionBook.solve); smiles without any of them are skipped. Unconverged volatilities are left out of the fits."""
+
+        with metrics.timer('surface.update'):
+            if book.count != self.indexed:
+                self.index(book)
+            keys = list(self.groups)
+            update = np.array([key not in self.smiles for key in keys], dtype=bool)
+            if changed is None:
+                update[:] = True
+            elif len(changed):
+                moved = np.zeros(book.count + 1, dtype=bool)  # The last entry is hit by the -1 padding of members.
+                moved[changed] = True
+                update |= moved[self.members].any(axis=1)
+            groups = np.flatnonzero(update)
+            skipped = len(keys) - len(groups)
+            if not len(groups):
+                self.counts = {'refit': 0, 'kept': 0, 'skipped': skipped}
+                return
+
+            refit = 0
+            solved = np.where(book.converged, book.volatility, np.nan)
+            expiries = self.medians(book.expiry, groups)
+            underlyings = self.medians(book.underlying, groups)
+            for group, expiry, underlying in zip(groups, expiries, underlyings):
+                key = keys[group]
+                rows = self.groups[key]
+                smile = self.smiles.setdefault(key, Smile())
+                volatility = solved[rows]
+                smile.expiry, smile.underlying = expiry, underlying
+                if smile.stale(rows, volatility, self.tolerance, self.refitFraction):
+                    with np.errstate(invalid='ignore', divide='ignore'):
+                        smile.fit(rows, np.log(book.strike[rows]/book.underlying[rows]), volatility)
+                    refit += 1
+
+            self.terms = {}
+            for (pair, label), smile in self.smiles.items():
+                if smile.coefficients is not None and np.isfinite(smile.expiry) and smile.expiry > 0:
+                    self.terms.setdefault(pair, []).append(smile)
+            for pair, smiles in self.terms.items():
+                smiles.sort(key=lambda smile: smile.expiry)
+                self.terms[pair] = (np.array([smile.expiry for smile in smiles]), smiles)
+
+        self.counts = {'refit': refit, 'kept': len(self.groups) - refit - skipped, 'skipped': skipped}
+        metrics.increment('surface.refits', refit)
+
+    def smileVolatility(self, pair, label, strike, underlying=None):
+        """Volatility of one smile at strike (a number or an array), or NaN if it has not been fitted."""
+
+        smile = self.smiles.get((pair, label))
+        strike = np.asarray(strike, dtype=float)
+        if smile is None or smile.coefficients is None:
+            return np.full(strike.shape, np.nan)
+        underlying = smile.underlying if underlying is None else underlying
+        return smile(np.log(strike/underlying))
+
+    def volatility(self, pair, strike, expiry, underlying=None):
+        """Volatility of pair at any strikes and expiries (years), broadcast against each other.
+        Between two expiries the total variance (volatility**2 * expiry) is interpolated linearly;
+        outside them the volatility of the nearest expiry is used. NaN if the pair has no fitted smile."""
+
+        strike, expiry = np.broadcast_arrays(np.asarray(strike, dtype=float), np.asarray(expiry, dtype=float))
+        if pair not in self.terms:
+            return np.full(strike.shape, np.nan)
+        expiries, smiles = self.terms[pair]
+        if underlying is None:
+            underlying = np.nanmedian([smile.underlying for smile in smiles])
+
+        moneyness = np.log(strike/underlying)
+        volatilities = np.array([smile(moneyness) for smile in smiles])  # (expiries, *strike.shape)
+        if len(expiries) == 1:
+            return volatilities[0]
+
+        after = np.clip(np.searchsorted(expiries, expiry), 1, len(expiries) - 1)
+        before = after - 1
+        t0, t1 = expiries[before], expiries[after]
+        v0 = np.take_along_axis(volatilities, before[None], axis=0)[0]
+        v1 = np.take_along_axis(volatilities, after[None], axis=0)[0]
+        t = np.clip(expiry, t0, t1)
+        weight = (t - t0)/(t1 - t0)
+        variance = (1 - weight)*v0*v0*t0 + weight*v1*v1*t1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sqrt(variance/t)
+
+    def residuals(self, book, rows=None):
+        """Solved minus fitted volatility of rows (default all) of book; positive means rich against the smile."""
+
+        rows = np.arange(book.count) if rows is None else np.asarray(rows)
+        fitted = np.full(len(rows), np.nan)
+        wanted = np.zeros(book.count, dtype=bool)
+        wanted[rows] = True
+        position = np.full(book.count, -1)
+        position[rows] = np.arange(len(rows))
+        for (pair, label), group in self.groups.items():
+            group = group[wanted[group]]
+            if len(group):
+                fitted[position[group]] = self.smileVolatility(pair, label, book.strike[group], book.underlying[group])
+        return np.where(book.converged[rows], book.volatility[rows], np.nan) - fitted
+
+    def report(self):
+        """Returns every smile as a printable table: expiry, points, at-the-money volatility, skew and curvature."""
+
+        lines = ["%-8s %-7s %10s %7s %10s %10s %10s" % ("Pair", "Expiry", "Years", "Points", "ATM vol", "Skew",
+                                                        "Curvature")]
+        for (pair, label), smile in sorted(self.smiles.items()):
+            if smile.coefficients is None:
+                continue
+            c0, c1, c2 = smile.coefficients
+            lines.append("%-8s %-7s %10.6f %7d %10.4f %10.2f %10.1f" % (pair, label, smile.expiry, smile.points,
+                                                                        smile(0.0), c1, c2))
+        return "\n".join(lines)
@@ -0,0 +1,57 @@
+"""Times ArbitrageScanner.update on a FakeDriver watchlist in which every contract is listed twice, and checks
+that a strike quoted on two rows is scanned at the best bid and the best offer of both.
+Run from the repository root with: python -m benchmarks.ArbitrageBenchmark"""
+
+import timeit
+
+from ArbitrageScanner import ArbitrageScanner
+from benchmarks.FakeNadex import FakeDriver
+from NadexSearch import NadexSearch
+
+
+def checkDuplicateStrikes():
+    """The 1.0850 strike is listed twice. Its second row has the best bid, which is above the 1.0840 offer;
+    its first row has the best offer, which is below the 1.0860 bid. Both violations have to be found,
+    whichever row is written last, and the first has to close once the second row's bid drops."""
+
+    low, middle, high = 'EUR/USD >1.0840 (3PM)', 'EUR/USD >1.0850 (3PM)', 'EUR/USD >1.0860 (3PM)'
+    for order in ((0, 1, 2, 3), (0, 2, 1, 3)):
+        rows = [(low, 50.0, 52.0), (middle, 40.0, 45.0), (middle, 53.0, 56.0), (high, 47.0, 49.0)]
+        rows = [rows[x] for x in order]
+        snapshot = {'names': [name for name, sell, buy in rows],
+                    'sell': [sell for name, sell, buy in rows],
+                    'buy': [buy for name, sell, buy in rows]}
+        scanner = ArbitrageScanner()
+        found = {(v['low'], v['high'], v['offer'], v['bid']) for v in scanner.update(snapshot)}
+        assert found == {(low, middle, 52.0, 53.0), (middle, high, 45.0, 47.0)}, found
+
+        snapshot = dict(snapshot, sell=[41.0 if sell == 53.0 else sell for sell in snapshot['sell']])
+        found = {(v['low'], v['high'], v['offer'], v['bid']) for v in scanner.update(snapshot)}
+        assert found == {(middle, high, 45.0, 47.0)}, found
+
+
+def run(rows=(100, 1000), ticks=50, repeat=5):
+    checkDuplicateStrikes()
+    print("Duplicate strikes: ok")
+    print("%6s %14s" % ("Rows", "update (ms)"))
+
+    for size in rows:
+        driver = FakeDriver(size)
+        nadex = NadexSearch(driver)
+        snapshots = []
+        for _ in range(ticks):
+            driver.tick()
+            snapshot = nadex.getSnapshot()
+            snapshots.append({key: snapshot[key] + snapshot[key] for key in ('names', 'sell', 'buy')})
+
+        def scan():
+            scanner = ArbitrageScanner(NadexSearch.currencyPairs)
+            for snapshot in snapshots:
+                scanner.update(snapshot)
+        update = min(timeit.repeat(scan, number=1, repeat=repeat))/ticks
+
+        print("%6d %14.4f" % (2*size, update*1e3))
+
+
+if __name__ == '__main__':
+    run()
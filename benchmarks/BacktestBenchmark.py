@@ -0,0 +1,98 @@
+"""Times the Backtester on a generated tape, by default a full day of one second ticks over a 300 contract watchlist,
+and checks that a tape cut short, as a crash leaves it, still replays every tick written in full.
+Run from the repository root with: python -m benchmarks.BacktestBenchmark [--ticks 86400] [--rows 300]"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from scipy.special import ndtr
+
+from Backtester import Backtester
+from ExpiryParser import ExpiryParser
+from TapeRecorder import TapeRecorder, TapeReplayer
+from benchmarks.FakeNadex import makeContracts, pairs
+
+
+def writeTape(path, ticks, rows, seed=0, indexInterval=256):
+    """Records a random walk of every pair and the binary prices that go with it, at a 10% volatility.
+    Each contract expires somewhere during the day and is unpriced afterwards, like on the watchlist."""
+
+    rng = np.random.default_rng(seed)
+    contracts = makeContracts(rows, seed)
+    names = [c.name for c in contracts]
+    pairIndex = {pair: x for x, pair in enumerate(pairs)}
+    column = np.array([pairIndex[c.pair] for c in contracts])
+    strike = np.array([c.strike for c in contracts])
+    expires = rng.uniform(0.1, 1.2, rows)*ticks
+    spot = np.array(list(pairs.values()))
+
+    recorder = TapeRecorder(path, indexInterval)
+    start = time.time() - ticks
+    for t in range(ticks):
+        spot *= 1 + rng.normal(0, 0.00005, len(spot))
+        underlying = spot[column]
+        seconds = expires - t
+        years = np.maximum(seconds, 1)/ExpiryParser.SECONDS_PER_YEAR
+        mid = 100*ndtr(np.log(underlying/strike)/(0.1*np.sqrt(years)) - 0.05*np.sqrt(years))
+        sell = np.clip(np.floor(mid*4)/4 - 0.75, 0.25, 98.5)
+        live = seconds > 0
+        recorder.record({'names': names,
+                         'sell': np.where(live, sell, np.nan),
+                         'buy': np.where(live, sell + 1.5, np.nan),
+                         'indicative': underlying,
+                         'expiry': np.where(live, years, np.nan),
+                         'timestamp': start + t})
+    recorder.close()
+
+
+def checkTruncated(directory):
+    """Cuts a small tape at every byte and checks that each cut replays exactly the ticks that are whole in it."""
+
+    path = os.path.join(directory, 'small.tape')
+    writeTape(path, 12, 2, indexInterval=4)
+    with open(path, 'rb') as f:
+        data = f.read()
+    replayer = TapeReplayer(path)
+    ends = replayer.tickOffsets + [replayer.tickSize(int(offset)) for offset in replayer.tickOffsets]
+    replayer.close()
+
+    cut = os.path.join(directory, 'cut.tape')
+    for size in range(len(TapeReplayer.MAGIC), len(data)):
+        with open(cut, 'wb') as f:
+            f.write(data[:size])
+        replayer = TapeReplayer(cut)
+        assert len(replayer) == (ends <= size).sum(), (size, len(replayer))
+        replayer.close()
+    os.remove(cut)
+    os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--ticks', type=int, default=86400)
+    parser.add_argument('--rows', type=int, default=300)
+    parser.add_argument('--entries', choices=('first', 'changes'), default='changes')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    checkTruncated(directory)
+    path = os.path.join(directory, 'backtest.tape')
+    start = time.perf_counter()
+    writeTape(path, args.ticks, args.rows)
+    print("Generated %d ticks x %d contracts (%.1f MB) in %.2f seconds." % (args.ticks, args.rows,
+                                                                          os.path.getsize(path)/1e6,
+                                                                          time.perf_counter() - start))
+
+    backtester = Backtester(dict(pairs), entries=args.entries)
+    start = time.perf_counter()
+    data = backtester.load(path)
+    print("Loaded in %.2f seconds." % (time.perf_counter() - start))
+    print(backtester.report(backtester.run(data), top=10))
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Compares ExpiryParser with the strptime based parsing getExpireTimes used to do.
+Run from the repository root with: python -m benchmarks.ExpiryBenchmark"""
+
+import datetime
+import random
+import time
+import timeit
+
+from ExpiryParser import ExpiryParser
+
+
+def legacyParse(timeList):
+    """The parsing loop getExpireTimes used before ExpiryParser, kept here as the baseline."""
+
+    timeList = [t.replace(" ", "") for t in timeList]
+    for x in range(0, len(timeList)):
+        if timeList[x] == '-':
+            continue
+
+        t = timeList[x]
+        if any('h' == c for c in t):
+            t = t.replace("h", "")
+            t = t.replace("m", "")
+            t = time.strptime(t, "%H:%M")
+            t = datetime.timedelta(hours=t.tm_hour, minutes=t.tm_min).total_seconds()
+
+        elif any('m' == c for c in t):
+            t = t.replace("m", "")
+            t = t.replace("s", "")
+
+            try:
+                t = time.strptime(t, "%M:%S")
+                t = datetime.timedelta(minutes=t.tm_min, seconds=t.tm_sec).total_seconds()
+            except ValueError:
+                t = "0"+t
+                t = time.strptime(t, "%M:%S")
+                t = datetime.timedelta(minutes=t.tm_min, seconds=t.tm_sec).total_seconds()
+
+        else:
+            t = t.replace("s", "")
+            t = time.strptime(t, "%S")
+            t = datetime.timedelta(seconds=t.tm_sec).total_seconds()
+
+        t /= 31536000.0
+        timeList[x] = t
+
+    return timeList
+
+
+def formatExpiry(seconds):
+    """Formats seconds the way the watchlist does."""
+
+    if seconds >= 3600:
+        return "%dh:%02dm" % (seconds//3600, (seconds % 3600)//60)
+    if seconds >= 60:
+        return "%dm:%02ds" % (seconds//60, seconds % 60)
+    return "%ds" % seconds
+
+
+def watchlistTicks(rows, ticks, seed=0):
+    """Builds the expiry column of a watchlist for consecutive ticks.
+    Contracts share a handful of expiries (hourly and daily series), so many rows carry the same string."""
+
+    rng = random.Random(seed)
+    expiries = [rng.choice((300, 1200, 2400, 3500, 7100, 14300, 28700)) + rng.randint(0, 59) for _ in range(rows)]
+    series = sorted(set(expiries))
+    column = [rng.choice(series) for _ in range(rows)]
+    snapshots = []
+    for tick in range(ticks):
+        snapshots.append(['-' if (x % 17 == 0) else formatExpiry(max(e - tick, 1)) for x, e in enumerate(column)])
+    return snapshots
+
+
+def run(rows=(10, 100, 1000), ticks=50, repeat=5):
+    print("%6s %14s %14s %14s %8s" % ("Rows", "strptime (ms)", "cold (ms)", "warm (ms)", "Warm x"))
+
+    for size in rows:
+        snapshots = watchlistTicks(size, ticks)
+        parser = ExpiryParser()
+
+        for snapshot in snapshots:
+            expected = legacyParse(snapshot)
+            actual = parser.parseAll(snapshot)
+            for e, a in zip(expected, actual):
+                assert (e == '-' and a != a) or abs(e - a) < 1e-12, (e, a)
+
+        legacy = min(timeit.repeat(lambda: [legacyParse(s) for s in snapshots], number=1, repeat=repeat))/ticks
+
+        def cold():
+            parser.cache.clear()
+            for s in snapshots:
+                parser.parseAll(s)
+        fresh = min(timeit.repeat(cold, number=1, repeat=repeat))/ticks
+
+        warm = min(timeit.repeat(lambda: [parser.parseAll(s) for s in snapshots], number=1, repeat=repeat))/ticks
+
+        print("%6d %14.4f %14.4f %14.4f %7.1fx" % (size, legacy*1e3, fresh*1e3, warm*1e3, legacy/warm))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,394 @@
+"""An offline stand-in for the Nadex platform.
+watchlistHtml builds HTML that mimics the ifrMyPrices table at any size, and FakeDriver serves it
+to NadexSearch in place of a Firefox WebDriver by emulating the scripts NadexSearch runs.
+FakeDriver also fakes the login page and the session cookie, so SessionManager can be tried offline."""
+
+from html.parser import HTMLParser
+import math
+import random
+import re
+import time
+
+pairs = {'AUD/JPY': 97.50, 'AUD/USD': 0.6650, 'EUR/GBP': 0.8550, 'EUR/JPY': 161.20, 'EUR/USD': 1.0850,
+         'GBP/JPY': 190.50, 'GBP/USD': 1.2700, 'USD/CAD': 1.3600, 'USD/CHF': 0.8800, 'USD/JPY': 149.30}
+series = (('(11AM)', 1500), ('(1PM)', 8700), ('(3PM)', 15900), ('(7PM)', 30300))
+
+nameClass = 'floatLeft tableIcon dealOpen'
+priceClass = 'price dealOpen'
+timeClass = 'yui-dt0-col-timeToExpiry yui-dt-col-timeToExpiry yui-dt-sortable'
+indicativeClass = 'yui-dt0-col-underlyingIndicativePrice yui-dt-col-underlyingIndicativePrice'
+
+
+def formatExpiry(seconds):
+    """Formats seconds the way the watchlist does."""
+
+    if seconds <= 0:
+        return '-'
+    if seconds >= 3600:
+        return "%dh:%02dm" % (seconds//3600, (seconds % 3600)//60)
+    if seconds >= 60:
+        return "%dm:%02ds" % (seconds//60, seconds % 60)
+    return "%ds" % seconds
+
+
+class Contract:
+    """One watchlist row and the state the fake market moves between ticks."""
+
+    def __init__(self, pair, strike, label, seconds, priced, rng):
+        self.pair = pair
+        self.strike = strike
+        self.label = label
+        self.seconds = seconds
+        self.priced = priced
+        self.rng = rng
+        self.spot = pairs[pair]
+        self.digits = 2 if 'JPY' in pair else 4
+        self.name = "%s >%.*f %s" % (pair, self.digits, strike, label)
+        self.mid = self.fairPrice()
+
+    def fairPrice(self):
+        """Binary price for a 10% vol, so the fixtures look like real quotes."""
+
+        years = max(self.seconds, 1)/31536000.0
+        d2 = math.log(self.spot/self.strike)/(0.1*math.sqrt(years)) - 0.05*math.sqrt(years)
+        return min(max(100*0.5*math.erfc(-d2/math.sqrt(2)), 1.0), 99.0)
+
+    def cells(self):
+        """Returns (name, sell, buy, time, indicative) as the page shows them."""
+
+        if not self.priced:
+            return self.name, '-', '-', formatExpiry(self.seconds), '-'
+        sell = math.floor(self.mid*4)/4 - 0.75
+        return (self.name, "%.2f" % max(sell, 0.25), "%.2f" % min(sell + 1.5, 100.0),
+                formatExpiry(self.seconds), "%.*f" % (self.digits + 1, self.spot))
+
+    def move(self, seconds, moveProbability):
+        self.seconds = max(self.seconds - seconds, 0)
+        if self.rng.random() < moveProbability:
+            self.spot *= 1 + self.rng.gauss(0, 0.0002)
+            self.mid = self.fairPrice()
+
+
+def makeContracts(rows, seed=0):
+    rng = random.Random(seed)
+    contracts = []
+    while len(contracts) < rows:
+        for pair, spot in pairs.items():
+            for label, seconds in series:
+                step = 0.05 if 'JPY' in pair else 0.0005
+                strike = spot + step*rng.randint(-10, 10)
+                contracts.append(Contract(pair, strike, label, seconds + rng.randint(0, 59), rng.random() > 0.05, rng))
+    rng.shuffle(contracts)
+    return contracts[:rows]
+
+
+def watchlistHtml(contracts):
+    """Renders the ifrMyPrices table. The time and indicative columns have a title cell, like the real one."""
+
+    lines = ['<html><body><table id="watchlist">',
+             '<tr><th class="%s">Name</th><th>Sell</th><th>Buy</th><th class="%s">Time to expiry</th><th class="%s">Indicative</th></tr>'
+             % ('yui-dt-col-name', timeClass, indicativeClass)]
+    for contract in contracts:
+        name, sell, buy, expiry, indicative = contract.cells()
+        lines.append('<tr><td><a class="%s">%s</a></td><td class="%s">%s</td><td class="%s">%s</td>'
+                     '<td class="%s">%s</td><td class="%s">%s</td></tr>'
+                     % (nameClass, name, priceClass, sell, priceClass, buy, timeClass, expiry, indicativeClass, indicative))
+    lines.append('</table></body></html>')
+    return "\n".join(lines)
+
+
+class FakeDocument(HTMLParser):
+    """Just enough of the DOM for NadexSearch's scripts: elements with their class tokens and textContent."""
+
+    def __init__(self, html):
+        HTMLParser.__init__(self)
+        self.elements = []  # [set of classes, text]
+        self.open = []
+        self.feed(html)
+
+    def handle_starttag(self, tag, attrs):
+        element = [set(dict(attrs).get('class', '').split()), '']
+        self.elements.append(element)
+        self.open.append(element)
+
+    def handle_endtag(self, tag):
+        if self.open:
+            self.open.pop()
+
+    def handle_data(self, data):
+        for element in self.open:
+            element[1] += data
+
+    def getElementsByClassName(self, className):
+        wanted = set(className.split())
+        return [text for classes, text in self.elements if wanted <= classes]
+
+
+class FakeElement:
+    def __init__(self, driver, text='', id=None):
+        self.driver = driver
+        self.text = text
+        self.id = id
+
+    def click(self):
+        self.driver.clicks += 1
+        if self.text:  # A watchlist link opens the order ticket of that contract.
+            self.driver.ticketName = self.text
+
+    def send_keys(self, *keys):
+        self.driver.type(self.id, "".join(keys))
+
+
+class FakeDriver:
+    """Serves a fake watchlist to NadexSearch instead of Firefox.
+    execute_script emulates the scripts NadexSearch sends, and latency adds a fixed WebDriver round trip
+    to every call. tick() moves the market forward and, once PriceObserver is installed, buffers every cell it
+    changed, the countdown of the expiry cells included, as mutations; removeContract() removes a row.
+    drainScript then gets them filtered the way the installScript observer filters them, so push mode sees
+    the same deltas and resyncs as on the real page.
+
+    The browser starts signed in unless signedIn is False, in which case it is on a blank page until it goes
+    to the site and logs in. Session ids live in FakeDriver.sessions, shared by every FakeDriver like a single
+    server, so a new FakeDriver can be signed in with the cookies of another one; expireSession() makes the
+    site forget a session. pageLoad adds that many seconds to every page load, and the login page accepts
+    only credentials, if given, as (username, password). Loading a page closes the open order ticket, if any;
+    ticketsLost counts the tickets closed that way before they were confirmed. The execute_script calls whose
+    numbers (counted in calls) are in failAt raise a JavascriptException, as scripts do on the wrong page."""
+
+    loginUrl = "http://www.nadex.com/login.html"
+    platformUrl = "http://www.nadex.com/platform.html"
+    returnKey = '\ue006'  # Keys.RETURN
+    sessions = set()  # Session ids the fake site accepts.
+
+    columnPattern = re.compile(r"(\w+): column\('([^']+)'\)")
+    classPattern = re.compile(r"getElementsByClassName\('([^']+)'\)")
+    loopStartPattern = re.compile(r"for\(var \w+ = (\d+);")
+
+    def __init__(self, rows=100, latency=0.0, seed=0, moveProbability=0.2, signedIn=True, pageLoad=0.0,
+                 credentials=None):
+        self.contracts = makeContracts(rows, seed)
+        self.latency = latency
+        self.moveProbability = moveProbability
+        self.calls = 0
+        self.clicks = 0
+        self.balance = "$10,000.00"
+        self.positions = {}  # Contract name to [signed size, open level]; orders fill straight away.
+        self.workingOrders = []  # [name, 'Buy' or 'Sell', size, level], as PositionMonitor reads them.
+        self.ticketName = None  # Contract of the open order ticket.
+        self.ticketsLost = 0
+        self.mutations = None  # [time, column or 'rows', row, text] seen by PriceObserver's observer, once installed.
+        self.resync = False
+        self.pageLoad = pageLoad
+        self.credentials = credentials
+        self.cookies = {}  # Cookie name to the cookie, as get_cookies returns them.
+        self.typed = {}  # Element id to the keys sent to it on the login page.
+        self.logins = 0
+        self.failAt = set()
+        self.page = 'blank'  # 'blank', 'login' or 'platform'.
+        self.current_url = 'about:blank'
+        if signedIn:
+            self.startSession()
+        self.render()
+
+    def startSession(self):
+        sessionId = "%016x" % random.getrandbits(64)
+        FakeDriver.sessions.add(sessionId)
+        self.cookies['JSESSIONID'] = {'name': 'JSESSIONID', 'value': sessionId, 'domain': 'www.nadex.com',
+                                      'path': '/', 'secure': False, 'httpOnly': True,
+                                      'expiry': int(time.time()) + 86400}
+        self.page, self.current_url = 'platform', self.platformUrl
+
+    def expireSession(self):
+        """Makes the site forget this browser's session, as if it had timed out."""
+
+        cookie = self.cookies.get('JSESSIONID')
+        if cookie is not None:
+            FakeDriver.sessions.discard(cookie['value'])
+
+    def authenticated(self):
+        cookie = self.cookies.get('JSESSIONID')
+        return cookie is not None and cookie['value'] in FakeDriver.sessions
+
+    def type(self, id, keys):
+        """Keys sent to an element; the return key submits the login form."""
+
+        if self.page != 'login':
+            return
+        if self.returnKey not in keys:
+            self.typed[id] = self.typed.get(id, '') + keys
+            return
+        credentials = (self.typed.get('account_id', ''), self.typed.get('password', ''))
+        self.typed = {}
+        time.sleep(self.pageLoad)
+        if self.credentials is None or credentials == tuple(self.credentials):
+            self.logins += 1
+            self.startSession()
+
+    def render(self):
+        self.document = FakeDocument(watchlistHtml(self.contracts))
+
+    def tick(self, seconds=1):
+        before = [contract.cells() for contract in self.contracts]
+        for contract in self.contracts:
+            contract.move(seconds, self.moveProbability)
+        self.render()
+
+        if self.mutations is not None:
+            now = time.time()
+            for row, contract in enumerate(self.contracts):
+                name, sell, buy, expiry, indicative = contract.cells()
+                if sell != before[row][1]:
+                    self.mutations.append([now, 'prices', 2*row, sell])
+                if buy != before[row][2]:
+                    self.mutations.append([now, 'prices', 2*row + 1, buy])
+                if expiry != before[row][3]:
+                    self.mutations.append([now, 'expiry', row + 1, expiry])
+                if indicative != before[row][4]:
+                    self.mutations.append([now, 'indicatives', row + 1, indicative])
+
+    def removeContract(self, row):
+        """Takes a row off the watchlist, as when a contract expires."""
+
+        del self.contracts[row]
+        self.render()
+        if self.mutations is not None:
+            self.mutations.append([time.time(), 'rows', row, None])
+
+    def execute_script(self, script, *args):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.calls in self.failAt:
+            from selenium.common.exceptions import JavascriptException
+            raise JavascriptException("TypeError: window.parent.frames.ifrMyPrices is undefined")
+
+        if 'account_id' in script:  # SessionManager.probeScript
+            if self.page == 'platform' and not self.authenticated():  # The site bounces an expired session.
+                self.page, self.current_url = 'login', self.loginUrl
+            return {'login': 'out', 'platform': 'in'}.get(self.page)
+
+        if 'MutationObserver' in script:  # PriceObserver.installScript
+            self.mutations = []
+            self.resync = False
+            return True
+
+        if 'ndxDeltas' in script:  # PriceObserver.drainScript
+            if self.mutations is None:
+                return None
+            mutations, self.mutations = self.mutations, []
+            deltas = []
+            for mutation in mutations:  # What the observer in PriceObserver.installScript keeps of them.
+                if mutation[1] == 'rows':
+                    self.resync = True
+                elif mutation[1] != 'expiry':
+                    deltas.append(mutation)
+            return {'deltas': deltas, 'resync': self.resync}
+
+        columns = self.columnPattern.findall(script)
+        if columns:  # NadexSearch.snapshotScript and other scripts built from its column() helper.
+            table = {key: self.document.getElementsByClassName(className) for key, className in columns}
+            if 'shardPairs' in script and args and args[0] is not None:  # SessionPool.shardScript
+                return self.shard(table, args[0])
+            return table
+
+        if 'ifrOpenPositions' in script:  # PositionMonitor.readScript
+            orders = [[str(cell) for cell in order] for order in self.workingOrders]
+            return {'balance': self.balance, 'positions': self.positionRows(), 'orders': orders}
+
+        if 'rsrcBalance' in script:
+            return self.balance
+
+        if "getElementById('btnSubmit').click()" in script and self.ticketName is not None:  # OrderPipeline.fillScript
+            self.fill(self.ticketName, int(args[1]), args[2], float(args[3]))
+            return True
+
+        if 'betslipBtnClose' in script:  # OrderPipeline.confirmScript closes the ticket.
+            self.ticketName = None
+            return True
+
+        if 'ifrBetslip' in script:  # Order tickets load and confirm straight away, unless they were closed.
+            return self.ticketName is not None
+
+        classes = self.classPattern.findall(script)
+        if classes:  # The older one-column scrapes, which join textContent with commas.
+            start = self.loopStartPattern.search(script)
+            texts = self.document.getElementsByClassName(classes[0])[int(start.group(1)) if start else 0:]
+            return "".join(text + "," for text in texts)
+
+        return None
+
+    def fill(self, name, size, short, level):
+        """Fills an order at its level and settles it against the balance like Nadex collateral."""
+
+        held, openLevel = self.positions.get(name, [0, 0.0])
+        change = -size if short else size
+        if held*change > 0:
+            openLevel = (abs(held)*openLevel + size*level)/(abs(held) + size)
+        elif not held:
+            openLevel = level
+        if held + change:
+            self.positions[name] = [held + change, openLevel]
+        else:
+            self.positions.pop(name, None)
+        # Closing returns what the position is worth at level; opening pays for the new size.
+        closing = min(size, abs(held)) if held*change < 0 else 0
+        cost = (size - closing)*(100 - level if short else level) - closing*(level if short else 100 - level)
+        balance = float(self.balance.replace('$', '').replace(',', '')) - cost
+        self.balance = "${:,.2f}".format(balance)
+
+    def positionRows(self):
+        contracts = {contract.name: contract for contract in self.contracts}
+        rows = []
+        for name, (size, openLevel) in sorted(self.positions.items()):
+            cells = contracts[name].cells() if name in contracts else (name, '-', '-', '-', '-')
+            level = cells[1] if size > 0 else cells[2]  # Longs are valued at the bid, shorts at the offer.
+            try:
+                pnl = (float(level) - openLevel)*size
+            except ValueError:
+                pnl = 0.0
+            rows.append([name, 'Buy' if size > 0 else 'Sell', str(abs(size)), "%.2f" % openLevel, level,
+                         "%.2f" % pnl])
+        return rows
+
+    def shard(self, table, pairs):
+        shard = {'names': [], 'prices': [], 'times': table['times'][:1], 'indicatives': table['indicatives'][:1]}
+        for x, name in enumerate(table['names']):
+            if name.split(' ')[0] in pairs:
+                shard['names'].append(name)
+                shard['prices'] += table['prices'][2*x:2*x + 2]
+                shard['times'].append(table['times'][x + 1])
+                shard['indicatives'].append(table['indicatives'][x + 1])
+        return shard
+
+    def find_element(self, by, value):
+        """A watchlist link (By.LINK_TEXT opens its order ticket), a login field (By.ID) or any other control."""
+
+        if by == 'link text':  # By.LINK_TEXT
+            return FakeElement(self, value)
+        if by == 'id':  # By.ID
+            return FakeElement(self, id=value)
+        return FakeElement(self)
+
+    def get(self, url):
+        time.sleep(self.pageLoad)
+        if self.ticketName is not None:
+            self.ticketsLost += 1
+            self.ticketName = None
+        if 'nadex.com' not in url:
+            self.page, self.current_url = 'blank', url
+        elif self.authenticated():  # Signed in browsers go straight to the platform, even from the login page.
+            self.page, self.current_url = 'platform', self.platformUrl
+        else:
+            self.page, self.current_url = 'login', self.loginUrl
+
+    def get_cookies(self):
+        return [dict(cookie) for cookie in self.cookies.values()]
+
+    def add_cookie(self, cookie):
+        self.cookies[cookie['name']] = dict(cookie)
+
+    def delete_all_cookies(self):
+        self.cookies = {}
+
+    def quit(self):
+        pass
@@ -0,0 +1,62 @@
+"""A local stand-in for the Yahoo quote pages read by YahooRateSource.
+Serves /q?s=EURUSD=X with the same span markup, with optional latency and failures."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeRateServer:
+    """Runs in a background thread on 127.0.0.1; baseUrl is what YahooRateSource should be given."""
+
+    def __init__(self, rates, latency=0.0, failureRate=0.0, seed=0):
+        self.rates = dict(rates)
+        self.latency = latency
+        self.failureRate = failureRate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.connections = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, so pooled connections are actually reused.
+
+            def setup(self):
+                server.connections += 1
+                BaseHTTPRequestHandler.setup(self)
+
+            def do_GET(self):
+                server.requests += 1
+                time.sleep(server.latency)
+                symbol = parse_qs(urlsplit(self.path).query).get('s', [''])[0]
+                pair = symbol.replace('=X', '')
+                rate = server.rates.get(pair[:3] + '/' + pair[3:])
+                if rate is None or server.random.random() < server.failureRate:
+                    body = '<html>Quote unavailable</html>'
+                else:
+                    body = '<html><span id="yfs_l10_%s=x">%.4f</span></html>' % (pair.lower(), rate)
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.baseUrl = 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
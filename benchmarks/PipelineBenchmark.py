@@ -0,0 +1,185 @@
+"""Repeatable timings of every hot path of a tick, against FakeDriver instead of a live Nadex session.
+Run from the repository root with: python -m benchmarks.PipelineBenchmark [--output bench_output.json]
+Results are written as JSON; pass --compare with an older file to see the change per stage."""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+
+import numpy as np
+import scipy
+
+from CurrencyOption import CurrencyOption
+from OptionBook import OptionBook
+from PriceObserver import PriceObserver
+from NadexSearch import NadexSearch
+from TickBuffer import TickBuffer
+from benchmarks.FakeNadex import FakeDriver, pairs
+
+
+def timeStage(function, repeat, setup=None):
+    """Runs function repeat times and returns the median, min and max in seconds."""
+
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {'median': statistics.median(times), 'min': min(times), 'max': max(times), 'runs': repeat}
+
+
+def checkUnsupportedPair():
+    """Adding a pair without a rate curve raises KeyError and leaves the book as it was."""
+
+    book = OptionBook()
+    book.add('EUR/USD >1.0850 (3PM)', 52.0, 50.0, 1.085, 0.01, 1.0852, 0)
+    try:
+        book.add('USD/TRY >30.00 (3PM)', 52.0, 50.0, 30.0, 0.01, 30.01, 0)
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("USD/TRY has no rate curve but was added")
+    assert book.count == 1 and list(book.rows) == ['EUR/USD >1.0850 (3PM)'] and len(book.names) == 1, book.rows
+    assert book.add('EUR/USD >1.0860 (3PM)', 47.0, 45.0, 1.085, 0.01, 1.0852, 0).row == 1
+
+
+def benchmarkSize(rows, repeat, latency):
+    driver = FakeDriver(rows, latency)
+    nadex = NadexSearch(driver=driver)
+    nadex.exchangeRates = dict(pairs)
+    tickBuffer = TickBuffer(rows, capacity=1024)
+    results = {}
+
+    try:
+        results['scrape.fourCalls'] = timeStage(lambda: (nadex.getOptionNames(False), nadex.getPrices(False),
+                                                         nadex.getExpireTimes(), nadex.getIndicatives()), repeat)
+        results['scrape.snapshot'] = timeStage(nadex.getSnapshot, repeat)
+        observer = PriceObserver(nadex, heartbeat=0.0)
+        observer.install()
+        results['scrape.push'] = timeStage(observer.getSnapshot, repeat, setup=driver.tick)
+
+        times = driver.document.getElementsByClassName('yui-dt0-col-timeToExpiry')[1:]
+        results['parse.expiryCold'] = timeStage(lambda: nadex.expiryParser.parseAll(times), repeat,
+                                                setup=nadex.expiryParser.cache.clear)
+        results['parse.expiryWarm'] = timeStage(lambda: nadex.expiryParser.parseAll(times), repeat)
+
+        snapshot = nadex.getSnapshot()
+
+        def resetOptions():
+            nadex.optionList = []
+            nadex.optionBook = OptionBook(solver=nadex.volatilitySolver, rateCurve=nadex.rateCurve)
+        results['makeOptions'] = timeStage(lambda: nadex.makeOptions(tickBuffer, snapshot), repeat, setup=resetOptions)
+        options = nadex.optionList
+        book = nadex.optionBook
+
+        results['iv.perContract'] = timeStage(lambda: [o.calculateVolatility(0.05) for o in options], repeat)
+        rows = book.rowsOf(options)
+        results['iv.batch'] = timeStage(lambda: nadex.volatilitySolver.solve(book.buy[rows], book.strike[rows],
+                                                                             book.underlying[rows], book.expiry[rows],
+                                                                             book.r_domestic[rows], book.r_foreign[rows],
+                                                                             discount=book.domesticDiscount[rows]),
+                                        repeat)
+
+        def nextTick():
+            driver.tick()
+            snapshot = nadex.getSnapshot()
+            tickBuffer.append(snapshot['timestamp'], snapshot['sell'], snapshot['buy'],
+                              snapshot['indicative'], snapshot['expiry'])
+            book.refresh()
+        results['iv.incremental'] = timeStage(lambda: book.solve(rows), repeat, setup=nextTick)
+
+        def nextTickFromScratch():
+            nextTick()
+            book.incrementalVolatility.reset()
+        results['iv.full'] = timeStage(lambda: book.solve(rows), repeat, setup=nextTickFromScratch)
+
+        solved = {}
+
+        def nextSolve():
+            nextTick()
+            solved['rows'] = book.solve(rows)
+        results['surface.update'] = timeStage(lambda: nadex.volatilitySurface.update(book, solved['rows']), repeat,
+                                              setup=nextSolve)
+
+        def clearGreeks():
+            for o in options:
+                o.greeksCache = None
+        results['greeks.perContract'] = timeStage(lambda: [o.greeks() for o in options], repeat, setup=clearGreeks)
+        results['greeks.batch'] = timeStage(lambda: CurrencyOption.batchGreeks(options), repeat, setup=clearGreeks)
+
+        def tick():
+            snapshot = nadex.getSnapshot()
+            tickBuffer.append(snapshot['timestamp'], snapshot['sell'], snapshot['buy'],
+                              snapshot['indicative'], snapshot['expiry'])
+            nadex.solveTick()
+        results['tick.pipeline'] = timeStage(tick, repeat, setup=driver.tick)
+
+        placed = []
+        results['order.place'] = timeStage(lambda: placed.append(nadex.orderPipeline.submit(options[0]).wait()), repeat)
+        assert placed == ["Order placed."]*repeat, placed
+    finally:
+        tickBuffer.close()
+        tickBuffer.unlink()
+        nadex.orderPipeline.stop()
+
+    results['contracts'] = len(options)
+    return results
+
+
+def gitVersion():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, baselinePath):
+    with open(baselinePath) as f:
+        baseline = json.load(f)
+    print("\nChange against", baselinePath, "(%s)" % baseline['meta']['version'])
+    for rows, stages in results['results'].items():
+        for stage, timing in stages.items():
+            old = baseline['results'].get(rows, {}).get(stage)
+            if isinstance(timing, dict) and isinstance(old, dict) and old['median'] > 0:
+                print("%6s %-20s %8.2fx" % (rows, stage, timing['median']/old['median']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 300, 1000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0, help="Simulated WebDriver round trip, in seconds.")
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--compare', help="Earlier output file to compare against.")
+    args = parser.parse_args()
+
+    checkUnsupportedPair()
+    print("Unsupported pair: ok")
+    results = {'meta': {'version': gitVersion(), 'time': time.time(), 'python': platform.python_version(),
+                        'numpy': np.__version__, 'scipy': scipy.__version__, 'latency': args.latency,
+                        'repeat': args.repeat},
+               'results': {}}
+
+    print("%6s %-20s %12s %12s" % ("Rows", "Stage", "median ms", "min ms"))
+    for rows in args.sizes:
+        stages = benchmarkSize(rows, args.repeat, args.latency)
+        results['results'][str(rows)] = stages
+        for stage, timing in stages.items():
+            if isinstance(timing, dict):
+                print("%6d %-20s %12.3f %12.3f" % (rows, stage, 1e3*timing['median'], 1e3*timing['min']))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print("\nWrote", args.output)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
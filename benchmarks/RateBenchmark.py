@@ -0,0 +1,64 @@
+"""Compares the old one-pair-at-a-time exchange rate fetching with ExchangeRateProvider,
+against a local FakeRateServer. Run from the repository root with: python -m benchmarks.RateBenchmark"""
+
+import re
+import time
+import urllib.request
+
+from ExchangeRates import ExchangeRateProvider, YahooRateSource
+from benchmarks.FakeRateServer import FakeRateServer
+
+pairs = ('AUD/JPY', 'AUD/USD', 'EUR/GBP', 'EUR/JPY', 'EUR/USD',
+         'GBP/JPY', 'GBP/USD', 'USD/CAD', 'USD/CHF', 'USD/JPY')
+rates = dict(zip(pairs, (78.1, 0.66, 0.85, 161.2, 1.08, 190.5, 1.27, 1.36, 0.88, 149.3)))
+
+
+def legacyFetch(baseUrl, pair):
+    """What NadexSearch.YahooExchangeRates used to do: new connection and new regex every call."""
+
+    pair = pair.replace("/", "")
+    pattern = re.compile('<span id="yfs_l10_' + pair.lower() + '=x">(.+?)</span>')
+    htmltext = urllib.request.urlopen(baseUrl + '/q?s=' + pair + '=X').read().decode("utf-8")
+    results = re.findall(pattern, htmltext)
+    try:
+        return float(results[0])
+    except IndexError:
+        return "Error."
+
+
+def legacyFetchAll(baseUrl):
+    exchangeRates = {}
+    for pair in pairs:
+        exchangeRates[pair] = legacyFetch(baseUrl, pair)
+        while exchangeRates[pair] == 'Error.':
+            exchangeRates[pair] = legacyFetch(baseUrl, pair)
+    return exchangeRates
+
+
+def run(latencies=(0.0, 0.02, 0.1), failureRate=0.2):
+    print("%10s %14s %14s %14s %12s" % ("Latency", "sequential (s)", "provider (s)", "cached (s)", "Connections"))
+
+    for latency in latencies:
+        with FakeRateServer(rates, latency, failureRate) as server:
+            start = time.perf_counter()
+            legacy = legacyFetchAll(server.baseUrl)
+            sequential = time.perf_counter() - start
+
+            server.connections = 0
+            provider = ExchangeRateProvider(YahooRateSource(server.baseUrl), backoff=0.01)
+            start = time.perf_counter()
+            fetched = provider.getRates(pairs)
+            concurrent = time.perf_counter() - start
+            connections = server.connections
+
+            start = time.perf_counter()
+            provider.getRates(pairs)
+            cached = time.perf_counter() - start
+            provider.close()
+
+            assert fetched == legacy, (fetched, legacy)
+            print("%9.0fms %14.4f %14.4f %14.6f %12d" % (latency*1e3, sequential, concurrent, cached, connections))
+
+
+if __name__ == '__main__':
+    run()
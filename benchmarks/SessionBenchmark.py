@@ -0,0 +1,109 @@
+"""Expires the session of a FakeDriver again and again while orders are placed and the watchlist is scraped
+on it, and times how long NadexSearch.keepSignedIn takes to sign it in again. Checks that every expiry was
+recovered from and that no re-login navigated away from an open order ticket, which is what
+NadexSearch.driverLock is for. Then makes one scrape of the priceHistory process fail, as it does while the page
+is on the login form, and checks that ticks still arrive afterwards, polled and pushed.
+Run from the repository root with: python -m benchmarks.SessionBenchmark"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import NadexSearch
+from benchmarks.FakeNadex import FakeDriver
+
+
+def trade(nadex, stopped, results):
+    """Keeps the browser busy like the menu and the strategies do: an order, then a scrape, until stopped."""
+
+    snapshot = nadex.getSnapshot()
+    x = next(x for x, price in enumerate(snapshot['buy']) if isinstance(price, float))
+    option = SimpleNamespace(name=snapshot['names'][x], sellPrice=snapshot['sell'][x], buyPrice=snapshot['buy'][x])
+    while not stopped.is_set():
+        results.append(nadex.orderPipeline.submit(option).wait())
+        nadex.getSnapshot()
+        time.sleep(0.001)
+
+
+def run(expiries=10, rows=100, latency=0.002, pageLoad=0.02, interval=0.05):
+    driver = FakeDriver(rows, latency, pageLoad=pageLoad)
+    nadex = NadexSearch.build(driverFactory=lambda: driver)
+    nadex.sessionManager.cookiePath = os.path.join(tempfile.mkdtemp(), 'session.json')
+    nadex.sessionManager.timeout = 5.0
+    nadex.orderPipeline.timeout = 1.0
+    recovered = threading.Event()
+    nadex.signedInAgain = lambda driver: recovered.set()
+
+    stopped = threading.Event()
+    results = []
+    trader = threading.Thread(target=trade, args=(nadex, stopped, results))
+    times = []
+    try:
+        if not nadex.signIn():
+            raise SystemExit("Could not sign in to the FakeDriver.")
+        nadex.keepSignedIn(interval)
+        trader.start()
+        for _ in range(expiries):
+            time.sleep(interval)
+            recovered.clear()
+            start = time.perf_counter()
+            driver.expireSession()
+            if not recovered.wait(10.0):
+                raise SystemExit("The expired session was not signed in again.")
+            times.append(time.perf_counter() - start)
+    finally:
+        stopped.set()
+        if trader.is_alive():
+            trader.join()
+        nadex.shutdown()
+
+    placed = results.count("Order placed.")
+    filled = sum(size for size, level in driver.positions.values())
+    print("Expiries: %d, signed in again: %d (logins: %d)" % (expiries, len(times), driver.logins))
+    print("Seconds to sign in again: median %.3f, max %.3f" % (statistics.median(times), max(times)))
+    print("Orders placed: %d, filled: %d, failed: %d, tickets lost to a re-login: %d"
+          % (placed, filled, len(results) - placed, driver.ticketsLost))
+    if driver.ticketsLost or filled != placed or not driver.authenticated():
+        raise SystemExit("A re-login interfered with an order.")
+
+
+def scrapeFailure(rows=100, latency=0.002, push=False, ticks=3):
+    """Fails the second script call of the priceHistory process and checks that ticks keep arriving."""
+
+    driver = FakeDriver(rows, latency)
+    nadex = NadexSearch.build(driverFactory=lambda: driver)
+    driver.failAt = {driver.calls + 2}  # Set before the launcher forks, so the priceHistory process has it.
+    nadex.startLauncher()
+    try:
+        tickBuffer = nadex.startPriceHistory(push=push)
+        deadline = time.time() + 10.0
+        while tickBuffer.count < ticks and time.time() < deadline:
+            time.sleep(0.01)
+        count, alive = tickBuffer.count, nadex.priceHistoryProcess.is_alive()
+    finally:
+        nadex.shutdown()
+
+    print("%s mode: %d ticks with one failed scrape, priceHistory %s"
+          % ("Push" if push else "Poll", count, "alive" if alive else "dead"))
+    if count < ticks or not alive:
+        raise SystemExit("priceHistory did not survive a failed scrape.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--expiries', type=int, default=10)
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.002, help="Seconds per WebDriver call.")
+    parser.add_argument('--page-load', type=float, default=0.02, help="Seconds per page load.")
+    args = parser.parse_args()
+    run(args.expiries, args.rows, args.latency, args.page_load)
+    for push in (False, True):
+        scrapeFailure(args.rows, args.latency, push)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Times how long NadexSearch takes to start in each mode: importing it, getting to the menu the way main() does
+(NadexSearch.start: building its components, signing in and waiting for whatever must be waited for),
+reading the first snapshot and the first tick reaching the shared TickBuffer.
+Every run is a fresh interpreter, so nothing is already imported. The browser mode runs on FakeDriver and reads
+its exchange rates from a FakeRateServer, but imports Selenium as the real one does; the pricing-only mode
+replays a generated tape.
+Run from the repository root with: python -m benchmarks.StartupBenchmark [--runs 5] [--rows 300]"""
+
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+stages = ('import', 'start', 'firstSnapshot', 'firstTick')
+
+
+def measure(mode, rows, tapePath):
+    """Runs in the fresh interpreter: starts NadexSearch in mode and returns the seconds since start per stage."""
+
+    start = time.perf_counter()
+    import NadexSearch
+    times = {'import': time.perf_counter() - start}
+
+    directory = tempfile.mkdtemp()
+    arguments = ['--cookies', os.path.join(directory, 'session.json')]
+    if mode == 'pricing-only':
+        nadex = NadexSearch.start(NadexSearch.parseArguments(arguments + ['--pricing-only', '--replay', tapePath]))
+    else:
+        importlib.import_module('selenium.webdriver')  # What build() imports to make Firefox sessions.
+        from benchmarks.FakeNadex import FakeDriver
+        from benchmarks.FakeRateServer import FakeRateServer
+        with FakeRateServer({pair: 1.0 for pair in NadexSearch.NadexSearch.currencyPairs}) as server:
+            nadex = NadexSearch.start(NadexSearch.parseArguments(arguments + ['--rate-url', server.baseUrl]),
+                                      driverFactory=lambda: FakeDriver(rows))
+    times['start'] = time.perf_counter() - start
+
+    try:
+        snapshot = nadex.replayer.peekSnapshot() if nadex.replayer is not None else nadex.getSnapshot()
+        assert snapshot and snapshot['names'], "no snapshot"
+        times['firstSnapshot'] = time.perf_counter() - start
+
+        tickBuffer = nadex.startPriceHistory()
+        while tickBuffer.count == 0:
+            time.sleep(0.001)
+        times['firstTick'] = time.perf_counter() - start
+    finally:
+        nadex.shutdown()
+    return times
+
+
+def run(mode, rows, tapePath):
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.StartupBenchmark', '--child', mode,
+                             '--rows', str(rows), '--tape', tapePath],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--rows', type=int, default=300)
+    parser.add_argument('--child', choices=('pricing-only', 'browser'), help=argparse.SUPPRESS)
+    parser.add_argument('--tape', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.rows, args.tape)))
+        return
+
+    from benchmarks.BacktestBenchmark import writeTape
+    tapePath = os.path.join(tempfile.mkdtemp(), 'startup.tape')
+    writeTape(tapePath, 100, args.rows)
+
+    print("Median seconds from start over %d runs, %d contracts:" % (args.runs, args.rows))
+    print("%-14s" % "Mode" + "".join("%15s" % stage for stage in stages))
+    for mode in ('pricing-only', 'browser'):
+        results = [run(mode, args.rows, tapePath) for _ in range(args.runs)]
+        print("%-14s" % mode + "".join("%15.3f" % statistics.median(r[stage] for r in results) for stage in stages))
+
+
+if __name__ == '__main__':
+    main()